@@ -1,58 +1,125 @@
 from flask import Flask, render_template, redirect, flash, request, make_response, jsonify, send_file
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-import zipfile
+from flask_socketio import SocketIO, emit, join_room
+import asyncssh
+import glob
 import os
-import time
 from werkzeug.utils import secure_filename
 from pyscripts.allowed_file import allowedFile, fileExtension
-from pyscripts.ex_centrifuge import (
-    uploadReads, 
-    executeCentrifuge, 
-    downloadCentrifugeReport
-)
-from pyscripts.ex_recentrifuge import (
-    executeRecentrifuge, 
-    uploadRecentrifugeScript, 
-    downloadRecentrifugeReport
-)
-from pyscripts.ex_rextract import (
-    uploadRextractScript, 
-    executeRextract, 
-    downloadRextractSequences
-)
-from pyscripts.data_visualization import (
-    createAbundancePieChart, 
-    createTSVDictionary, 
-    createUniquereadsBarChart, 
-    createSankeyChart, 
-    createNumreadsNumuniquereadsScatterChart, 
-    createGenomesizeAbundanceBarChart,
-    getMetrics
-)
+from pyscripts.chunked_upload import uploads, ChunkError
+from pyscripts.compression import compressor
+from pyscripts.chart_cache import charts
+from pyscripts.chart_service import service, ChartTimeout
+from pyscripts.data_visualization import createReport, reportChart, chartParams, CHARTS, PLOTLYJS_PATH, PLOTLYJS_VERSION
+from pyscripts.execution import backends
+from pyscripts.job_monitor import monitor
+from pyscripts.pipeline import STAGE_FUNCTIONS
+from pyscripts.progress import bus
+from pyscripts.read_store import saveUpload
+from pyscripts.report_query import queryArgs
+from pyscripts.report_registry import reports
+from pyscripts.resources import estimator
+from pyscripts.run_manager import manager, COMPLETED
+from pyscripts.upload_relay import relayForm
+from pyscripts.transfer import engine
 
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024 * 1024  # 20 GB
+app.config['TRANSFER_BLOCK_SIZE'] = 1024 * 1024  # 1 MB
+app.config['TRANSFER_MAX_REQUESTS'] = 32
+app.config['TRANSFER_PARALLELISM'] = 2
+app.config['TRANSFER_BANDWIDTH_LIMIT'] = None  # bytes/s, None for no cap
+app.config['MAX_CONCURRENT_STAGES'] = 4
+app.config['RUN_TTL'] = 24 * 3600  # seconds a finished run is kept
+app.config['STREAM_UPLOADS'] = True  # relay reads without saving them
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # 8 MB
+app.config['COMPRESS_READS'] = True  # gzip plain FASTQ while sending it
+app.config['COMPRESSION_LEVEL'] = 3
+app.config['COMPRESSION_WORKERS'] = None  # None for one per CPU
+app.config['CHART_CACHE_FOLDER'] = 'download/.charts'
+app.config['REPORT_REGISTRY_FOLDER'] = 'download/.reports'
+app.config['CHART_WORKERS'] = None  # None for one per CPU
+app.config['CHART_TIMEOUT'] = 60  # seconds, None for no limit
+app.config['PLOTLYJS_MAX_AGE'] = 365 * 24 * 3600  # 1 year, versioned URL
+app.config['EXECUTION_BACKEND'] = None  # 'slurm', 'local', None by size
+app.config['LOCAL_EXECUTION_MAX_BYTES'] = 256 * 1024 * 1024  # 256 MB
+app.config['LOCAL_EXECUTION_MAX_MEMORY'] = 16 * 1024 * 1024 * 1024  # 16 GB
+app.config['LOCAL_EXECUTION_THREADS'] = 8
+app.config['LOCAL_EXECUTION_MAX_JOBS'] = 2
+app.config['RESOURCE_HISTORY_FILE'] = 'download/.resources/history.json'
+app.config['RESOURCE_MARGIN'] = 1.5  # factor on the estimated memory and time
+app.config['SLURM_RESOURCES'] = {}  # per stage, e.g. {'rextract': {'cores': 4}}
+app.config['CENTRIFUGE_SHARD_READS'] = 50000000  # 0 to never shard
+app.config['CENTRIFUGE_MAX_SHARDS'] = 16
 CORS(app)
 socketio = SocketIO(app)
 
+# Configure the SFTP transfer engine
+engine.configure(
+    block_size = app.config['TRANSFER_BLOCK_SIZE'],
+    max_requests = app.config['TRANSFER_MAX_REQUESTS'],
+    parallelism = app.config['TRANSFER_PARALLELISM'],
+    bandwidth_limit = app.config['TRANSFER_BANDWIDTH_LIMIT']
+)
+
+# Configure the compression of the plain FASTQ files sent to the cluster
+compressor.configure(
+    enabled = app.config['COMPRESS_READS'],
+    level = app.config['COMPRESSION_LEVEL'],
+    workers = app.config['COMPRESSION_WORKERS']
+)
+
+# Keep the chunked uploads in the upload folder
+uploads.configure(upload_folder = app.config['UPLOAD_FOLDER'])
 
-# Global variables
-progress = {'state': '', 'value': 0}
-HOSTNAME = ''
-USERNAME = ''
-PASSWORD = ''
-ACCOUNT = ''
-abu_chart = None
-uni_rea_bar_chart = None
-reads_scatter_chart = None
-genomesize_abundance_bar_chart = None
-hierarchy_sunkey_chart = None
-metrics = None
-dict = {}
+# Keep the rendered charts of the reports
+charts.configure(directory = app.config['CHART_CACHE_FOLDER'])
+reports.configure(directory = app.config['REPORT_REGISTRY_FOLDER'])
+
+# Configure the rendering of the charts on a process pool
+service.configure(
+    workers = app.config['CHART_WORKERS'],
+    timeout = app.config['CHART_TIMEOUT']
+)
+
+# Version of the plotly.js bundle loaded by the report page
+app.jinja_env.globals['plotlyjs_version'] = PLOTLYJS_VERSION
+
+# Configure the background execution of the runs
+manager.configure(
+    max_concurrent = app.config['MAX_CONCURRENT_STAGES'], 
+    stages = tuple(STAGE_FUNCTIONS), 
+    run_ttl = app.config['RUN_TTL']
+)
+
+# Run the small inputs on the login node instead of through Slurm
+backends.configure(
+    backend = app.config['EXECUTION_BACKEND'], 
+    local_max_bytes = app.config['LOCAL_EXECUTION_MAX_BYTES'], 
+    local_max_memory = app.config['LOCAL_EXECUTION_MAX_MEMORY']
+)
+backends.get('local').configure(
+    threads = app.config['LOCAL_EXECUTION_THREADS'], 
+    max_jobs = app.config['LOCAL_EXECUTION_MAX_JOBS']
+)
+
+# Size the Slurm jobs from their inputs and the past jobs
+estimator.configure(
+    history_file = app.config['RESOURCE_HISTORY_FILE'], 
+    margin = app.config['RESOURCE_MARGIN'], 
+    overrides = app.config['SLURM_RESOURCES'], 
+    shard_reads = app.config['CENTRIFUGE_SHARD_READS'], 
+    max_shards = app.config['CENTRIFUGE_MAX_SHARDS']
+)
+
+# Push the progress events of each run to the Socket.IO room of the run
+bus.subscribe(
+    lambda channel, event, data: socketio.emit(event, data, to = channel)
+)
+monitor.subscribe(bus.jobState)
 
 
 @app.route("/")
@@ -63,26 +130,33 @@ def main():
 
 
 @socketio.on('progress_request')
-def emitProgress():
-    """Function to send progress data for progress bar using socket.
+def subscribeProgress(data):
+    """Function to subscribe a socket to the progress events of a run.
+
+    The current status is sent at once, the following events are pushed 
+    to the room of the run only when something changes.
     """
-    global progress
+    run = manager.get(data['run_id'])
+
+    if run is not None:
+        join_room(run.id)
+        emit('progress', run.status())
 
-    while True:
-        if progress['value'] == 100:
-            emit('progress', progress)
-            time.sleep(1)
-            break
-        else:
-            emit('progress', progress)
-            time.sleep(1)
+
+def latestReport():
+    """Get the path of the last centrifuge_report.tsv file downloaded,
+    None if there is none.
+    """
+    reports = glob.glob('download/*/centrifuge_report.tsv')
+
+    return max(reports, key=os.path.getmtime, default=None)
 
 
 @app.route('/check-report', methods=['GET'])
 def checkReportExists():
     """Check if there is already a centrifuge_report.tsv file downloaded.
     """
-    if os.path.exists('download/centrifuge_report.tsv'):
+    if latestReport() is not None:
         return jsonify({'exists': True})
     else:
         return jsonify({'exists': False})
@@ -92,11 +166,11 @@ def checkReportExists():
 def downloadReport():
     """
     """
-    # Path of the centrifuge report
-    filepath = 'download/centrifuge_report.tsv'
+    # Path of the last centrifuge report
+    filepath = latestReport()
     
     # Check if the file is present
-    if os.path.exists(filepath):
+    if filepath is not None:
         # Start download of the file
         return send_file(
             filepath, 
@@ -108,6 +182,27 @@ def downloadReport():
         return jsonify({'error': 'File non trovato.'}), 404
 
 
+@app.route("/assets/plotly-<version>.min.js")
+def plotlyScript(version):
+    """Serve the plotly.js bundle of the charts.
+
+    The URL changes with the version of the bundle, so the browser keeps
+    it in cache and loads it once for every report.
+    """
+    if version != PLOTLYJS_VERSION:
+        return jsonify({'error': 'Unknown plotly.js version'}), 404
+
+    response = send_file(
+        PLOTLYJS_PATH, 
+        mimetype = 'text/javascript', 
+        max_age = app.config['PLOTLYJS_MAX_AGE']
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
+
+
 @app.route("/centrifuge-form")
 def renderCentrifugeForm():
     """Display Centrifuge form page.
@@ -115,107 +210,309 @@ def renderCentrifugeForm():
     return render_template('cen_form.html')
 
 
+@app.route("/uploads", methods=['POST'])
+def createUpload():
+    """Function to start a chunked upload of a reads file.
+    """
+    data = request.get_json(silent = True) or {}
+
+    try:
+        size = int(data.get('size', -1))
+        if size > app.config['MAX_CONTENT_LENGTH']:
+            return jsonify({'error': "The file is too large"}), 413
+
+        upload = uploads.create(
+            data.get('filename', ''), 
+            size, 
+            int(data.get('chunk_size', app.config['UPLOAD_CHUNK_SIZE']))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(upload.status()), 201
+
+
+@app.route("/uploads/<upload_id>")
+def uploadStatus(upload_id):
+    """Function to get the chunks received of an upload, to resume it.
+    """
+    upload = uploads.get(upload_id)
+
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    return jsonify(upload.status())
+
+
+@app.route("/uploads/<upload_id>/chunks/<int:index>", methods=['PUT'])
+def uploadChunk(upload_id, index):
+    """Function to receive a chunk of an upload, checked against the 
+    SHA-256 sent in the X-Chunk-SHA256 header.
+    """
+    upload = uploads.get(upload_id)
+
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    if (request.content_length or 0) > upload.chunk_size:
+        return jsonify({'error': "The chunk is too large"}), 413
+
+    try:
+        upload.writeChunk(
+            index, 
+            request.get_data(cache = False), 
+            request.headers.get('X-Chunk-SHA256')
+        )
+    except ChunkError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return '', 204
+
+
+@app.route("/uploads/<upload_id>/complete", methods=['POST'])
+def completeUpload(upload_id):
+    """Function to end an upload once every chunk was received.
+    """
+    upload = uploads.get(upload_id)
+
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    missing = upload.complete()
+    if missing:
+        return jsonify({'error': 'Missing chunks', 'missing': missing}), 409
+
+    return jsonify(upload.status())
+
+
 @app.route("/centrifuge-form", methods=['POST'])
-async def submitCentrifugeForm():
-    """Function to get data from the form and execute Centrifuge.
+def submitCentrifugeForm():
+    """Function to get data from the form and start a run executing 
+    Centrifuge in the background.
     """
-    global progress
-    global HOSTNAME
-    global USERNAME
-    global PASSWORD
-    global ACCOUNT
-    global abu_chart
-    global uni_rea_bar_chart
-    global reads_scatter_chart
-    global genomesize_abundance_bar_chart
-    global hierarchy_sunkey_chart
-    global metrics
-    global dict
-
-    HOSTNAME = request.form['hostname']
-    USERNAME = request.form['username']
-    PASSWORD = request.form['password']
-    ACCOUNT = request.form['account']
-
-    reads_files = request.files.getlist('readsFiles')
-
-    read_type = request.form['readType']
-    domains = request.form.getlist('domains')
+    objects = None
+
+    if app.config['STREAM_UPLOADS']:
+        # Relay the reads to the cluster while they are received
+        try:
+            form, stored = relayForm(
+                request.stream, 
+                request.mimetype_params.get('boundary', ''), 
+                request.content_length or 0
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except (asyncssh.Error, OSError) as e:
+            return jsonify({
+                'error': f"Upload to the cluster failed: {e}"
+            }), 502
+
+        reads_files = [filename for filename, _ in stored]
+        objects = [object for _, object in stored] if stored else None
+    else:
+        form = request.form
+        reads_files = [
+            reads.filename for reads in request.files.getlist('readsFiles')
+        ]
+
+    # Reads sent before the form with the chunked upload API
+    completed = []
+    for upload_id in form.getlist('uploads'):
+        upload = uploads.get(upload_id)
+        if upload is None or not upload.completed:
+            return jsonify({'error': "Upload of the reads not completed"}), 400
+        completed.append(upload)
+
+    if completed:
+        reads_files = [upload.filename for upload in completed]
+
+    read_type = form['readType']
+    domains = form.getlist('domains')
 
     abs_paths = []
 
     # Check at least one domain selected
     if len(domains) == 0:
-        flash("At least one domain must be selected")
-        return redirect(request.url)
+        return jsonify({'error': "At least one domain must be selected"}), 400
 
     # Check if files are selected according to paired or single end selector
     if read_type == 'single' and len(reads_files) != 1:
-        flash("If single-end reads selected, one file must be uploaded")
-        return redirect(request.url)
+        return jsonify({
+            'error': "If single-end reads selected, one file must be uploaded"
+        }), 400
     elif read_type == 'paired' and len(reads_files) != 2:
-        flash("If paired-end reads selected, two files must be uploaded")
-        return redirect(request.url)
+        return jsonify({
+            'error': "If paired-end reads selected, two files must be uploaded"
+        }), 400
 
     # Check if the files are in the correct format (fastq or fastq.gz)
     for reads in reads_files:
-        file_ext = fileExtension(reads.filename)
+        file_ext = fileExtension(reads)
         if file_ext != 'fastq' and file_ext != 'fastq.gz':
-            flash(
-                "Selected files are in the wrong format "
-                "(accepted fastq or fastq.gz)"
-            )
-            return redirect(request.url)
+            return jsonify({
+                'error': "Selected files are in the wrong format "
+                         "(accepted fastq or fastq.gz)"
+            }), 400
+
+    if objects is not None:
+        # The reads are already on the cluster, only the names are needed
+        abs_paths = reads_files
+    elif completed:
+        # The reads are already in the upload folder
+        abs_paths = [os.path.abspath(upload.path) for upload in completed]
+    else:
+        # Upload files in the 'uploads' folder, hashing them while saving
+        for reads in request.files.getlist('readsFiles'):
+            filename = secure_filename(reads.filename)
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            saveUpload(reads, file_path)
+            
+            # Get paths of the file
+            abs_paths.append(os.path.abspath(file_path))
+
+    # Create the run and execute Centrifuge in the background
+    run = manager.create(
+        form['hostname'], 
+        form['username'], 
+        form['password'], 
+        form['account'], 
+        abs_paths, 
+        domains, 
+        pipeline = bool(form.get('pipeline')), 
+        objects = objects
+    )
+    manager.start(run, 'centrifuge', STAGE_FUNCTIONS['centrifuge'])
+
+    return jsonify(run.status()), 202
+
+
+@app.route("/runs/<run_id>")
+def runStatus(run_id):
+    """Function to get the status of a run.
+    """
+    run = manager.get(run_id)
+
+    if run is None:
+        return jsonify({'error': 'Run not found'}), 404
+
+    return jsonify(run.status())
+
+
+@app.route("/runs/<run_id>/report")
+def runReport(run_id):
+    """Function to display the report page of a run.
+    """
+    run = manager.get(run_id)
+
+    if run is None:
+        return jsonify({'error': 'Run not found'}), 404
+    if 'report' not in run.results:
+        return jsonify({'error': 'Report not ready', **run.status()}), 409
 
-    # Upload files in the 'uploads' folder
-    for reads in reads_files:
-        filename = secure_filename(reads.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        reads.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        
-        # Get paths of the file
-        abs_paths.append(os.path.abspath(file_path))
-
-    # Upload reads files in the cluster
-    progress = {'state': 'Uploading reads files', 'value': 10}
-    await uploadReads(HOSTNAME, USERNAME, PASSWORD, ACCOUNT, abs_paths)
-
-    # Execute Centrifuge on the cluster
-    progress = {'state': 'Executing Centrifuge', 'value': 60}
-    await executeCentrifuge(HOSTNAME, USERNAME, PASSWORD, domains)
-
-    # Get the Centrifuge report from the cluster
-    progress = {'state': 'Downloading Centrifuge report', 'value': 90}
-    await downloadCentrifugeReport(HOSTNAME, USERNAME, PASSWORD)
-    progress = {'state': 'Downloading Centrifuge report', 'value': 100}
-    time.sleep(3)
-
-    # Generate the dictionary from the tsv file
-    dict = createTSVDictionary('download/centrifuge_report.tsv')
-    
-    # Generate all charts from the dictionary
-    abu_chart = createAbundancePieChart(dict)
-    uni_rea_bar_chart = createUniquereadsBarChart(dict)
-    reads_scatter_chart = createNumreadsNumuniquereadsScatterChart(dict)
-    genomesize_abundance_bar_chart = createGenomesizeAbundanceBarChart(dict)
-    hierarchy_sunkey_chart = createSankeyChart(dict)
-    metrics = getMetrics(dict)
-    
     # Display report page
     return render_template(
         'report_tsv_page.html', 
-        abu_chart = abu_chart,
-        reads_scatter_chart = reads_scatter_chart,
-        uni_rea_bar_chart = uni_rea_bar_chart,
-        genomesize_abundance_bar_chart = genomesize_abundance_bar_chart,
-        hierarchy_sunkey_chart = hierarchy_sunkey_chart,
-        metrics = metrics,
         rec_button = True,
         rex_button = True,
-        dict = dict
+        run_id = run.id,
+        **run.results['report']
     )
 
 
+@app.route("/runs/<run_id>/stages/<stage>", methods=['POST'])
+def startStage(run_id, stage):
+    """Function to start Recentrifuge or Rextract on the results of 
+    a run.
+    """
+    run = manager.get(run_id)
+
+    if run is None:
+        return jsonify({'error': 'Run not found'}), 404
+    if stage not in ('recentrifuge', 'rextract'):
+        return jsonify({'error': 'Unknown stage'}), 404
+    if run.stages.get('centrifuge') != COMPLETED:
+        return jsonify({'error': 'Centrifuge not completed'}), 409
+
+    # Start the stage, unless it was already started with the pipeline
+    manager.start(run, stage, STAGE_FUNCTIONS[stage])
+
+    return jsonify(run.status()), 202
+
+
+@app.route("/runs/<run_id>/results/<stage>")
+def stageResults(run_id, stage):
+    """Function to get the results of a completed stage of a run.
+    """
+    run = manager.get(run_id)
+
+    if run is None:
+        return jsonify({'error': 'Run not found'}), 404
+    if run.stages.get(stage) != COMPLETED:
+        return jsonify({'error': 'Results not ready', **run.status()}), 409
+
+    if stage == 'centrifuge':
+        return send_file(
+            run.results['centrifuge'], 
+            as_attachment = True, 
+            download_name = 'centrifuge_report.tsv'
+        )
+    elif stage == 'recentrifuge':
+        # Display the Recentrifuge report HTML page
+        return send_file(run.results['recentrifuge'], mimetype = 'text/html')
+    else:
+        return send_file(
+            run.results['rextract'], 
+            as_attachment = True, 
+            download_name = 'cleaned_sequences.zip'
+        )
+
+
+@app.route("/reports/<report_id>/charts/<name>")
+def reportChartJSON(report_id, name):
+    """Function to get the JSON of a chart of a report, requested by the
+    report page when the chart is shown.
+
+    The taxa can be aggregated at a rank with the 'rank' argument, and 
+    the number of taxa shown chosen with the 'top' argument.
+    """
+    if name not in CHARTS:
+        return jsonify({'error': 'Unknown chart'}), 404
+    if report_id not in reports:
+        return jsonify({'error': 'Report not found'}), 404
+
+    try:
+        params = chartParams(name, request.args)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    try:
+        response = make_response(reportChart(report_id, name, params))
+    except ChartTimeout as error:
+        return jsonify({'error': str(error)}), 504
+    response.mimetype = 'application/json'
+
+    return response
+
+
+@app.route("/reports/<report_id>/rows")
+def reportRows(report_id):
+    """Function to get a page of the rows of a report, sorted and 
+    filtered, requested by the table of the report page.
+
+    The arguments are sort (a column of the report), order (asc or 
+    desc), rank, name, min_reads, min_abundance, max_abundance, offset 
+    and limit.
+    """
+    if report_id not in reports:
+        return jsonify({'error': 'Report not found'}), 404
+
+    try:
+        params = queryArgs(request.args)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    return jsonify(reports.load(report_id).query.query(**params))
+
+
 # Function to display the upload report analisys page
 @app.route("/report-analisys")
 def report():
@@ -229,14 +526,6 @@ def reportUpload():
     """Handle the post method of uploading the tsv 
     report file by the user and display report page.
     """
-    global abu_chart
-    global uni_rea_bar_chart
-    global reads_scatter_chart
-    global genomesize_abundance_bar_chart
-    global hierarchy_sunkey_chart
-    global metrics
-    global dict
-
     if 'file' not in request.files:
         flash('No file part')
         return redirect(request.url)
@@ -254,116 +543,18 @@ def reportUpload():
         file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
         flash('File successfully uploaded')
 
-        # Generate the dictionary from the tsv file
-        dict = createTSVDictionary(filepath)
-        
-        # Generate all charts from the dictionary
-        abu_chart = createAbundancePieChart(dict)
-        uni_rea_bar_chart = createUniquereadsBarChart(dict)
-        reads_scatter_chart = createNumreadsNumuniquereadsScatterChart(dict)
-        genomesize_abundance_bar_chart = createGenomesizeAbundanceBarChart(dict)
-        hierarchy_sunkey_chart = createSankeyChart(dict)
-        metrics = getMetrics(dict)
-        
         # Display report page
         return render_template(
             'report_tsv_page.html', 
-            abu_chart = abu_chart,
-            reads_scatter_chart = reads_scatter_chart,
-            uni_rea_bar_chart = uni_rea_bar_chart,
-            genomesize_abundance_bar_chart = genomesize_abundance_bar_chart,
-            hierarchy_sunkey_chart = hierarchy_sunkey_chart,
-            metrics = metrics,
             rec_button = False,
             rex_button = False,
-            dict = dict
+            **createReport(filepath)
         )
     else:
         flash('Allowed file type is TSV')
         return redirect(request.url)
 
 
-@app.route("/recentrifuge-submit")
-async def submitRecentrifuge():
-    """Function to handle the 'Execute Recentrifuge' button in the 
-    tsv report page and display the Recentrifuge HTML report page.
-    """
-    global progress
-    global HOSTNAME
-    global USERNAME
-    global PASSWORD
-    global ACCOUNT
-
-    # Upload Recentrifuge script in the cluster
-    progress = {'state': 'Uploading Recentrifuge script', 'value': 10}
-    await uploadRecentrifugeScript(HOSTNAME, USERNAME, PASSWORD, ACCOUNT)
-    
-    # Execute Recentrifuge on the cluster
-    progress = {'state': 'Executing Recentrifuge', 'value': 60}
-    await executeRecentrifuge(HOSTNAME, USERNAME, PASSWORD)
-    
-    # Get the Centrifuge report from the cluster
-    progress = {'state': 'Downloading Recentrifuge report page', 'value': 90}
-    await downloadRecentrifugeReport(HOSTNAME, USERNAME, PASSWORD)
-    progress = {'state': 'Downloading Recentrifuge report page', 'value': 100}
-    time.sleep(3)
-
-    # Display the Recentrifuge report HTML page
-    return render_template('recentrifuge_output.html')
-
-
-@app.route("/rextract-submit")
-async def submitRextract():
-    """Function to upload, execute Rextract script and download Rextract 
-    cleaned sequences.
-    """
-    global progress
-    global HOSTNAME
-    global USERNAME
-    global PASSWORD
-    global ACCOUNT
-
-    # Upload Rextract script in the cluster
-    progress = {'state': 'Uploading Rextract script', 'value': 10}
-    await uploadRextractScript(HOSTNAME, USERNAME, PASSWORD, ACCOUNT)
-    
-    # Execute Rextract on the cluster
-    progress = {'state': 'Executing Rextract', 'value': 60}
-    await executeRextract(HOSTNAME, USERNAME, PASSWORD)
-
-    # Get the Rextract cleaned sequences from the cluster
-    progress = {'state': 'Downloading cleaned sequences', 'value': 90}
-    await downloadRextractSequences(HOSTNAME, USERNAME, PASSWORD)
-    progress = {'state': 'Downloading cleaned sequences', 'value': 100}
-    time.sleep(3)
-
-    # Check if the files are present
-    files = os.listdir('download')
-    rxtr_files = []
-
-    for file in files:
-        if 'rxtr' in file:
-            rxtr_files.append(f'download/{file}')
-
-    with zipfile.ZipFile(
-        'download/cleaned_sequences.zip', 
-        'w', 
-        zipfile.ZIP_DEFLATED
-    ) as zipf:
-        for file in rxtr_files:
-            zipf.write(file)
-
-    # Delete files after zip file creation
-    for file in rxtr_files:
-        os.remove(file)
-    
-    return send_file(
-        f'download/cleaned_sequences.zip', 
-        as_attachment = True, 
-        download_name = 'cleaned_sequences.zip'
-    )
-
-
 
 if __name__ == '__main__':
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
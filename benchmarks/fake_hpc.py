@@ -0,0 +1,552 @@
+import argparse
+import asyncio
+import collections
+import gzip
+import os
+import tempfile
+import threading
+import time
+
+import asyncssh
+
+from benchmarks.synthetic_report import writeSyntheticReport
+from pyscripts.job_monitor import localJobsDir
+from pyscripts.library_cache import REFSEQ_URL
+from pyscripts.taxonomy_report import TREE_FILE
+
+
+# Rows of the synthetic report written by the stub centrifuge
+DEFAULT_REPORT_ROWS = 1000
+
+# Assemblies of each domain served by the stub wget, as (accession,
+# taxID)
+ASSEMBLIES = (('GCF_000001.1', 10239), ('GCF_000002.1', 10240))
+
+# Domains of the stub RefSeq
+DOMAINS = ('archaea', 'bacteria', 'fungi', 'protozoa', 'viral')
+
+# Stub commands of the cluster, run by bash with $FAKE_HPC_ROOT set.
+# Every job is a state file in $FAKE_HPC_ROOT/jobs, updated by the
+# sbatch stub as the job waits in the queue and runs.
+STUBS = {
+    'sbatch': r'''
+JOBS=$FAKE_HPC_ROOT/jobs
+DEPENDENCY=
+for ARG in "$@"; do
+    case $ARG in
+        --dependency=afterok:*) DEPENDENCY=${ARG#--dependency=afterok:};;
+        -*) ;;
+        *) SCRIPT=$ARG;;
+    esac
+done
+[ -f "$SCRIPT" ] || { echo "sbatch: error: $SCRIPT not found" >&2; exit 1; }
+ID=$(flock $JOBS/.lock bash -c \
+    'ID=$(( $(cat $0/.last 2> /dev/null || echo 99) + 1 )); echo $ID > $0/.last; echo $ID' \
+    $JOBS)
+echo PENDING > $JOBS/$ID
+(
+    for DEP in ${DEPENDENCY//:/ }; do
+        while :; do
+            case $(cat $JOBS/$DEP 2> /dev/null) in
+                COMPLETED) break;;
+                # Empty while the state is being written
+                PENDING|RUNNING|"") sleep 0.2;;
+                *) echo CANCELLED > $JOBS/$ID; exit;;
+            esac
+        done
+    done
+    sleep $FAKE_HPC_QUEUE_WAIT
+    echo RUNNING > $JOBS/$ID
+    START=$(date +%s.%N)
+    # The tasks of a job array run at the same time
+    LAST=$(sed -n 's/^#SBATCH --array=0-\([0-9]*\)$/\1/p' $SCRIPT)
+    STATE=COMPLETED
+    if [ -z "$LAST" ]; then
+        SLURM_JOB_ID=$ID bash $SCRIPT > slurm-$ID.out 2>&1 || STATE=FAILED
+    else
+        PIDS=
+        for TASK in $(seq 0 $LAST); do
+            SLURM_JOB_ID=$ID SLURM_ARRAY_TASK_ID=$TASK bash $SCRIPT \
+                > slurm-${ID}_$TASK.out 2>&1 &
+            PIDS="$PIDS $!"
+        done
+        for PID in $PIDS; do wait $PID || STATE=FAILED; done
+    fi
+    sleep $(awk -v runtime=$FAKE_HPC_RUNTIME -v start=$START \
+        -v now=$(date +%s.%N) 'BEGIN { rest = runtime - (now - start); print (rest > 0 ? rest : 0) }')
+    echo $(( $(date +%s) - ${START%.*} )) > $JOBS/.$ID.elapsed
+    echo $STATE > $JOBS/$ID
+) > /dev/null 2>&1 &
+echo $ID
+''',
+    'squeue': r'''
+while [ $# -gt 0 ]; do [ "$1" = -j ] && IDS=$2; shift; done
+for ID in ${IDS//,/ }; do
+    STATE=$(cat $FAKE_HPC_ROOT/jobs/$ID 2> /dev/null)
+    case $STATE in PENDING|RUNNING) echo "$ID $STATE";; esac
+done
+''',
+    'sacct': r'''
+while [ $# -gt 0 ]; do
+    case $1 in -j) IDS=$2;; -o) FORMAT=$2;; esac
+    shift
+done
+for ID in ${IDS//,/ }; do
+    STATE=$(cat $FAKE_HPC_ROOT/jobs/$ID 2> /dev/null)
+    case $STATE in PENDING|RUNNING|"") continue;; esac
+    if [ "$FORMAT" = JobID,ElapsedRaw,MaxRSS ]; then
+        ELAPSED=$(cat $FAKE_HPC_ROOT/jobs/.$ID.elapsed 2> /dev/null || echo 0)
+        echo "$ID|$ELAPSED|"
+        echo "$ID.batch|$ELAPSED|$FAKE_HPC_MAX_RSS"
+    else
+        echo "$ID|$STATE"
+    fi
+done
+''',
+    'module': 'exit 0\n',
+    'pip': 'exit 0\n',
+    'python3': r'''
+[ "$1 $2" = "-m venv" ] || exit 1
+mkdir -p $3/bin && touch $3/bin/activate
+''',
+    'wget': r'''
+while [ $# -gt 0 ]; do
+    case $1 in -O) OUT=$2; shift;; -*) ;; *) URL=$1;; esac
+    shift
+done
+FILE=$FAKE_HPC_ROOT/ftp/${URL#https://ftp.ncbi.nlm.nih.gov/}
+[ -f "$FILE" ] || exit 8
+if [ "$OUT" = - ]; then cat "$FILE"; else cp "$FILE" "$OUT"; fi
+''',
+    'centrifuge-download': r'''
+while [ $# -gt 0 ]; do [ "$1" = -o ] && OUT=$2; shift; done
+cp $FAKE_HPC_ROOT/data/nodes.dmp $FAKE_HPC_ROOT/data/names.dmp $OUT/
+''',
+    'centrifuge-build': r'''
+for ARG; do PREFIX=$ARG; done
+for PART in 1 2 3; do head -c 1048576 /dev/zero > $PREFIX.$PART.cf; done
+''',
+    'centrifuge': r'''
+READS=
+while [ $# -gt 0 ]; do
+    case $1 in
+        -U|-1|-2) READS="$READS $2"; shift;;
+        -S) OUT=$2; shift;;
+        --report-file) REPORT=$2; shift;;
+    esac
+    shift
+done
+printf "readID\tseqID\ttaxID\tscore\t2ndBestScore\thitLength\tqueryLength\tnumMatches\n" > $OUT
+for FILE in $READS; do
+    gzip -cdf $FILE | awk 'NR % 4 == 1 { print substr($1, 2) "\tNC_0\t1000\t100\t0\t50\t50\t1" }' >> $OUT
+done
+cp $FAKE_HPC_ROOT/data/centrifuge_report.tsv ${REPORT:-centrifuge_report.tsv}
+''',
+    'rcf': r'''
+while [ $# -gt 0 ]; do [ "$1" = -f ] && INPUT=$2; shift; done
+{ echo "<html><body><pre>"; head -c 262144 $INPUT; echo "</pre></body></html>"; } > $INPUT.rcf.html
+cp $INPUT $INPUT.rcf.csv
+''',
+    'rextract': r'''
+READS=
+while [ $# -gt 0 ]; do
+    case $1 in -q|-1|-2) READS="$READS $2"; shift;; esac
+    shift
+done
+for FILE in $READS; do
+    NAME=$(basename $FILE)
+    gzip -cdf $FILE > ${NAME%%.fastq*}_rxtr.fastq
+done
+'''
+}
+
+
+class Link:
+    """Simulated network link between the app and the cluster, adding a
+    round trip latency to every request and sharing a bandwidth among the
+    concurrent transfers.
+
+    :param latency: Seconds of a round trip.
+    :param bandwidth: Bytes per second of the link, None for no limit.
+    """
+
+    def __init__(self, latency: float = 0, bandwidth: float = None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._free_at = 0
+
+    async def roundTrip(self):
+        """Wait a round trip.
+        """
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def transfer(self, size: int):
+        """Wait a round trip and the transfer of some bytes, after the
+        transfers already on the link.
+
+        :param size: Number of bytes.
+        """
+        delay = self.latency
+        if self.bandwidth:
+            now = time.monotonic()
+            self._free_at = max(self._free_at, now) + size / self.bandwidth
+            delay += self._free_at - now
+
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class _SFTPServer(asyncssh.SFTPServer):
+    """SFTP server on the local disk, going through the Link of the
+    cluster and counting the requests and the bytes.
+    """
+
+    def __init__(self, chan, hpc):
+        super().__init__(chan)
+        self._hpc = hpc
+
+    async def open(self, path, pflags, attrs):
+        self._hpc.count('sftp_requests')
+        await self._hpc.link.roundTrip()
+        return super().open(path, pflags, attrs)
+
+    async def stat(self, path):
+        self._hpc.count('sftp_requests')
+        await self._hpc.link.roundTrip()
+        return super().stat(path)
+
+    async def lstat(self, path):
+        self._hpc.count('sftp_requests')
+        await self._hpc.link.roundTrip()
+        return super().lstat(path)
+
+    async def read(self, file_obj, offset, size):
+        data = super().read(file_obj, offset, size)
+        self._hpc.count('sftp_requests')
+        self._hpc.count('bytes_downloaded', len(data))
+        await self._hpc.link.transfer(len(data))
+        return data
+
+    async def write(self, file_obj, offset, data):
+        self._hpc.count('sftp_requests')
+        self._hpc.count('bytes_uploaded', len(data))
+        await self._hpc.link.transfer(len(data))
+        return super().write(file_obj, offset, data)
+
+
+class _SSHServer(asyncssh.SSHServer):
+    """SSH server accepting any password, keeping the set of the open
+    connections.
+    """
+
+    def __init__(self, connections: set):
+        self._connections = connections
+        self._conn = None
+
+    def connection_made(self, conn):
+        self._conn = conn
+        self._connections.add(conn)
+
+    def connection_lost(self, exc):
+        self._connections.discard(self._conn)
+
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+class FakeHPC:
+    """Stand-in of the cluster, running on the local disk.
+
+    An asyncssh server, started in its own thread, runs the commands with
+    bash in a temporary root holding $SCRATCH, the stub Slurm, module and
+    bioinformatics commands, and a stub RefSeq FTP. The Slurm stubs keep
+    every job in the queue for queue_wait seconds and running for at
+    least runtime seconds. Every command and SFTP request goes through a
+    Link with the given latency and bandwidth.
+
+    :param latency: Seconds of a round trip.
+    :param bandwidth: Bytes per second of the link, None for no limit.
+    :param queue_wait: Seconds every job waits in the queue.
+    :param runtime: Seconds every job runs at least.
+    :param report_rows: Rows of the report written by centrifuge.
+    :param root: Directory of the cluster, a temporary one if None.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        bandwidth: float = None,
+        queue_wait: float = 0,
+        runtime: float = 0,
+        report_rows: int = DEFAULT_REPORT_ROWS,
+        root: str = None
+    ):
+        self.link = Link(latency, bandwidth)
+        self.queue_wait = queue_wait
+        self.runtime = runtime
+        self.report_rows = report_rows
+        self.root = root
+        self.port = None
+        self.stats = collections.Counter()
+        self._temporary = None
+        self._loop = None
+        self._server = None
+        self._connections = set()
+        self._thread = None
+
+    @property
+    def hostname(self) -> str:
+        """Host name of the cluster for the web app, with the port.
+        """
+        return f'127.0.0.1:{self.port}'
+
+    @property
+    def scratch(self) -> str:
+        """Path of $SCRATCH on the local disk.
+        """
+        return os.path.join(self.root, 'scratch')
+
+    def count(self, name: str, value: int = 1):
+        """Add to a counter of the statistics.
+
+        :param name: The name of the counter.
+        :param value: The value added.
+        """
+        self.stats[name] += value
+
+    def jobs(self) -> dict:
+        """Get the state of every submitted job and the time it entered
+        the state, by JobID.
+        """
+        jobs = {}
+
+        # The Slurm jobs, and the ones run without Slurm
+        for directory in (
+            os.path.join(self.root, 'jobs'),
+            localJobsDir(self.scratch)
+        ):
+            if not os.path.isdir(directory):
+                continue
+            for job_id in os.listdir(directory):
+                if job_id.startswith('.'):
+                    continue
+                path = os.path.join(directory, job_id)
+                with open(path) as file:
+                    state = file.read().strip()
+                jobs[job_id] = (state, os.path.getmtime(path))
+
+        return jobs
+
+    def _install(self):
+        """Write the stub commands, the data they serve and the login
+        profile in the root.
+        """
+        for directory in ('bin', 'data', 'jobs', 'scratch'):
+            os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+
+        for name, body in STUBS.items():
+            path = os.path.join(self.root, 'bin', name)
+            with open(path, 'w', newline='\n') as file:
+                file.write('#!/bin/bash\n' + body.lstrip('\n'))
+            os.chmod(path, 0o755)
+
+        # The login shells of the commands reset the PATH
+        with open(os.path.join(self.root, '.bash_profile'), 'w') as file:
+            file.write('export PATH=$FAKE_HPC_ROOT/bin:$PATH\n')
+
+        # Report of centrifuge and its taxonomy, as nodes.dmp
+        data = os.path.join(self.root, 'data')
+        writeSyntheticReport(data, self.report_rows)
+        with open(os.path.join(data, TREE_FILE)) as tree, \
+                open(os.path.join(data, 'nodes.dmp'), 'w') as nodes, \
+                open(os.path.join(data, 'names.dmp'), 'w') as names:
+            for line in tree:
+                tax_id, parent, rank = line.rstrip('\n').split('\t')
+                nodes.write(f'{tax_id}\t|\t{parent}\t|\t{rank}\t|\n')
+                names.write(f'{tax_id}\t|\tTaxon {tax_id}\t|\t\t|\n')
+        os.remove(os.path.join(data, TREE_FILE))
+
+        # RefSeq assembly summaries and genomes of every domain
+        base = REFSEQ_URL[len('https://ftp.ncbi.nlm.nih.gov/'):]
+        for domain in DOMAINS:
+            directory = os.path.join(self.root, 'ftp', base, domain)
+            os.makedirs(directory, exist_ok=True)
+            with open(
+                os.path.join(directory, 'assembly_summary.txt'),
+                'w'
+            ) as file:
+                file.write('# assembly_accession\n')
+                for accession, tax_id in ASSEMBLIES:
+                    url = f'https://ftp.ncbi.nlm.nih.gov/genomes/all/' \
+                          f'{accession}_{domain}'
+                    fields = [accession] + ['na'] * 19
+                    fields[5] = fields[6] = str(tax_id)
+                    fields[10] = 'latest'
+                    fields[11] = 'Complete Genome'
+                    fields[19] = url
+                    file.write('\t'.join(fields) + '\n')
+
+                    genome = os.path.join(
+                        self.root,
+                        'ftp',
+                        'genomes',
+                        'all',
+                        f'{accession}_{domain}'
+                    )
+                    os.makedirs(genome, exist_ok=True)
+                    path = os.path.join(
+                        genome,
+                        f'{accession}_{domain}_genomic.fna.gz'
+                    )
+                    with gzip.open(path, 'wt') as fna:
+                        fna.write(f'>NC_{tax_id}.1 {domain}\n')
+                        fna.write('ACGT' * 1024 + '\n')
+
+    def _environment(self) -> dict:
+        """Get the environment of the commands.
+        """
+        return {
+            'FAKE_HPC_ROOT': self.root,
+            'FAKE_HPC_QUEUE_WAIT': str(self.queue_wait),
+            'FAKE_HPC_RUNTIME': str(self.runtime),
+            'FAKE_HPC_MAX_RSS': '2048K',
+            'HOME': self.root,
+            'SCRATCH': self.scratch,
+            'PATH': f"{os.path.join(self.root, 'bin')}:/usr/bin:/bin",
+            'LC_ALL': 'C'
+        }
+
+    async def _runCommand(self, process):
+        """Run the command of an SSH session with bash in $SCRATCH.
+
+        :param process: The asyncssh server process.
+        """
+        command = process.command or 'true'
+        self.count('commands')
+        await self.link.roundTrip()
+
+        child = await asyncio.create_subprocess_exec(
+            'bash',
+            '-c',
+            command,
+            env=self._environment(),
+            cwd=self.scratch,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await child.communicate()
+        await self.link.transfer(len(stdout) + len(stderr))
+
+        process.stdout.write(stdout)
+        process.stderr.write(stderr)
+        process.exit(child.returncode)
+
+    async def _listen(self):
+        """Start the SSH server.
+        """
+        self._server = await asyncssh.create_server(
+            lambda: _SSHServer(self._connections),
+            '127.0.0.1',
+            self.port or 0,
+            server_host_keys=[asyncssh.generate_private_key('ssh-ed25519')],
+            process_factory=self._runCommand,
+            sftp_factory=lambda chan: _SFTPServer(chan, self),
+            encoding=None
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _close(self):
+        """Stop the SSH server and close its connections.
+        """
+        self._server.close()
+        for conn in list(self._connections):
+            conn.close()
+
+    def start(self) -> 'FakeHPC':
+        """Install the cluster in the root and start the SSH server.
+        """
+        if self.root is None:
+            self._temporary = tempfile.TemporaryDirectory()
+            self.root = self._temporary.name
+        self.root = os.path.abspath(self.root)
+        self._install()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            daemon=True
+        )
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._listen(), self._loop).result()
+
+        return self
+
+    def stop(self):
+        """Stop the SSH server and remove the temporary root.
+        """
+        if self._server is not None:
+            asyncio.run_coroutine_threadsafe(
+                self._close(),
+                self._loop
+            ).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._server = None
+
+        if self._temporary is not None:
+            self._temporary.cleanup()
+            self._temporary = None
+            self.root = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run a stand-in of the cluster on the local disk'
+    )
+    parser.add_argument('--root', help='directory of the cluster')
+    parser.add_argument('--port', type=int, default=8022)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument(
+        '--bandwidth',
+        type=float,
+        help='bytes per second of the link'
+    )
+    parser.add_argument('--queue-wait', type=float, default=0)
+    parser.add_argument('--runtime', type=float, default=0)
+    parser.add_argument(
+        '--report-rows',
+        type=int,
+        default=DEFAULT_REPORT_ROWS
+    )
+    args = parser.parse_args()
+
+    hpc = FakeHPC(
+        args.latency,
+        args.bandwidth,
+        args.queue_wait,
+        args.runtime,
+        args.report_rows,
+        args.root
+    )
+    hpc.port = args.port
+    with hpc:
+        print(f"Cluster listening on {hpc.hostname}, $SCRATCH {hpc.scratch}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
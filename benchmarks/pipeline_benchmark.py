@@ -0,0 +1,374 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_hpc import FakeHPC, DEFAULT_REPORT_ROWS
+from benchmarks.report_benchmark import RESULTS_DIR, gitCommit
+from pyscripts import job_monitor
+from pyscripts.pipeline import PIPELINE_STAGES
+from pyscripts.progress import bus
+
+
+# Latency in seconds and bandwidth in bytes per second of the simulated
+# links between the web app and the cluster
+LINK_PROFILES = {
+    'local': (0, None),
+    'lan': (0.001, 100 * 1024 * 1024),
+    'wan': (0.04, 10 * 1024 * 1024)
+}
+
+# Pairs of reads of the synthetic samples
+DEFAULT_READS = 20000
+
+# Length of the synthetic reads
+READ_LENGTH = 150
+
+# Factor applied to the poll intervals of the job monitor, which are
+# sized for jobs running for hours
+DEFAULT_POLL_SCALE = 0.1
+
+# Seconds after which a run is considered stuck
+RUN_TIMEOUT = 600
+
+
+def writeSyntheticReads(directory: str, reads: int, seed: int = 0) -> list:
+    """Write a synthetic paired-end sample and return the paths of its
+    two FASTQ files.
+
+    :param directory: Directory of the files.
+    :param reads: Number of pairs of reads.
+    :param seed: Seed of the random generator.
+    """
+    rng = random.Random(seed)
+    quality = 'I' * READ_LENGTH
+    paths = [
+        os.path.join(directory, f'sample_{mate}.fastq') for mate in (1, 2)
+    ]
+
+    files = [open(path, 'w') for path in paths]
+    try:
+        for read in range(reads):
+            for mate, file in enumerate(files, 1):
+                sequence = ''.join(rng.choices('ACGT', k=READ_LENGTH))
+                file.write(f'@read{read}/{mate}\n{sequence}\n+\n{quality}\n')
+    finally:
+        for file in files:
+            file.close()
+
+    return paths
+
+
+def fileChecksum(path: str) -> str:
+    """Get the hex SHA-256 of a file.
+
+    :param path: Path of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def scalePollIntervals(scale: float):
+    """Scale the poll intervals of the job monitor.
+
+    :param scale: Factor applied to the intervals.
+    """
+    for state in job_monitor.POLL_INTERVALS:
+        job_monitor.POLL_INTERVALS[state] *= scale
+    job_monitor.DEFAULT_POLL_INTERVAL *= scale
+
+
+def runPipeline(client, hpc: FakeHPC, paths: list, staged: bool) -> dict:
+    """Submit a run of the web app to the cluster and time it until the
+    results of every stage are downloaded.
+
+    :param client: The Flask test client.
+    :param hpc: The FakeHPC running the jobs.
+    :param paths: Paths of the FASTQ files.
+    :param staged: Start Recentrifuge and Rextract from the report page
+    once Centrifuge completed, instead of submitting the pipeline.
+    """
+    # Times of the job states seen by the app
+    seen = {}
+    lock = threading.Lock()
+
+    def listener(channel, event, data):
+        if event == 'job':
+            with lock:
+                states = seen.setdefault(data['job_id'], {})
+                states[data['state']] = time.time()
+
+    bus.subscribe(listener)
+    stats = hpc.stats.copy()
+    steps = {}
+
+    start = time.time()
+    with contextlib.ExitStack() as stack:
+        files = [
+            (stack.enter_context(open(path, 'rb')), os.path.basename(path))
+            for path in paths
+        ]
+        data = {
+            'hostname': hpc.hostname,
+            'username': 'benchmark',
+            'password': 'benchmark',
+            'account': 'benchmark',
+            'readType': 'paired',
+            'domains': ['viral'],
+            # Sent by the form page for the files it does not chunk
+            'sha256': [fileChecksum(path) for path in paths],
+            'size': [os.path.getsize(path) for path in paths],
+            'readsFiles': files
+        }
+        if not staged:
+            data['pipeline'] = '1'
+        response = client.post(
+            '/centrifuge-form',
+            data=data,
+            content_type='multipart/form-data'
+        )
+    assert response.status_code == 202, response.json
+    run_id = response.json['id']
+    steps['submit'] = time.time() - start
+
+    def wait(stage):
+        deadline = time.time() + RUN_TIMEOUT
+        while time.time() < deadline:
+            status = client.get(f'/runs/{run_id}').json
+            state = status['stages'].get(stage)
+            if state == 'failed':
+                raise RuntimeError(f"Stage {stage} failed: {status['error']}")
+            if state == 'completed':
+                return status
+            time.sleep(0.05)
+        raise TimeoutError(f"Stage {stage} did not complete")
+
+    wait('centrifuge')
+    steps['centrifuge'] = time.time() - start
+    assert client.get(f'/runs/{run_id}/report').status_code == 200
+
+    for stage in PIPELINE_STAGES[1:]:
+        if staged:
+            response = client.post(f'/runs/{run_id}/stages/{stage}')
+            assert response.status_code == 202, response.json
+        status = wait(stage)
+        response = client.get(f'/runs/{run_id}/results/{stage}')
+        assert response.status_code == 200, response.status_code
+        steps[stage] = time.time() - start
+
+    bus.unsubscribe(listener)
+
+    # Delay between the end of every job and the app noticing it
+    ended = hpc.jobs()
+    jobs = {}
+    for job_id, states in seen.items():
+        state, end = ended[job_id]
+        jobs[job_id] = {
+            'state': state,
+            'detection_delay': states.get(state, end) - end
+        }
+
+    timings = status['timings']
+
+    return {
+        'seconds': time.time() - start,
+        'backend': status['backend'],
+        'steps': steps,
+        'stages': {
+            stage: timing['completed'] - timing['running']
+            for stage, timing in timings.items()
+        },
+        'jobs': jobs,
+        'cluster': {
+            name: hpc.stats[name] - stats[name] for name in hpc.stats
+        }
+    }
+
+
+def runBenchmarks(
+    profiles,
+    reads: int = DEFAULT_READS,
+    queue_wait: float = 1,
+    runtime: float = 1,
+    report_rows: int = DEFAULT_REPORT_ROWS,
+    staged: bool = False,
+    backend: str = None,
+    shard_reads: int = None,
+    seed: int = 0
+) -> dict:
+    """Run the pipeline twice on a FakeHPC for every link profile, with
+    empty caches then with the reads, libraries and index already on
+    the cluster.
+
+    :param profiles: The names of the LINK_PROFILES.
+    :param reads: Pairs of reads of the sample.
+    :param queue_wait: Seconds every job waits in the queue.
+    :param runtime: Seconds every job runs at least.
+    :param report_rows: Rows of the Centrifuge report.
+    :param staged: Start the stages one after the other.
+    :param backend: The name of the execution backend of the runs,
+    chosen by the size of the reads if None.
+    :param shard_reads: Reads of each shard of the Centrifuge job array,
+    the setting of the web app if None.
+    :param seed: Seed of the synthetic reads.
+    """
+    result = {
+        'commit': gitCommit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'reads': reads,
+        'queue_wait': queue_wait,
+        'runtime': runtime,
+        'report_rows': report_rows,
+        'mode': 'staged' if staged else 'pipeline',
+        'backend': backend,
+        'shard_reads': shard_reads,
+        'profiles': {}
+    }
+
+    import HPC_CleanSeq
+    from pyscripts.chart_service import service
+    from pyscripts.execution import backends
+    from pyscripts.resources import estimator
+    client = HPC_CleanSeq.app.test_client()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # The web app keeps its files in the working directory
+        os.chdir(directory)
+        for folder in ('uploads', 'download', 'scripts'):
+            os.makedirs(folder)
+        paths = writeSyntheticReads(directory, reads, seed)
+        backends.configure(backend=backend)
+        if shard_reads is not None:
+            estimator.configure(shard_reads=shard_reads)
+
+        try:
+            for profile in profiles:
+                latency, bandwidth = LINK_PROFILES[profile]
+                print(f"Link {profile}")
+                result['profiles'][profile] = {}
+                with FakeHPC(
+                    latency,
+                    bandwidth,
+                    queue_wait,
+                    runtime,
+                    report_rows
+                ) as hpc:
+                    for cache in ('cold', 'warm'):
+                        run = runPipeline(client, hpc, paths, staged)
+                        result['profiles'][profile][cache] = run
+                        print(
+                            f"  {cache:5} {run['backend']:6}"
+                            f"{run['seconds']:8.2f} s  "
+                            + '  '.join(
+                                f"{step} {seconds:.2f}"
+                                for step, seconds in run['steps'].items()
+                            )
+                        )
+        finally:
+            service.configure()
+            backends.configure(
+                backend=HPC_CleanSeq.app.config['EXECUTION_BACKEND']
+            )
+            estimator.configure(
+                shard_reads=HPC_CleanSeq.app.config['CENTRIFUGE_SHARD_READS']
+            )
+            os.chdir(cwd)
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipeline on a stand-in of the cluster'
+    )
+    parser.add_argument(
+        '--profiles',
+        nargs='+',
+        choices=list(LINK_PROFILES),
+        default=list(LINK_PROFILES),
+        help='simulated links between the web app and the cluster'
+    )
+    parser.add_argument(
+        '--reads',
+        type=int,
+        default=DEFAULT_READS,
+        help='pairs of reads of the sample'
+    )
+    parser.add_argument(
+        '--queue-wait',
+        type=float,
+        default=1,
+        help='seconds every job waits in the queue'
+    )
+    parser.add_argument(
+        '--runtime',
+        type=float,
+        default=1,
+        help='seconds every job runs at least'
+    )
+    parser.add_argument(
+        '--report-rows',
+        type=int,
+        default=DEFAULT_REPORT_ROWS
+    )
+    parser.add_argument(
+        '--poll-scale',
+        type=float,
+        default=DEFAULT_POLL_SCALE,
+        help='factor applied to the poll intervals of the job monitor'
+    )
+    parser.add_argument(
+        '--staged',
+        action='store_true',
+        help='start the stages one after the other instead of the pipeline'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=['slurm', 'local'],
+        help='execution backend of the runs, chosen by the reads if not given'
+    )
+    parser.add_argument(
+        '--shard-reads',
+        type=int,
+        help='reads of each shard of the Centrifuge job array'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON results')
+    args = parser.parse_args()
+
+    scalePollIntervals(args.poll_scale)
+    result = runBenchmarks(
+        args.profiles,
+        args.reads,
+        args.queue_wait,
+        args.runtime,
+        args.report_rows,
+        args.staged,
+        args.backend,
+        args.shard_reads,
+        args.seed
+    )
+    result['poll_scale'] = args.poll_scale
+
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}-pipeline.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(result, file, indent=1)
+    print(f"Results written in {output}")
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import plotly
+
+from benchmarks.synthetic_report import writeSyntheticReport
+from pyscripts.chart_aggregation import rollup
+from pyscripts.data_visualization import (
+    buildChart,
+    getMetrics,
+    CHART_PARAMS,
+    CHARTS
+)
+from pyscripts.report_query import ReportQuery
+from pyscripts.taxonomy_report import TaxonomyReport, loadParents, treeFile
+
+
+# Number of rows of the synthetic reports
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+# Directory of the results, one JSON file per execution
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Largest number of timed executions of each step
+MAX_REPEATS = 5
+
+# Seconds after which a step is no longer repeated
+REPEAT_BUDGET = 2
+
+
+def measure(step) -> dict:
+    """Time a step, taking the best of some executions, and measure the
+    peak of the memory it allocates with tracemalloc.
+
+    The step is repeated until MAX_REPEATS executions or REPEAT_BUDGET
+    seconds. The memory is measured by a further execution, as tracemalloc
+    slows the step down.
+
+    :param step: Callable without arguments.
+    """
+    times = []
+    while len(times) < MAX_REPEATS and sum(times) < REPEAT_BUDGET:
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': min(times),
+        'mean_seconds': sum(times) / len(times),
+        'repeats': len(times),
+        'peak_bytes': peak
+    }
+
+
+def benchmarkFunctions(filepath: str) -> dict:
+    """Benchmark the parsing, the queries and every chart builder on a
+    report, in the current process.
+
+    :param filepath: Path of the report.
+    """
+    results = {}
+
+    results['parse'] = measure(lambda: TaxonomyReport.fromTSV(filepath))
+    report = TaxonomyReport.fromTSV(filepath)
+    parents = loadParents(treeFile(filepath))
+
+    results['load_tree'] = measure(lambda: loadParents(treeFile(filepath)))
+    results['link_parents'] = measure(lambda: report.linkParents(parents))
+    results['metrics'] = measure(lambda: getMetrics(report))
+    results['rollup_genus'] = measure(
+        lambda: rollup(report, 'genus', parents)
+    )
+
+    for name in CHARTS:
+        params = CHART_PARAMS.get(name, {})
+        results[f'chart_{name}'] = measure(
+            lambda: buildChart(report, parents, name, params)
+        )
+
+    # A fresh query for every execution, so the indexes are built
+    results['query_first_page'] = measure(
+        lambda: ReportQuery(report).query()
+    )
+    query = ReportQuery(report)
+    query.query(rank='genus', name='1')
+    results['query_filtered'] = measure(
+        lambda: query.query(rank='genus', name='1', min_reads=10)
+    )
+
+    return results
+
+
+def benchmarkApp(filepath: str) -> dict:
+    """Benchmark the report page of the web app through the Flask test
+    client: the POST of the report, then the request of every chart, the
+    first one rendering it and the second one from the cache.
+
+    :param filepath: Path of the report.
+    """
+    import HPC_CleanSeq
+    from pyscripts.chart_cache import charts
+    from pyscripts.chart_service import service
+    from pyscripts.report_registry import reports
+
+    results = {}
+    client = HPC_CleanSeq.app.test_client()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Keep the files of the app out of the repository
+        HPC_CleanSeq.app.config['UPLOAD_FOLDER'] = directory
+        charts.configure(directory=os.path.join(directory, 'charts'))
+        reports.configure(directory=os.path.join(directory, 'reports'))
+        service.configure(directory=os.path.join(directory, 'columns'))
+
+        def post():
+            with open(filepath, 'rb') as file:
+                response = client.post(
+                    '/report-analisys',
+                    data={'file': (file, 'centrifuge_report.tsv')},
+                    content_type='multipart/form-data'
+                )
+            assert response.status_code == 200, response.status_code
+            return response
+
+        results['post_report'] = measure(post)
+        report_id = reports.register(os.path.join(
+            directory,
+            'centrifuge_report.tsv'
+        ))
+
+        def charts_request():
+            for name in CHARTS:
+                response = client.get(f'/reports/{report_id}/charts/{name}')
+                assert response.status_code == 200, response.status_code
+
+        # Rendered once, the executions after the first hit the cache
+        start = time.perf_counter()
+        charts_request()
+        results['charts_first_request'] = {
+            'seconds': time.perf_counter() - start
+        }
+        results['charts_cached'] = measure(charts_request)
+
+        results['rows_first_page'] = measure(
+            lambda: client.get(f'/reports/{report_id}/rows')
+        )
+
+        service.configure()
+
+    return results
+
+
+def gitCommit() -> str:
+    """Get the commit of the repository, None if it is unknown.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmarks(sizes, app: bool = True, seed: int = 0) -> dict:
+    """Run the benchmarks on synthetic reports of some sizes.
+
+    :param sizes: The numbers of rows of the reports.
+    :param app: Also benchmark the requests to the web app.
+    :param seed: Seed of the synthetic reports.
+    """
+    result = {
+        'commit': gitCommit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'plotly': plotly.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'sizes': {}
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            print(f"Report of {rows} rows")
+            filepath = writeSyntheticReport(
+                os.path.join(directory, str(rows)),
+                rows,
+                seed
+            )
+
+            steps = benchmarkFunctions(filepath)
+            if app:
+                steps.update(benchmarkApp(filepath))
+            result['sizes'][str(rows)] = steps
+
+            for step, values in steps.items():
+                print(f"  {step:40} {values['seconds'] * 1000:10.1f} ms")
+
+    return result
+
+
+def compareResults(previous: dict, current: dict):
+    """Print the change of the times of the steps between two results.
+
+    :param previous: The older result.
+    :param current: The newer result.
+    """
+    print(f"\n{previous['commit']} -> {current['commit']}")
+    for rows, steps in current['sizes'].items():
+        before = previous['sizes'].get(rows, {})
+        for step, values in steps.items():
+            if step not in before:
+                continue
+            ratio = values['seconds'] / max(before[step]['seconds'], 1e-9)
+            print(f"  {rows:>8} {step:40} x{ratio:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the parsing and the charts of the reports'
+    )
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=DEFAULT_SIZES,
+        help='numbers of rows of the synthetic reports'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-app',
+        action='store_true',
+        help='do not benchmark the requests to the web app'
+    )
+    parser.add_argument('--output', help='path of the JSON results')
+    parser.add_argument(
+        '--compare',
+        help='JSON results of a previous execution to compare with'
+    )
+    args = parser.parse_args()
+
+    result = runBenchmarks(args.sizes, not args.no_app, args.seed)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(result, file, indent=1)
+    print(f"Results written in {output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compareResults(json.load(file), result)
@@ -0,0 +1,172 @@
+import argparse
+import os
+
+import numpy as np
+
+from pyscripts.taxonomy_report import REPORT_COLUMNS, TREE_FILE
+
+
+# Ranks of the synthetic taxonomy, from the root to the leaves
+SYNTHETIC_RANKS = (
+    'superkingdom',
+    'phylum',
+    'class',
+    'order',
+    'family',
+    'genus',
+    'species',
+    'leaf'
+)
+
+# TaxID of the root of the taxonomy, parent of the superkingdoms
+ROOT_TAX_ID = 1
+
+# First taxID given to the synthetic taxa
+FIRST_TAX_ID = 1000
+
+
+def _branching(rows: int) -> float:
+    """Get the mean number of children per taxon giving about rows taxa
+    in a tree as deep as SYNTHETIC_RANKS.
+
+    :param rows: Number of taxa.
+    """
+    low, high = 1.0, float(rows)
+    for _ in range(60):
+        middle = (low + high) / 2
+        total = sum(
+            middle ** level for level in range(1, len(SYNTHETIC_RANKS) + 1)
+        )
+        if total < rows:
+            low = middle
+        else:
+            high = middle
+
+    return high
+
+
+def syntheticTaxonomy(rows: int, seed: int = 0) -> dict:
+    """Generate a taxonomy of rows taxa, listed depth first so that every
+    taxon follows its ancestors as in the Centrifuge reports.
+
+    :param rows: Number of taxa.
+    :param seed: Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    branching = _branching(rows)
+
+    tax_ids = []
+    parents = []
+    levels = []
+
+    # Stack of the taxa still to visit, as (parent taxID, level)
+    stack = []
+    while len(tax_ids) < rows:
+        if not stack:
+            stack.append((ROOT_TAX_ID, 0))
+        parent, level = stack.pop()
+        tax_id = FIRST_TAX_ID + len(tax_ids)
+        tax_ids.append(tax_id)
+        parents.append(parent)
+        levels.append(level)
+
+        if level + 1 < len(SYNTHETIC_RANKS):
+            children = rng.poisson(branching - 1) + 1
+            stack.extend([(tax_id, level + 1)] * int(children))
+
+    return {
+        'tax_id': np.array(tax_ids, dtype=np.int64),
+        'parent': np.array(parents, dtype=np.int64),
+        'level': np.array(levels, dtype=np.int64)
+    }
+
+
+def writeSyntheticReport(
+    directory: str,
+    rows: int,
+    seed: int = 0,
+    tree: bool = True
+) -> str:
+    """Write a synthetic centrifuge_report.tsv, and the taxonomy tree
+    downloaded with the reports if asked, and return the path of the
+    report.
+
+    The reads follow a log-normal distribution, the unique reads are a
+    part of them and the abundance is spread over the species and the
+    leaves in proportion to their reads over their genome size.
+
+    :param directory: Directory of the files, created if needed.
+    :param rows: Number of taxa of the report.
+    :param seed: Seed of the random generator.
+    :param tree: Also write the TREE_FILE of the report.
+    """
+    rng = np.random.default_rng(seed)
+    taxonomy = syntheticTaxonomy(rows, seed)
+    tax_id = taxonomy['tax_id']
+    level = taxonomy['level']
+    count = len(tax_id)
+
+    ranks = np.array(SYNTHETIC_RANKS, dtype=object)[level]
+    names = [
+        f'{rank.capitalize()} {taxon}'
+        for rank, taxon in zip(ranks.tolist(), tax_id.tolist())
+    ]
+    genome_size = rng.lognormal(15, 1.5, count).astype(np.int64) + 1000
+
+    # Few reads on the inner taxa, most on the species and the leaves
+    leafy = level >= SYNTHETIC_RANKS.index('species')
+    num_reads = rng.lognormal(np.where(leafy, 6, 3), 2).astype(np.int64)
+    num_unique_reads = rng.binomial(num_reads, rng.uniform(0, 1, count))
+
+    abundance = np.where(leafy, num_reads / genome_size, 0.0)
+    if abundance.sum() > 0:
+        abundance /= abundance.sum()
+
+    os.makedirs(directory, exist_ok=True)
+    filepath = os.path.join(directory, 'centrifuge_report.tsv')
+    with open(filepath, 'w') as file:
+        file.write('\t'.join(REPORT_COLUMNS) + '\n')
+        for row in zip(
+            names,
+            tax_id.tolist(),
+            ranks.tolist(),
+            genome_size.tolist(),
+            num_reads.tolist(),
+            num_unique_reads.tolist(),
+            np.round(abundance, 6).tolist()
+        ):
+            file.write('\t'.join(map(str, row)) + '\n')
+
+    if tree:
+        with open(os.path.join(directory, TREE_FILE), 'w') as file:
+            file.write(f'{ROOT_TAX_ID}\t{ROOT_TAX_ID}\tno rank\n')
+            for row in zip(
+                tax_id.tolist(),
+                taxonomy['parent'].tolist(),
+                ranks.tolist()
+            ):
+                file.write('\t'.join(map(str, row)) + '\n')
+
+    return filepath
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic Centrifuge report'
+    )
+    parser.add_argument('directory', help='directory of the report')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-tree',
+        action='store_true',
+        help='do not write the taxonomy tree of the report'
+    )
+    args = parser.parse_args()
+
+    print(writeSyntheticReport(
+        args.directory,
+        args.rows,
+        args.seed,
+        not args.no_tree
+    ))
@@ -0,0 +1,109 @@
+import numpy as np
+
+from pyscripts.taxonomy_report import TaxonomyReport
+
+
+# Label of the bucket gathering the taxa out of the top N
+OTHER = 'Other'
+
+# Number of points from which the scatter charts are drawn with WebGL
+WEBGL_MIN_POINTS = 1000
+
+# Largest number of taxa shown by a chart
+MAX_TOP_N = 10000
+
+
+def topN(values: np.ndarray, n: int = None) -> np.ndarray:
+    """Get the positions of the n largest values, from the largest.
+
+    Only the top n values are sorted, the others are partitioned out.
+
+    :param values: Array of the values.
+    :param n: Number of positions, all if None.
+    """
+    if n is None or n >= len(values):
+        return np.argsort(-values, kind='stable')
+
+    top = np.argpartition(-values, n - 1)[:n]
+
+    return top[np.argsort(-values[top], kind='stable')]
+
+
+def withOther(
+    names: np.ndarray,
+    values: np.ndarray,
+    n: int = None
+) -> tuple:
+    """Keep the n largest values, from the largest, and gather the others
+    in the OTHER bucket, left out if empty.
+
+    :param names: Array of the names of the values.
+    :param values: Array of the values.
+    :param n: Number of values kept, all if None.
+    """
+    top = topN(values, n)
+    others = np.ones(len(values), dtype=bool)
+    others[top] = False
+    rest = values[others].sum()
+
+    names = names[top]
+    values = values[top]
+    if rest > 0:
+        names = np.append(names, OTHER)
+        values = np.append(values, rest)
+
+    return names, values
+
+
+def rollup(
+    report: TaxonomyReport,
+    rank: str,
+    parents: dict = None
+) -> TaxonomyReport:
+    """Aggregate the rows of a report at a rank, every row of the rank
+    gets the reads and the abundance of its whole subtree.
+
+    The rows above the rank, or without an ancestor of the rank in the
+    report, are left out. The genome size of a row is the largest of its
+    subtree.
+
+    :param report: The TaxonomyReport.
+    :param rank: The name of the rank, for example 'genus'.
+    :param parents: The parent taxID of every taxID (see loadParents),
+    the tree is inferred from the order of the rows if None.
+    """
+    code = report.rankCode(rank)
+    if parents is not None:
+        parent = report.linkParents(parents)
+    else:
+        parent = report.inferParents()
+
+    # Climb all the rows at once until they reach a row of the rank
+    ancestor = np.arange(len(report))
+    climbing = np.flatnonzero(report.rank != code)
+    while len(climbing) > 0:
+        ancestor[climbing] = parent[ancestor[climbing]]
+        climbing = climbing[ancestor[climbing] >= 0]
+        climbing = climbing[report.rank[ancestor[climbing]] != code]
+
+    members = np.flatnonzero(ancestor >= 0)
+    groups, group = np.unique(ancestor[members], return_inverse=True)
+
+    def total(column):
+        sums = np.zeros(len(groups), dtype=column.dtype)
+        np.add.at(sums, group, column[members])
+        return sums
+
+    genome_size = np.zeros(len(groups), dtype=report.genome_size.dtype)
+    np.maximum.at(genome_size, group, report.genome_size[members])
+
+    return TaxonomyReport(
+        name=report.name[groups],
+        tax_id=report.tax_id[groups],
+        rank=report.rank[groups],
+        rank_names=report.rank_names,
+        genome_size=genome_size,
+        num_reads=total(report.num_reads),
+        num_unique_reads=total(report.num_unique_reads),
+        abundance=total(report.abundance)
+    )
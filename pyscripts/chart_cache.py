@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import plotly
+
+from pyscripts.taxonomy_report import treeFile
+
+
+# Directory holding the rendered charts, one subdirectory per report
+DEFAULT_CHART_CACHE = 'download/.charts'
+
+# Bump when the charts change, so the old payloads are not served
+CHART_CACHE_VERSION = 2
+
+# Size of the blocks read while hashing the reports
+HASH_BLOCK_SIZE = 1024 * 1024  # 1 MB
+
+
+def reportHash(filepath: str) -> str:
+    """Hash the content of a report and of the taxonomy tree downloaded
+    with it, the charts depend on both.
+
+    :param filepath: Path of the report.
+    """
+    digest = hashlib.sha256()
+
+    for path in (filepath, treeFile(filepath)):
+        if path is None:
+            continue
+        with open(path, 'rb') as file:
+            while True:
+                block = file.read(HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        # Keep the report and the tree apart in the hash
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+class ChartCache:
+    """Cache on disk of the charts of the reports, as JSON payloads.
+
+    A chart is keyed by the hash of the content of its report, its name
+    and its parameters, so a report opened again, also uploaded with
+    another name or after a restart, gets its charts without rendering
+    them.
+
+    :param directory: Directory of the cache.
+    :param enabled: Keep the rendered charts.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CHART_CACHE,
+        enabled: bool = True
+    ):
+        self.directory = directory
+        self.enabled = enabled
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **options):
+        """Update the settings of the cache.
+
+        :param options: Any of directory and enabled.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown chart cache option: {name}")
+            setattr(self, name, value)
+
+    def path(self, report_hash: str, name: str, params: dict = None) -> str:
+        """Get the path of the payload of a chart.
+
+        :param report_hash: The hash of the report (see reportHash).
+        :param name: The name of the chart.
+        :param params: The parameters of the chart.
+        """
+        key = json.dumps(
+            [CHART_CACHE_VERSION, plotly.__version__, params or {}],
+            sort_keys=True,
+            default=str
+        )
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+
+        return os.path.join(
+            self.directory,
+            report_hash,
+            f'{name}-{digest}.json'
+        )
+
+    def chart(
+        self,
+        report_hash: str,
+        name: str,
+        build,
+        params: dict = None
+    ) -> str:
+        """Get the payload of a chart, rendering it only if it is not in
+        the cache.
+
+        :param report_hash: The hash of the report (see reportHash).
+        :param name: The name of the chart.
+        :param build: Callable rendering the payload from the params.
+        :param params: The parameters of the chart, passed to build.
+        """
+        params = params or {}
+        if not self.enabled:
+            return build(**params)
+
+        path = self.path(report_hash, name, params)
+        with self._lock:
+            lock = self._building.setdefault(path, threading.Lock())
+
+        # A chart requested again while rendered waits for it
+        try:
+            with lock:
+                try:
+                    with open(path, 'r') as file:
+                        return file.read()
+                except FileNotFoundError:
+                    pass
+
+                payload = build(**params)
+
+                # Written aside and moved, a reader never sees half a
+                # payload
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+                with open(temporary, 'w') as file:
+                    file.write(payload)
+                os.replace(temporary, path)
+        finally:
+            with self._lock:
+                self._building.pop(path, None)
+
+        return payload
+
+
+# Cache shared by every report
+charts = ChartCache()
@@ -0,0 +1,206 @@
+import collections
+import concurrent.futures
+import os
+import signal
+import threading
+import uuid
+
+import numpy as np
+
+from pyscripts.report_registry import reports
+from pyscripts.taxonomy_report import TaxonomyReport
+
+
+# Directory holding the reports saved for the worker processes
+DEFAULT_CHART_COLUMNS = 'download/.columns'
+
+# Seconds a chart can take before it is abandoned
+DEFAULT_CHART_TIMEOUT = 60
+
+# Seconds waited after the timeout for a worker to stop the chart
+TIMEOUT_GRACE = 5
+
+# Number of reports kept loaded by each worker process
+WORKER_LOADED_REPORTS = 2
+
+# Reports loaded in a worker process, by directory
+_worker_reports = collections.OrderedDict()
+
+
+class ChartTimeout(Exception):
+    """A chart that took longer than the timeout of the chart service.
+    """
+
+
+def _timeUp(signum, frame):
+    """Signal handler stopping a chart at its timeout.
+    """
+    raise ChartTimeout("The chart took too long to render")
+
+
+def _loadColumns(directory: str) -> tuple:
+    """Load a saved report and its taxonomy tree in a worker process,
+    reusing the ones loaded by the previous charts.
+
+    :param directory: Directory of the saved report.
+    """
+    loaded = _worker_reports.get(directory)
+
+    if loaded is None:
+        report = TaxonomyReport.load(directory)
+        parents = None
+        path = os.path.join(directory, 'parents.npy')
+        if os.path.exists(path):
+            tax_ids, parent_ids = np.load(path)
+            parents = dict(zip(tax_ids.tolist(), parent_ids.tolist()))
+
+        loaded = (report, parents)
+        _worker_reports[directory] = loaded
+        while len(_worker_reports) > WORKER_LOADED_REPORTS:
+            _worker_reports.popitem(last=False)
+
+    _worker_reports.move_to_end(directory)
+
+    return loaded
+
+
+def _renderInWorker(directory: str, timeout: float, function, args: tuple):
+    """Render a chart in a worker process, stopping it at the timeout.
+
+    :param directory: Directory of the saved report.
+    :param timeout: Seconds the chart can take, None for no limit.
+    :param function: Function called with the report, the parents and
+    the args.
+    :param args: Further arguments of the function.
+    """
+    report, parents = _loadColumns(directory)
+
+    alarm = timeout and hasattr(signal, 'setitimer')
+    if alarm:
+        previous = signal.signal(signal.SIGALRM, _timeUp)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(report, parents, *args)
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+class ChartService:
+    """Renderer of the charts of the reports on a process pool.
+
+    Building and serializing the figures is CPU bound, so the charts of
+    a report are rendered in parallel by worker processes. The report is
+    saved once as .npy files mapped in memory by the workers, instead of
+    being pickled for every chart.
+
+    :param workers: Number of worker processes, the CPU count if None.
+    :param timeout: Seconds a chart can take, None for no limit.
+    :param directory: Directory of the reports saved for the workers.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        timeout: float = DEFAULT_CHART_TIMEOUT,
+        directory: str = DEFAULT_CHART_COLUMNS
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.directory = directory
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def configure(self, **options):
+        """Update the settings of the service.
+
+        :param options: Any of workers, timeout and directory.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown chart service option: {name}")
+            setattr(self, name, value)
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Get the process pool, starting it if needed.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers or os.cpu_count()
+                )
+
+            return self._executor
+
+    def _export(self, report_id: str) -> str:
+        """Save a registered report for the workers, once, and return the
+        directory holding it.
+
+        :param report_id: The ID of the report.
+        """
+        directory = os.path.join(self.directory, report_id)
+
+        with self._lock:
+            if os.path.isdir(directory):
+                return directory
+
+            loaded = reports.load(report_id)
+
+            # Saved aside and moved, a worker never sees half a report
+            temporary = f'{directory}.{uuid.uuid4().hex}.tmp'
+            loaded.report.save(temporary)
+            if loaded.parents is not None:
+                np.save(
+                    os.path.join(temporary, 'parents.npy'),
+                    np.array(
+                        [list(loaded.parents), list(loaded.parents.values())],
+                        dtype=np.int64
+                    )
+                )
+            os.rename(temporary, directory)
+
+        return directory
+
+    def submit(self, report_id: str, function, *args):
+        """Start rendering a chart of a registered report and return its
+        future.
+
+        :param report_id: The ID of the report.
+        :param function: Picklable function called in a worker with the
+        TaxonomyReport, the parents (None without tree) and the args.
+        :param args: Further arguments of the function.
+        """
+        return self._pool().submit(
+            _renderInWorker,
+            self._export(report_id),
+            self.timeout,
+            function,
+            args
+        )
+
+    def render(self, report_id: str, function, *args):
+        """Render a chart of a registered report and return the result of
+        the function.
+
+        :param report_id: The ID of the report.
+        :param function: Picklable function called in a worker with the
+        TaxonomyReport, the parents (None without tree) and the args.
+        :param args: Further arguments of the function.
+        """
+        future = self.submit(report_id, function, *args)
+        timeout = self.timeout + TIMEOUT_GRACE if self.timeout else None
+
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ChartTimeout("The chart took too long to render")
+
+
+# Service shared by every report page
+service = ChartService()
@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+from pyscripts.allowed_file import fileExtension
+from pyscripts.read_store import recordHash
+
+
+# Directory in the upload folder holding the chunked uploads
+CHUNKED_UPLOADS = '.chunked'
+
+# Size of the chunks, when not chosen by the browser
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB
+
+# Bounds of the size of the chunks chosen by the browser
+MIN_CHUNK_SIZE = 256 * 1024  # 256 KB
+MAX_CHUNK_SIZE = 64 * 1024 * 1024  # 64 MB
+
+# Days after which an upload, completed or not, is removed
+UPLOAD_MAX_AGE_DAYS = 2
+
+
+class ChunkError(Exception):
+    """A chunk that can not be accepted, the message explains why.
+    """
+
+
+class ChunkedUpload:
+    """A reads file uploaded by the browser in chunks.
+
+    The chunks can be sent in any order, also at the same time, and are
+    written at their offset of a file of the final size. The received
+    chunks are recorded on disk, so an interrupted upload is resumed by
+    sending only the missing ones, also after a restart of the server.
+
+    Every chunk is checked against the SHA-256 computed by the browser.
+    The SHA-256 of the whole file is computed while the chunks arrive,
+    following the chunks received in order, and recorded on completion
+    for the read store (see read_store.recordHash).
+
+    :param directory: Directory of the upload.
+    :param filename: Name of the reads file.
+    :param size: Number of bytes of the file.
+    :param chunk_size: Number of bytes of the chunks, except the last.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        filename: str,
+        size: int,
+        chunk_size: int
+    ):
+        self.id = os.path.basename(directory)
+        self.directory = directory
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.received = set()
+        self.completed = False
+        self.sha256 = None
+        self._digest = hashlib.sha256()
+        self._hashed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        """Path of the local file."""
+        return os.path.join(self.directory, self.filename)
+
+    @property
+    def chunks(self) -> int:
+        """Number of chunks of the file."""
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunkLength(self, index: int) -> int:
+        """Get the number of bytes of a chunk.
+
+        :param index: The index of the chunk.
+        """
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def missing(self) -> list:
+        """Get the indexes of the chunks not received yet.
+        """
+        return [
+            index for index in range(self.chunks)
+            if index not in self.received
+        ]
+
+    def status(self) -> dict:
+        """Get the JSON serializable status of the upload.
+        """
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunks,
+            'received': sorted(self.received),
+            'completed': self.completed,
+            'sha256': self.sha256
+        }
+
+    def save(self):
+        """Record the status of the upload on disk.
+        """
+        state = os.path.join(self.directory, 'upload.json')
+        with open(state + '.tmp', 'w') as file:
+            json.dump(self.status(), file)
+        os.replace(state + '.tmp', state)
+
+    def _hashChunks(self, index: int = None, data: bytes = None):
+        """Add to the hash of the file the chunks received in order and
+        not hashed yet, read back from the file except the given one.
+
+        Called with the lock held.
+
+        :param index: The index of the chunk just written.
+        :param data: The content of the chunk just written.
+        """
+        while self._hashed in self.received:
+            if self._hashed == index:
+                chunk = data
+            else:
+                with open(self.path, 'rb') as file:
+                    file.seek(self._hashed * self.chunk_size)
+                    chunk = file.read(self.chunkLength(self._hashed))
+            self._digest.update(chunk)
+            self._hashed += 1
+
+    def writeChunk(self, index: int, data: bytes, sha256: str):
+        """Write a chunk at its offset of the file.
+
+        :param index: The index of the chunk.
+        :param data: The content of the chunk.
+        :param sha256: Hex digest of the content computed by the browser.
+        """
+        if self.completed:
+            raise ChunkError("The upload is already completed")
+        if index < 0 or index >= self.chunks:
+            raise ChunkError(f"Chunk {index} out of range")
+        if len(data) != self.chunkLength(index):
+            raise ChunkError(
+                f"Chunk {index} has {len(data)} bytes instead of "
+                f"{self.chunkLength(index)}"
+            )
+        if not sha256:
+            raise ChunkError(f"Checksum of chunk {index} missing")
+        if hashlib.sha256(data).hexdigest() != sha256.lower():
+            raise ChunkError(f"Checksum of chunk {index} does not match")
+
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, index * self.chunk_size)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        with self._lock:
+            self.received.add(index)
+            self._hashChunks(index, data)
+            self.save()
+
+    def complete(self) -> list:
+        """Mark the upload as completed if every chunk was received and
+        return the indexes of the missing chunks.
+        """
+        with self._lock:
+            missing = self.missing()
+            if not missing and not self.completed:
+                self._hashChunks()
+                self.sha256 = self._digest.hexdigest()
+                recordHash(self.path, self.sha256)
+                self.completed = True
+                self.save()
+
+        return missing
+
+
+class ChunkedUploads:
+    """Registry of the chunked uploads, stored in the upload folder.
+
+    :param upload_folder: The upload folder of the application.
+    """
+
+    def __init__(self, upload_folder: str = 'uploads'):
+        self.upload_folder = upload_folder
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def configure(self, upload_folder: str):
+        """Change the upload folder, before the first upload.
+
+        :param upload_folder: The upload folder of the application.
+        """
+        self.upload_folder = upload_folder
+
+    @property
+    def directory(self) -> str:
+        """Directory holding the chunked uploads."""
+        return os.path.join(self.upload_folder, CHUNKED_UPLOADS)
+
+    def _cleanup(self):
+        """Remove the uploads older than UPLOAD_MAX_AGE_DAYS.
+        """
+        limit = time.time() - UPLOAD_MAX_AGE_DAYS * 24 * 3600
+
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.stat().st_mtime < limit:
+                self._uploads.pop(entry.name, None)
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def create(
+        self,
+        filename: str,
+        size: int,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> ChunkedUpload:
+        """Start a new upload, creating an empty file of its final size.
+
+        :param filename: Name of the reads file given by the browser.
+        :param size: Number of bytes of the file.
+        :param chunk_size: Number of bytes of the chunks.
+        """
+        filename = secure_filename(filename)
+        file_ext = fileExtension(filename) if '.' in filename else ''
+        if file_ext != 'fastq' and file_ext != 'fastq.gz':
+            raise ValueError(
+                "Selected files are in the wrong format "
+                "(accepted fastq or fastq.gz)"
+            )
+        if size < 0:
+            raise ValueError("Invalid file size")
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(
+                f"The chunk size must be between {MIN_CHUNK_SIZE} and "
+                f"{MAX_CHUNK_SIZE} bytes"
+            )
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        with self._lock:
+            self._cleanup()
+
+            directory = os.path.join(self.directory, uuid.uuid4().hex)
+            os.makedirs(directory)
+            upload = ChunkedUpload(directory, filename, size, chunk_size)
+
+            # Sparse file, the chunks are written at their offset
+            with open(upload.path, 'wb') as file:
+                file.truncate(size)
+            upload.save()
+
+            self._uploads[upload.id] = upload
+
+        return upload
+
+    def get(self, upload_id: str) -> ChunkedUpload:
+        """Get an upload by its ID, loading it from disk if the server
+        was restarted, None if it does not exist.
+
+        :param upload_id: The ID of the upload.
+        """
+        if not upload_id.isalnum():
+            return None
+
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is not None:
+                return upload
+
+            directory = os.path.join(self.directory, upload_id)
+            try:
+                with open(os.path.join(directory, 'upload.json')) as file:
+                    state = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+
+            upload = ChunkedUpload(
+                directory,
+                state['filename'],
+                state['size'],
+                state['chunk_size']
+            )
+            upload.received = set(state['received'])
+            upload.completed = state['completed']
+            upload.sha256 = state.get('sha256')
+            self._uploads[upload.id] = upload
+
+        return upload
+
+
+# Registry shared by every request of the application
+uploads = ChunkedUploads()
@@ -0,0 +1,148 @@
+import asyncio
+import concurrent.futures
+import gzip
+import os
+
+from pyscripts.allowed_file import fileExtension
+
+
+# Size of the pieces of the reads compressed independently
+DEFAULT_COMPRESSION_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MB
+
+# Fast levels compress FASTQ about 3x and keep up with the link
+DEFAULT_COMPRESSION_LEVEL = 3
+
+
+def _compressChunk(data: bytes, level: int) -> bytes:
+    """Compress a piece of the reads as a gzip member, executed in the
+    worker processes.
+
+    :param data: The piece of the reads.
+    :param level: The gzip compression level.
+    """
+    # mtime=0 makes the output depend only on the input, so identical
+    # reads get the same hash in the read store
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class ReadsCompressor:
+    """Compressor of plain FASTQ files while they are sent to the
+    cluster.
+
+    The reads are split in pieces compressed in parallel by a process
+    pool, and the pieces are sent in order as soon as they are ready.
+    The result is a multi-member gzip file, read as a single .fastq.gz
+    by Centrifuge, Rextract and any zlib based tool.
+
+    :param enabled: Compress the plain FASTQ files.
+    :param level: The gzip compression level.
+    :param workers: Number of worker processes, the CPU count if None.
+    :param chunk_size: Size of the pieces compressed independently.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        level: int = DEFAULT_COMPRESSION_LEVEL,
+        workers: int = None,
+        chunk_size: int = DEFAULT_COMPRESSION_CHUNK_SIZE
+    ):
+        self.enabled = enabled
+        self.level = level
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._executor = None
+
+    def configure(self, **options):
+        """Update the settings of the compressor.
+
+        :param options: Any of enabled, level, workers and chunk_size.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown compression option: {name}")
+            setattr(self, name, value)
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Get the process pool, starting it if needed.
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers or os.cpu_count()
+            )
+
+        return self._executor
+
+    def compresses(self, filename: str) -> bool:
+        """Check if a reads file is compressed while sent.
+
+        :param filename: Name of the reads file.
+        """
+        return self.enabled and fileExtension(filename) == 'fastq'
+
+    def storedName(self, filename: str) -> str:
+        """Get the name of a reads file once sent to the cluster.
+
+        :param filename: Name of the reads file.
+        """
+        return filename + '.gz' if self.compresses(filename) else filename
+
+    async def _pieces(self, blocks):
+        """Regroup a stream of blocks in pieces of chunk_size bytes.
+
+        :param blocks: Async iterable of the bytes blocks.
+        """
+        buffer = bytearray()
+
+        async for data in blocks:
+            buffer += data
+            while len(buffer) >= self.chunk_size:
+                yield bytes(buffer[:self.chunk_size])
+                del buffer[:self.chunk_size]
+
+        if buffer:
+            yield bytes(buffer)
+
+    async def compress(self, blocks, on_read=None):
+        """Compress a stream of blocks of plain reads, yielding the
+        compressed pieces in order.
+
+        At most twice the number of workers pieces are in memory.
+
+        :param blocks: Async iterable of the bytes blocks of the reads.
+        :param on_read: Callable receiving the number of plain bytes of
+        every piece read.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._pool()
+        window = 2 * (self.workers or os.cpu_count())
+        pending = []
+
+        try:
+            async for piece in self._pieces(blocks):
+                if on_read is not None:
+                    on_read(len(piece))
+                pending.append(loop.run_in_executor(
+                    executor,
+                    _compressChunk,
+                    piece,
+                    self.level
+                ))
+
+                # Send the oldest piece once the window is full
+                if len(pending) >= window:
+                    yield await pending.pop(0)
+
+            while pending:
+                yield await pending.pop(0)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+# Compressor shared by every upload
+compressor = ReadsCompressor()
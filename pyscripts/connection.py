@@ -0,0 +1,193 @@
+import asyncio
+import time
+import weakref
+
+import asyncssh
+
+
+# Seconds of inactivity after which a pooled connection is probed
+# before being handed out again
+HEALTH_CHECK_INTERVAL = 60
+
+# Seconds to wait for the health check command to answer
+HEALTH_CHECK_TIMEOUT = 10
+
+# Interval of the SSH keepalive messages sent on idle connections
+KEEPALIVE_INTERVAL = 30
+
+
+def splitHost(hostname: str) -> tuple:
+    """Split a 'host:port' host name in the host and the port, the port
+    is None if not given.
+
+    :param hostname: A string which is the host name to connect.
+    """
+    host, separator, port = hostname.rpartition(':')
+
+    if separator and port.isdigit() and ':' not in host:
+        return host, int(port)
+
+    return hostname, None
+
+
+class PooledConnection:
+    """Authenticated SSH connection kept open between pipeline stages.
+
+    :param conn: The asyncssh client connection.
+    :param loop: The event loop owning the connection.
+    """
+
+    def __init__(self, conn, loop):
+        self.conn = conn
+        self.loop = loop
+        self.last_used = time.monotonic()
+
+    def isClosed(self) -> bool:
+        """Check if the underlying connection can no longer be used.
+        """
+        return self.conn.is_closed() or self.loop.is_closed()
+
+
+class ConnectionPool:
+    """Pool keeping one authenticated SSH connection per user and cluster.
+
+    SFTP sessions and remote commands of every stage are opened as new
+    channels on the pooled connection, so the handshake and the password
+    authentication are paid once. The resolved $SCRATCH path is cached
+    per user and cluster and survives reconnections.
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._scratch_dirs = {}
+        self._locks = weakref.WeakKeyDictionary()
+
+    def _lock(self, key):
+        """Get the lock serializing the connection attempts for a key.
+
+        :param key: The (hostname, username) tuple of the connection.
+        """
+        locks = self._locks.setdefault(asyncio.get_running_loop(), {})
+
+        if key not in locks:
+            locks[key] = asyncio.Lock()
+
+        return locks[key]
+
+    async def _isHealthy(self, pooled) -> bool:
+        """Check if a pooled connection is still usable.
+
+        :param pooled: The PooledConnection to check.
+        """
+        # Connections are bound to the event loop that opened them
+        if pooled.isClosed() or pooled.loop is not asyncio.get_running_loop():
+            return False
+
+        # Recently used connections are trusted without a round trip
+        if time.monotonic() - pooled.last_used < HEALTH_CHECK_INTERVAL:
+            return True
+
+        try:
+            await asyncio.wait_for(
+                pooled.conn.run('true', check=True),
+                timeout=HEALTH_CHECK_TIMEOUT
+            )
+            return True
+        except (OSError, asyncssh.Error, asyncio.TimeoutError):
+            return False
+
+    async def connect(self, hostname: str, username: str, password: str):
+        """Get an authenticated connection, opening it if needed.
+
+        :param hostname: A string which is the host name to connect,
+        followed by ':port' for a port other than the SSH one.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        """
+        key = (hostname, username)
+        host, port = splitHost(hostname)
+
+        async with self._lock(key):
+            pooled = self._connections.get(key)
+
+            if pooled is not None and not await self._isHealthy(pooled):
+                print(f"Reconnecting to {hostname} as {username}")
+                self._discard(key)
+                pooled = None
+
+            if pooled is None:
+                conn = await asyncssh.connect(
+                    host,
+                    port=port or 22,
+                    username=username,
+                    password=password,
+                    known_hosts=None,
+                    keepalive_interval=KEEPALIVE_INTERVAL
+                )
+                pooled = PooledConnection(conn, asyncio.get_running_loop())
+                self._connections[key] = pooled
+
+            pooled.last_used = time.monotonic()
+
+            return pooled.conn
+
+    async def scratchDir(
+        self,
+        hostname: str,
+        username: str,
+        password: str
+    ) -> str:
+        """Get the $SCRATCH directory path of the user on the cluster.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        """
+        key = (hostname, username)
+
+        if key not in self._scratch_dirs:
+            conn = await self.connect(hostname, username, password)
+            command = await conn.run('echo $SCRATCH')
+            self._scratch_dirs[key] = command.stdout[:-1]
+
+        return self._scratch_dirs[key]
+
+    def _discard(self, key):
+        """Drop a connection from the pool, closing it if possible.
+
+        :param key: The (hostname, username) tuple of the connection.
+        """
+        pooled = self._connections.pop(key, None)
+
+        if pooled is not None and not pooled.isClosed():
+            if pooled.loop is asyncio.get_running_loop():
+                pooled.conn.close()
+            else:
+                pooled.loop.call_soon_threadsafe(pooled.conn.close)
+
+    async def close(self, hostname: str = None, username: str = None):
+        """Close the pooled connections.
+
+        :param hostname: Host name of the connection to close, all the
+        connections are closed if not given.
+        :param username: Username of the connection to close.
+        """
+        if hostname is None:
+            keys = list(self._connections.keys())
+        else:
+            keys = [(hostname, username)]
+
+        for key in keys:
+            pooled = self._connections.get(key)
+            self._discard(key)
+
+            if pooled is not None and pooled.loop is asyncio.get_running_loop():
+                await pooled.conn.wait_closed()
+
+
+# Pool shared by every pipeline stage
+pool = ConnectionPool()
@@ -1,36 +1,68 @@
 
+import concurrent.futures
+import os
+import zlib
+
+import plotly
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.io as pio
-import csv
-import random
+from plotly.offline import get_plotlyjs_version
+
+import numpy as np
+
+from pyscripts.chart_aggregation import (
+    rollup,
+    topN,
+    withOther,
+    MAX_TOP_N,
+    WEBGL_MIN_POINTS
+)
+from pyscripts.chart_cache import charts
+from pyscripts.chart_service import service
+from pyscripts.report_registry import reports
+from pyscripts.taxonomy_report import TaxonomyReport, RANK_LEVELS
 
 # Set the theme style for all charts
 pio.templates.default = "ggplot2"
 
-SUPERKINGDOM = 0
-PHYLUM = 1
-CLASS = 2
-ORDER = 3
-FAMILY = 4
-GENUS = 5
-SPECIES = 6
-LEAF = 7
+# Minimum fraction of the reads in a subtree to show it in the sankey
+# chart, keeps the chart readable for large reports
+SANKEY_MIN_FRACTION = 0.001
 
+# Bundle of plotly.js shipped with plotly, served once to the report
+# page instead of being embedded in every chart
+PLOTLYJS_PATH = os.path.join(
+    os.path.dirname(plotly.__file__),
+    'package_data',
+    'plotly.min.js'
+)
+PLOTLYJS_VERSION = get_plotlyjs_version()
 
-def createGenomesizeAbundanceBarChart(dictionary):
-    """Function to generate bar chart (genomeSize vs Abundance).
+
+def chartJSON(fig, validate: bool = True) -> str:
+    """Function to convert a chart in the compact JSON drawn by
+    Plotly.newPlot in the report page.
+
+    :param fig: The plotly figure, or its dict.
+    :param validate: Validate the figure, slow for large charts.
     """
-    keys = list(dictionary.keys())
-    genomesizes = []
-    abundances = []
+    return pio.to_json(fig, validate=validate)
 
-    for key in keys:
-        genomeSize = dictionary[key]['genomeSize']
-        abundance = dictionary[key]['abundance']
 
-        genomesizes.append(genomeSize)
-        abundances.append(abundance)
+def createGenomesizeAbundanceBarChart(
+    report: TaxonomyReport,
+    top_n: int = None
+):
+    """Function to generate bar chart (genomeSize vs Abundance).
+
+    :param report: The TaxonomyReport.
+    :param top_n: Number of the most abundant taxa shown, all if None.
+    """
+    top = topN(report.abundance, top_n)
+    keys = report.name[top]
+    genomesizes = report.genome_size[top]
+    abundances = report.abundance[top]
 
     # Create figure
     fig = make_subplots(rows = 2, cols = 1, shared_xaxes = True)
@@ -62,32 +94,32 @@ def createGenomesizeAbundanceBarChart(dictionary):
     )
     fig.update_xaxes(title_text="Organism", row=2, col=1)
 
-    # Convert the chart in html
-    chart_HTML = pio.to_html(fig, full_html=False)
+    return chartJSON(fig)
 
-    return chart_HTML
 
-
-def createNumreadsNumuniquereadsScatterChart(dictionary):
+def createNumreadsNumuniquereadsScatterChart(
+    report: TaxonomyReport,
+    top_n: int = None
+):
     """Function to generate scatter plot chart (numReads vs numUniqueReads).
-    """
-    keys = list(dictionary.keys())
-    num_reads = []
-    num_unique_reads = []
 
-    for key in keys:
-        read = dictionary[key]['numReads']
-        unique_read = dictionary[key]['numUniqueReads']
+    Large charts are drawn with WebGL.
 
-        num_reads.append(read)
-        num_unique_reads.append(unique_read)
+    :param report: The TaxonomyReport.
+    :param top_n: Number of the taxa with most reads shown, all if None.
+    """
+    top = topN(report.num_reads, top_n)
+    keys = report.name[top]
+    num_reads = report.num_reads[top]
+    num_unique_reads = report.num_unique_reads[top]
+    scatter = go.Scattergl if len(top) >= WEBGL_MIN_POINTS else go.Scatter
 
     # Create figure
     fig = go.Figure()
 
     # Add numReads trace
     fig.add_trace(
-        go.Scatter(
+        scatter(
             x = keys,
             y = num_reads,
             name = 'Number of reads',
@@ -97,7 +129,7 @@ def createNumreadsNumuniquereadsScatterChart(dictionary):
 
     # Add numUniqueReads trace
     fig.add_trace(
-        go.Scatter(
+        scatter(
             x = keys,
             y = num_unique_reads,
             name = 'Number of unique reads',
@@ -110,25 +142,23 @@ def createNumreadsNumuniquereadsScatterChart(dictionary):
         xaxis_title="Organism"
     )
 
-    # Convert the chart in html
-    chart_HTML = pio.to_html(fig, full_html=False)
+    return chartJSON(fig)
 
-    return chart_HTML
 
-
-def createAbundancePieChart(dict):
+def createAbundancePieChart(report: TaxonomyReport, top_n: int = None):
     """Function to generate pie chart (abundance).
+
+    :param report: The TaxonomyReport.
+    :param top_n: Number of the most abundant taxa shown, the others are
+    gathered in a single slice. All if None.
     """
-    keys = list(dict.keys())
-    names = []
-    values = []
-    
     # Select only values and names with abundance > 0.0
-    for key in keys:
-        value = dict[key]['abundance']
-        if value > 0.0:
-            names.append(key)
-            values.append(value)
+    selected = report.abundance > 0.0
+    names, values = withOther(
+        report.name[selected],
+        report.abundance[selected],
+        top_n
+    )
 
     # Create the figure
     fig = go.Figure(
@@ -143,28 +173,28 @@ def createAbundancePieChart(dict):
         ]
     )
 
-    # Convert the chart in html
-    chart_html = pio.to_html(fig, full_html=False)  
+    return chartJSON(fig)
 
-    return chart_html
 
-
-def createUniquereadsBarChart(dict):
+def createUniquereadsBarChart(
+    report: TaxonomyReport,
+    top_n: int = None,
+    min_reads: int = 1000
+):
     """Function to generate bar chart (unique reads).
-    """
-    keys = list(dict.keys())
-    values = []
-    names = []
-    unique_reads = []
-
-    for key in keys:
-        values.append(dict[key]['numUniqueReads'])
 
-    # Remove values under 1000 reads
-    for i in range(len(values)):
-        if values[i] > 1000:
-            names.append(keys[i])
-            unique_reads.append(values[i])
+    :param report: The TaxonomyReport.
+    :param top_n: Number of the taxa with most unique reads shown, the
+    others are gathered in a single bar. All if None.
+    :param min_reads: Unique reads under which a taxon is not shown.
+    """
+    # Remove values under min_reads reads
+    selected = report.num_unique_reads > min_reads
+    names, unique_reads = withOther(
+        report.name[selected],
+        report.num_unique_reads[selected],
+        top_n
+    )
 
     # Create chart figure
     fig = go.Figure(
@@ -180,186 +210,288 @@ def createUniquereadsBarChart(dict):
         xaxis_title="Organism"
     )
 
-    # Convert the chart in html
-    chart_html = pio.to_html(fig, full_html=False)  
+    return chartJSON(fig)
 
-    return chart_html
 
+def nodeColor(tax_id: int, alpha: float = 1) -> str:
+    """Function to get the color of a taxon in the sankey chart, always
+    the same for the same taxID.
 
-def createSankeyChart(dictionary):
-    """Function to generate sankey chart (organism hierarchy).
+    :param tax_id: The taxID of the taxon.
+    :param alpha: The opacity of the color.
     """
-    keys = list(dictionary.keys())
-    source = []
-    dest = []
-    values = []
-    colors = []
-
-    for i in range(len(keys)):
-        taxrank = dictionary[keys[i]]['taxRank']
-        classrank = 0
-
-        # Assign classrank to current organism
-        if taxrank == 'superkingdom':
-            classrank = SUPERKINGDOM
-        if taxrank == 'phylum':
-            classrank = PHYLUM
-        if taxrank == 'class':
-            classrank = CLASS
-        if taxrank == 'order':
-            classrank = ORDER
-        if taxrank == 'family':
-            classrank = FAMILY
-        if taxrank == 'genus':
-            classrank = GENUS
-        if taxrank == 'species':
-            classrank = SPECIES
-        if taxrank == 'leaf':
-            classrank = LEAF
-
-        # Set the value of j
-        j = i + 1
-
-        # Search for destinations (aka direct discendents for the organism)
-        for k in range(j, len(keys)):
-            nextrank = dictionary[keys[k]]['taxRank']
-            next_genomesize = dictionary[keys[k]]['genomeSize']
-
-            # Assign classrank to each organism
-            if nextrank == 'superkingdom':
-                next_classrank = SUPERKINGDOM
-            if nextrank == 'phylum':
-                next_classrank = PHYLUM
-            if nextrank == 'class':
-                next_classrank = CLASS
-            if nextrank == 'order':
-                next_classrank = ORDER
-            if nextrank == 'family':
-                next_classrank = FAMILY
-            if nextrank == 'genus':
-                next_classrank = GENUS
-            if nextrank == 'species':
-                next_classrank = SPECIES
-            if nextrank == 'leaf':
-                next_classrank = LEAF
-
-            if next_classrank > classrank:
-                # Add link
-                source.append(i)
-                dest.append(k)
-                values.append(next_genomesize)
-                #print(f"{keys[i]} [{taxrank}] -> {keys[k]} [{nextrank}]")
-            else:
-                break
-    
-    # Generate random colors for diagram's nodes
-    for i in range(len(source)):
-        # Generate color based on index
-        r = random.randint(1, 255)
-        g = random.randint(1, 255)
-        b = 128                                     # Fixed value for blue
-        colors.append(f'rgba({r}, {g}, {b}, 1)')
-
-    # Generate link's colors
-    link_colors = [color.replace('1)', '0.4)') for color in colors]
+    digest = zlib.crc32(str(tax_id).encode())
+    r = 1 + digest % 255
+    g = 1 + (digest >> 8) % 255
+    b = 128                                     # Fixed value for blue
 
-    # Create chart figure
-    fig = go.Figure(
-        data=[
-            go.Sankey(
-                valueformat = ".0f",
-                # Define nodes
-                node = dict(
-                    pad = 15,
-                    thickness = 15,
-                    line = dict(color = "black", width = 0.5),
-                    label = keys,
-                    color = colors
-                ),
-                # Add links
-                link = dict(
-                    source = source, 
-                    target = dest,
-                    value = [g if g > 0 else 1 for g in values],
-                    color = link_colors, 
-                    hovercolor = colors
-                )
-            )
-        ]
-    )
-    fig.update_layout(height=1500)
+    return f'rgba({r}, {g}, {b}, {alpha})'
 
-    # Convert the chart in html
-    chart_html = pio.to_html(fig, full_html=False)  
 
-    return chart_html
+def treeDepths(parents: np.ndarray) -> np.ndarray:
+    """Function to get the depth of every node of a tree, visiting each
+    node once.
 
+    :param parents: The position of the parent of every node, -1 for the
+    roots.
+    """
+    parents = parents.tolist()
+    depths = [-1] * len(parents)
+
+    for node in range(len(parents)):
+        path = []
+        while node >= 0 and depths[node] == -1:
+            # Marked before the parent is visited, to stop on cycles
+            depths[node] = -2
+            path.append(node)
+            node = parents[node]
+
+        depth = depths[node] if node >= 0 and depths[node] >= 0 else -1
+        for node in reversed(path):
+            depth += 1
+            depths[node] = depth
+
+    return np.array(depths, dtype=np.int64)
+
+
+def createSankeyChart(
+    report: TaxonomyReport,
+    parents: dict = None,
+    max_depth: int = None,
+    min_fraction: float = SANKEY_MIN_FRACTION
+):
+    """Function to generate sankey chart (organism hierarchy).
+
+    Every taxon is linked to its parent, from the taxonomy tree if given
+    or else inferred from the order of the rows. The links carry the
+    reads of the subtree of the child.
+
+    :param report: The TaxonomyReport.
+    :param parents: The parent taxID of every taxID (see loadParents).
+    :param max_depth: Deepest level of the tree shown, all if None.
+    :param min_fraction: Minimum fraction of the reads in the subtree of
+    a taxon to show it.
+    """
+    if parents is not None:
+        parent = report.linkParents(parents)
+    else:
+        parent = report.inferParents()
+    depth = treeDepths(parent)
+
+    # Reads of each subtree, adding the children to the parents from the
+    # deepest level up
+    subtree = report.num_reads.astype(np.int64)
+    for level in range(int(depth.max(initial=0)), 0, -1):
+        nodes = np.flatnonzero((depth == level) & (parent >= 0))
+        np.add.at(subtree, parent[nodes], subtree[nodes])
+
+    # Prune the small and the deep subtrees, their parents are kept too
+    keep = subtree >= min_fraction * report.num_reads.sum()
+    if max_depth is not None:
+        keep &= depth <= max_depth
+
+    # Number the kept nodes
+    kept = np.flatnonzero(keep)
+    position = np.full(len(report), -1, dtype=np.int64)
+    position[kept] = np.arange(len(kept))
+
+    # Add links from the kept parents to the kept children
+    children = kept[(parent[kept] >= 0)]
+    children = children[keep[parent[children]]]
+    source = position[parent[children]]
+    dest = position[children]
+    values = np.maximum(subtree[children], 1)
+
+    keys = report.name[kept]
+    tax_ids = report.tax_id[kept].tolist()
+    colors = [nodeColor(tax_id) for tax_id in tax_ids]
+
+    # Generate link's colors, the ones of the children
+    link_colors = [
+        nodeColor(tax_id, 0.4) for tax_id in report.tax_id[children].tolist()
+    ]
+    link_hovercolors = [colors[node] for node in dest.tolist()]
+
+    # Create chart figure, the sankey trace is not validated by plotly
+    # as it checks every color one by one
+    fig = go.Figure().update_layout(height=1500).to_dict()
+    fig['data'] = [
+        dict(
+            type = 'sankey',
+            valueformat = ".0f",
+            # Define nodes
+            node = dict(
+                pad = 15,
+                thickness = 15,
+                line = dict(color = "black", width = 0.5),
+                label = keys,
+                color = colors
+            ),
+            # Add links
+            link = dict(
+                source = source, 
+                target = dest,
+                value = values,
+                color = link_colors, 
+                hovercolor = link_hovercolors
+            )
+        )
+    ]
 
-def getMetrics(dict):
+    return chartJSON(fig, validate=False)
+
+
+def getMetrics(report: TaxonomyReport):
     """Function to get relevant values.
     """
-    keys = dict.keys()
-    max_abundance = 0.0
-    max_num_reads = 0
-    max_num_uniquereads = 0
-    max_genomesize = 0
-    max_abundance_name = ''
-    max_num_reads_name = ''
-    max_num_uniquereads_name = ''
-    max_genomesize_name = ''
-
-    for key in keys:
-        abundance = dict[key]['abundance']
-        num_reads = dict[key]['numReads']
-        num_uniquereads = dict[key]['numUniqueReads']
-        genomesize = dict[key]['genomeSize']
-
-        # Update max values
-        if abundance > max_abundance:
-            max_abundance = abundance
-            max_abundance_name = key
-        
-        if num_reads > max_num_reads:
-            max_num_reads = num_reads
-            max_num_reads_name = key
-
-        if num_uniquereads > max_num_uniquereads:
-            max_num_uniquereads = num_uniquereads
-            max_num_uniquereads_name = key
-
-        if genomesize > max_genomesize:
-            max_genomesize = genomesize
-            max_genomesize_name = key
+    metrics = []
+
+    for column in (
+        report.abundance,
+        report.num_reads,
+        report.num_unique_reads,
+        report.genome_size
+    ):
+        # First organism with the max value, none if no value is > 0
+        if len(column) > 0 and column.max() > 0:
+            position = int(column.argmax())
+            metrics.append([report.name[position], column[position].item()])
+        else:
+            metrics.append(['', column.dtype.type(0).item()])
 
     # Convert max_abundance in percentage
-    max_abundance_perc = round(max_abundance * 100)
+    metrics[0][1] = round(metrics[0][1] * 100)
+
+    return metrics
+
+
+# Charts of the report page, by name, with their default parameters
+CHARTS = {
+    'abu_chart': createAbundancePieChart,
+    'uni_rea_bar_chart': createUniquereadsBarChart,
+    'reads_scatter_chart': createNumreadsNumuniquereadsScatterChart,
+    'genomesize_abundance_bar_chart': createGenomesizeAbundanceBarChart,
+    'hierarchy_sunkey_chart': createSankeyChart
+}
+CHART_PARAMS = {
+    'abu_chart': {'rank': None, 'top_n': 20},
+    'uni_rea_bar_chart': {'rank': None, 'top_n': 50, 'min_reads': 1000},
+    'reads_scatter_chart': {'rank': None, 'top_n': 5000},
+    'genomesize_abundance_bar_chart': {'rank': None, 'top_n': 50},
+    'hierarchy_sunkey_chart': {
+        'max_depth': None,
+        'min_fraction': SANKEY_MIN_FRACTION
+    }
+}
+
+# Charts drawn on the taxonomy tree of the report
+TREE_CHARTS = {'hierarchy_sunkey_chart'}
+
+
+def chartParams(name: str, args) -> dict:
+    """Function to get the parameters of a chart, the defaults of
+    CHART_PARAMS updated with the ones requested by the page.
+
+    :param name: The name of the chart, a key of CHARTS.
+    :param args: Mapping of the requested parameters, 'rank' to view the
+    taxa aggregated at a rank and 'top' for the number of taxa shown.
+    """
+    params = dict(CHART_PARAMS.get(name, {}))
+
+    rank = args.get('rank')
+    if rank and 'rank' in params:
+        if rank not in RANK_LEVELS:
+            raise ValueError(f"Unknown rank: {rank}")
+        params['rank'] = rank
+
+    top = args.get('top')
+    if top and 'top_n' in params:
+        if not top.isdigit() or not 0 < int(top) <= MAX_TOP_N:
+            raise ValueError(f"The top must be between 1 and {MAX_TOP_N}")
+        params['top_n'] = int(top)
+
+    return params
+
+
+def buildChart(
+    report: TaxonomyReport,
+    parents: dict,
+    name: str,
+    params: dict
+) -> str:
+    """Function to render a chart of a report, executed in the workers of
+    the chart service.
+
+    :param report: The TaxonomyReport.
+    :param parents: The parent taxID of every taxID, None without tree.
+    :param name: The name of the chart, a key of CHARTS.
+    :param params: The parameters of the chart.
+    """
+    params = dict(params)
+
+    # View the taxa aggregated at a rank
+    rank = params.pop('rank', None)
+    if rank is not None:
+        report = rollup(report, rank, parents)
+
+    if name in TREE_CHARTS:
+        params['parents'] = parents
 
-    return [[max_abundance_name, max_abundance_perc], 
-            [max_num_reads_name, max_num_reads], 
-            [max_num_uniquereads_name, max_num_uniquereads], 
-            [max_genomesize_name, max_genomesize]]
+    return CHARTS[name](report, **params)
 
 
-def createTSVDictionary(filepath):
-    """Function to create dictionary out of the report.tsv file.
+def reportChart(report_id: str, name: str, params: dict = None) -> str:
+    """Function to get the JSON of a chart of a registered report.
+
+    The chart is rendered once per report and parameters by the chart
+    service, then taken from the cache.
+
+    :param report_id: The ID of the report (see ReportRegistry).
+    :param name: The name of the chart, a key of CHARTS.
+    :param params: The parameters of the chart (see chartParams), the
+    defaults if None.
+    """
+    if name not in CHARTS:
+        raise KeyError(name)
+    if params is None:
+        params = CHART_PARAMS.get(name)
+
+    def build(**params):
+        return service.render(report_id, buildChart, name, params)
+
+    return charts.chart(report_id, name, build, params)
+
+
+def reportCharts(report_id: str) -> dict:
+    """Function to render all the charts of a registered report in
+    parallel, the charts that fail are None.
+
+    :param report_id: The ID of the report (see ReportRegistry).
     """
-    # Empty dictionary
-    dict = {}
-
-    # Open the file in binary reading (data file)
-    with open(filepath, 'r') as file:
-        reader = csv.DictReader(file, delimiter='\t')
-
-        for row in reader:
-            name = row['name']
-            dict[name] = {
-                'taxID': row['taxID'],
-                'taxRank': row['taxRank'],
-                'genomeSize': int(row['genomeSize']),
-                'numReads': int(row['numReads']),
-                'numUniqueReads': int(row['numUniqueReads']),
-                'abundance': float(row['abundance'])
-            }
-
-    return dict
+    def chart(name):
+        try:
+            return reportChart(report_id, name)
+        except Exception as error:
+            print(f"Chart {name} of report {report_id} failed: {error}")
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(len(CHARTS)) as executor:
+        return dict(zip(CHARTS, executor.map(chart, CHARTS)))
 
+
+def createReport(filepath):
+    """Function to create the ID and the metrics of a report.tsv file, as
+    the arguments of the report page.
+
+    The charts and the rows of the table are not rendered here, the page
+    requests them by the ID of the report (see reportChart and
+    ReportQuery).
+    """
+    # Parse the tsv file and register it for the requests of the page
+    report = TaxonomyReport.fromTSV(filepath)
+    report_id = reports.register(filepath, report)
+
+    return {
+        'report_id': report_id,
+        'metrics': getMetrics(report)
+    }
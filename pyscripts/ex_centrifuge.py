@@ -1,24 +1,108 @@
 
+import asyncio
 import asyncssh
 import os
-import time
 import logging
 
+from pyscripts.connection import pool
+from pyscripts.execution import backends
+from pyscripts.index_cache import (
+    INDEX_NAME,
+    buildIndexCommands,
+    indexDir,
+    indexKey,
+    lookupIndex
+)
+from pyscripts.library_cache import (
+    buildRefreshScript,
+    cacheDir,
+    libraryCommands,
+    linkTaxonomyCommand,
+    refreshCommand,
+    snapshotLabel
+)
 from pyscripts.progress import uploadProgress, downloadProgress
+from pyscripts.read_store import linkName, storeReads
+from pyscripts.resources import (
+    READS_SAMPLE_BYTES,
+    ResourceEstimate,
+    estimator,
+    remoteSize,
+    sampleReads
+)
+from pyscripts.sharding import classifyCommand, mergeCommands, splitCommands
+from pyscripts.taxonomy_report import TREE_FILE, treeCommand
+from pyscripts.transfer import engine
+from pyscripts.workspace import cleanupCommand, localDir, remoteWorkdir
 
 
 #logging.basicConfig(level=logging.DEBUG)
 
 
+def indexCommands(
+    scratch_dir: str,
+    domains: list,
+    snapshot: str,
+    index_cached: bool,
+    threads: int
+) -> str:
+    """Function to build the script lines building the index of the
+    domains in the cache, unless it is already there, and linking it in
+    the working directory.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the snapshot of the cached libraries.
+    :param index_cached: True if the index of the domains is already
+    in the index cache.
+    :param threads: Number of threads of centrifuge-build.
+    """
+    commands = ''
+
+    # 1. Build the index in the cache from the cached libraries
+    # (skipped on cache hit)
+    if not index_cached:
+        commands += libraryCommands(scratch_dir, domains)
+        commands += buildIndexCommands(scratch_dir, domains, snapshot, threads)
+    # 2. Link the cached index in the working directory
+    key = indexKey(domains, snapshot)
+    commands += f'ln -sfn {indexDir(scratch_dir, key)} index\n'
+
+    return commands
+
+
 async def buildCentrifugeScript(
+        run_id: str,
         inputs: list, 
-        account: str
+        account: str,
+        scratch_dir: str,
+        domains: list,
+        snapshot: str,
+        index_cached: bool,
+        backend: str = 'slurm',
+        resources: ResourceEstimate = None
 ):
     """Function to build the Centrifuge script.
 
+    :param run_id: The ID of the run.
     :param inputs: Array of strings containing the names of the
     raw sequences file/s to include in the script.
+    :param scratch_dir: The $SCRATCH directory path.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the snapshot of the cached libraries.
+    :param index_cached: True if the index of the domains is already
+    in the index cache.
+    :param backend: The name of the backend running the script.
+    :param resources: The ResourceEstimate of the job, the fallback
+    resources if not given.
     """
+    executor = backends.get(backend)
+    if resources is None:
+        resources = estimator.estimate('centrifuge')
+    threads = executor.cores(resources)
+
     # Extracting sequences name
     if len(inputs) == 1:
         seq1 = os.path.basename(inputs[0])
@@ -27,314 +111,714 @@ async def buildCentrifugeScript(
         seq2 = os.path.basename(inputs[1])
 
     # Write the script file
-    with open('scripts/cen_script.sh', 'w', newline='\n') as file:
+    script = os.path.join(localDir('scripts', run_id), 'cen_script.sh')
+    with open(script, 'w', newline='\n') as file:
         file.write('#!/bin/bash' + '\n\n')
     
         # Add directories
-        file.write(
-            '#SBATCH --job-name=centrifuge\n'
-            '#SBATCH --time=24:00:00\n'
-            '#SBATCH -p g100_usr_bmem \n'
-            '#SBATCH -N 1\n'
-            '#SBATCH -n 48 \n'
-            '#SBATCH --mem=500G \n'
-            f'#SBATCH --account {account}\n\n'
-        )
+        file.write(executor.header('centrifuge', account, resources))
 
         # Add instructions
-        # 1. Build the index
-        file.write(
-            'centrifuge-build -p 48 --conversion-table seqid2taxid.map '
-            '--taxonomy-tree taxonomy/nodes.dmp --name-table '
-            'taxonomy/names.dmp sequences.fna database/abv'
-            '\n'
-        )
+        # 1. Build the index if needed and link it in the working
+        # directory
+        index = f'index/{INDEX_NAME}'
+        file.write(indexCommands(
+            scratch_dir, 
+            domains, 
+            snapshot, 
+            index_cached, 
+            threads
+        ))
         # 2. Execute Centrifuge on the index
         # 2.1 Case single-end reads
         if len(inputs) == 1:        
             file.write(
-                f'centrifuge -x database/abv -U {seq1} '
-                '-S reports/centrifuge_output.txt -p 48'
+                f'centrifuge -x {index} -U {seq1} '
+                f'-S reports/centrifuge_output.txt -p {threads}'
                 '\n'
             )
         # 2.2 Case paired-end reads
         elif len(inputs) == 2:  
             file.write(
-                f'centrifuge -x database/abv -1 {seq1} -2 {seq2} '
-                '-S reports/centrifuge_output.txt -p 48'
+                f'centrifuge -x {index} -1 {seq1} -2 {seq2} '
+                f'-S reports/centrifuge_output.txt -p {threads}'
                 '\n'
             )
+        # 3. Extract the taxonomy tree of the taxa in the report
+        file.write(treeCommand())
     
     # Return absolute path of the file
-    return os.path.abspath('scripts/cen_script.sh')
+    return os.path.abspath(script)
+
+
+async def buildShardedScripts(
+        run_id: str,
+        inputs: list, 
+        account: str,
+        scratch_dir: str,
+        domains: list,
+        snapshot: str,
+        index_cached: bool,
+        resources: ResourceEstimate,
+        scatter: ResourceEstimate,
+        gather: ResourceEstimate
+) -> list:
+    """Function to build the scripts of a sharded Centrifuge execution
+    on Slurm: a job splitting the reads in shards, a job array classifying
+    each shard on its own node, and a job merging their results in the
+    files of an unsharded execution. Return the absolute paths of the
+    scripts, in this order.
+
+    :param run_id: The ID of the run.
+    :param inputs: Array of strings containing the names of the
+    raw sequences file/s to include in the scripts.
+    :param account: The account charged for the jobs.
+    :param scratch_dir: The $SCRATCH directory path.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the snapshot of the cached libraries.
+    :param index_cached: True if the index of the domains is already
+    in the index cache.
+    :param resources: The ResourceEstimate of each task of the job
+    array, with a task per shard.
+    :param scatter: The ResourceEstimate of the job splitting the reads.
+    :param gather: The ResourceEstimate of the job merging the results.
+    """
+    executor = backends.get('slurm')
+    directory = localDir('scripts', run_id)
+    scripts = []
+
+    for name, job_name, estimate, commands in (
+        (
+            'cen_script.sh', 
+            'centrifuge_scatter', 
+            scatter, 
+            # 1. Build the index if needed, shared by the shards, and
+            # split the reads
+            indexCommands(
+                scratch_dir, 
+                domains, 
+                snapshot, 
+                index_cached, 
+                executor.cores(scatter)
+            ) + splitCommands(inputs, resources.tasks)
+        ), 
+        (
+            'cen_shard.sh', 
+            'centrifuge', 
+            resources, 
+            # 2. Execute Centrifuge on the shard of the task
+            classifyCommand(
+                f'index/{INDEX_NAME}', 
+                inputs, 
+                executor.cores(resources)
+            )
+        ), 
+        (
+            'cen_merge.sh', 
+            'centrifuge_gather', 
+            gather, 
+            # 3. Merge the results and extract the taxonomy tree
+            mergeCommands(resources.tasks)
+        )
+    ):
+        script = os.path.join(directory, name)
+        with open(script, 'w', newline='\n') as file:
+            file.write('#!/bin/bash' + '\n\n')
+            file.write(executor.header(job_name, account, estimate))
+            file.write(commands)
+        scripts.append(os.path.abspath(script))
+
+    return scripts
+
+
+async def linkReads(
+    hostname: str, 
+    username: str, 
+    password: str,
+    run_id: str,
+    inputs: list,
+    objects: list
+) -> list:
+    """Function to link reads already in the store of the cluster in the
+    working directory of a run and return the names of the links.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param inputs: Array of strings containing the names of the
+    raw sequences file/s to include in the script.
+    :param objects: Array of strings containing the paths of the
+    stored reads, in the same order of inputs.
+    """
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    # Remove the working directories of the old runs
+    await conn.run(cleanupCommand(scratch_dir))
+
+    # Start the sftp client
+    async with conn.start_sftp_client() as sftp:
+        # Create the working directory of the run
+        workdir = remoteWorkdir(scratch_dir, run_id)
+        print(f"Creating the working directory {workdir}")
+        await sftp.makedirs(workdir, exist_ok=True)
+
+        # Navigate in the working directory
+        await sftp.chdir(workdir)
+
+        # Link the stored reads in the working directory
+        names = [
+            linkName(input, object) for input, object in zip(inputs, objects)
+        ]
+        for name, object in zip(names, objects):
+            await sftp.symlink(object, name)
+
+    return names
 
 
 async def uploadReads(
     hostname: str, 
     username: str, 
     password: str,
-    account: str,  
+    run_id: str,
     inputs: list
-):
-    """Function to upload input reads and the Centrifuge script
-    on the cluster using SFTP.
+) -> list:
+    """Function to upload input reads in the working directory of a run
+    on the cluster using SFTP and return their names in it.
 
     :param hostname: A string which is the host name to connect.
     :param username: A string which is the username of the account
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
     :param inputs: Array of strings containing the names of the
     raw sequences file/s to include in the script.
     """
-    async with asyncssh.connect(
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    # Start the sftp client
+    async with conn.start_sftp_client() as sftp:
+        # Upload input1 and input 2 files in the reads store, skipping
+        # the ones already uploaded by a previous run
+        print(f"Uploading files with paths: {inputs}")
+        objects = await storeReads(
+            sftp, 
+            scratch_dir, 
+            inputs, 
+            progress_handler=uploadProgress
+        )
+        print("OK")
+
+    names = await linkReads(
         hostname, 
-        username=username,
-        password=password,
-        known_hosts=None
-    ) as conn:
-        # Get $SCRATCH directory path
-        command = await conn.run('echo $SCRATCH')
-        scratch_dir = command.stdout[:-1]
+        username, 
+        password, 
+        run_id, 
+        inputs, 
+        objects
+    )
 
-        # Start the sftp client
-        async with conn.start_sftp_client() as sftp:
-            # Navigate to $SCRATCH directory
-            await sftp.chdir(scratch_dir)
+    print("Files uploaded")
 
-            # Print all the content of the scratch directory
-            ls = await sftp.listdir('.')
-            print(f"Content of the directory: \n{ls}")
+    return names
 
-            # Delete 'dec' directory if already exists
-            if 'dec' in ls:
-                print("Deleting previous decontamination directory")
-                await sftp.rmtree('dec')
 
-            # Create a new 'dec' directory
-            print("Creating the decontamination directory")
-            await sftp.mkdir('dec')
+async def inspectReads(
+    hostname: str, 
+    username: str, 
+    password: str,
+    run_id: str,
+    names: list
+) -> dict:
+    """Function to get the size of the reads linked in the working
+    directory of a run: the bytes stored on the cluster, the bytes once
+    uncompressed and the number of reads, both estimated from the head
+    of the files.
 
-            # Navigate in the working directory
-            print("Moving to dec directory")
-            await sftp.chdir('dec')
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param names: Array of strings containing the names of the reads
+    in the working directory.
+    """
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
 
-            # Upload input1 and input 2 files
-            for input in inputs:                
-                print(f"Uploading file with path: {input}")
-                await sftp.put(input, progress_handler=uploadProgress)
-                print("OK")
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
 
-            # Build the script file
-            script = await buildCentrifugeScript(inputs, account)
+    async def inspect(sftp, name):
+        attrs = await sftp.stat(name)
+        async with sftp.open(name, 'rb') as file:
+            head = await file.read(READS_SAMPLE_BYTES)
+        return sampleReads(head, attrs.size)
 
-            # Upload script file
-            await sftp.put(script, progress_handler=uploadProgress)
-            print("OK")
+    async with conn.start_sftp_client() as sftp:
+        await sftp.chdir(remoteWorkdir(scratch_dir, run_id))
+        samples = await asyncio.gather(*[
+            inspect(sftp, name) for name in names
+        ])
 
-    print("Files uploaded")
+    return {
+        metric: sum(sample[metric] for sample in samples)
+        for metric in ('bytes', 'raw_bytes', 'reads')
+    }
 
 
-async def executeCentrifuge(
+async def refreshLibraries(
     hostname: str, 
     username: str, 
     password: str, 
+    run_id: str, 
     domains: list
+) -> tuple:
+    """Function to refresh the library cache of the domains on Galileo100
+    and return the label of the snapshot of the libraries and whether
+    their index is already in the index cache.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    """
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    # Get the working directory of the run
+    workdir = remoteWorkdir(scratch_dir, run_id)
+
+    async with conn.start_sftp_client() as sftp:
+        # Upload the script refreshing the shared library cache in the
+        # working directory, each run executes its own copy
+        await sftp.makedirs(workdir, exist_ok=True)
+        await engine.put(
+            sftp, 
+            [buildRefreshScript(run_id)], 
+            workdir, 
+            progress_handler=uploadProgress
+        )
+
+        # Refresh the taxonomy and the libraries of the domains,
+        # downloading only the new or changed assemblies
+        print(f"Refreshing library cache ({', '.join(domains)})")
+        refresh = refreshCommand(
+            scratch_dir, 
+            domains, 
+            f'{workdir}/refresh_library.sh'
+        )
+        command = await conn.run(
+            "bash -lc 'module load profile/bioinf && "
+            "export PATH=$SCRATCH/centrifuge:$PATH && "
+            f"{refresh}'", 
+            check=True
+        )
+        snapshot = snapshotLabel(command.stdout, domains)
+        print(f"Library snapshot: {snapshot}")
+
+        # Check if the index of the domains can be reused
+        index_cached = await lookupIndex(
+            sftp, 
+            scratch_dir, 
+            indexKey(domains, snapshot)
+        )
+        print(f"Index cache {'hit' if index_cached else 'miss'}")
+
+    return snapshot, index_cached
+
+
+async def indexSize(
+    hostname: str, 
+    username: str, 
+    password: str, 
+    domains: list, 
+    snapshot: str
+) -> int:
+    """Function to get the size in bytes of the cached index of the
+    domains, 0 if it is not in the index cache.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the snapshot of the cached libraries.
+    """
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    return await remoteSize(
+        conn, 
+        [indexDir(scratch_dir, indexKey(domains, snapshot))]
+    )
+
+
+async def prepareCentrifuge(
+    hostname: str, 
+    username: str, 
+    password: str, 
+    run_id: str, 
+    account: str, 
+    inputs: list, 
+    domains: list, 
+    backend: str = 'slurm', 
+    reads: dict = None, 
+    snapshot: str = None, 
+    index_cached: bool = None
 ):
-    """Function to connect to Galileo100 and run the Centrifuge
-    script.
+    """Function to refresh the library cache and upload the Centrifuge
+    script on Galileo100, returning the resources estimated for its job.
 
     :param hostname: A string which is the host name to connect.
     :param username: A string which is the username of the account
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param inputs: Array of strings containing the names of the
+    raw sequences file/s to include in the script.
     :param domains: Array of strings containing the names of the
     biological domains.
+    :param backend: The name of the backend running the script.
+    :param reads: The size of the reads, as returned by inspectReads,
+    the job gets the fallback resources if not given.
+    :param snapshot: Label of the snapshot of the libraries, as returned
+    by refreshLibraries, the library cache is refreshed if not given.
+    :param index_cached: True if the index of the domains is already in
+    the index cache, as returned by refreshLibraries.
     """
-    # Create the domains string
-    dom = ''
-    for i in range(len(domains)):
-        if i == 0:
-            dom = domains[i]
-        else:
-            dom += ',' + domains[i]
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
 
-    print("Executing centrifuge")
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
 
-    # Connect to remote host
-    async with asyncssh.connect(
-        hostname, 
-        username=username,
-        password=password, 
-        known_hosts=None
-    ) as conn:
-        async with conn.create_process() as proc:
-            # Navigate in the working directory
-            proc.stdin.write('cd $SCRATCH/dec' + '\n')
-            await proc.stdin.drain()
-
-            # Import profile and modules
-            proc.stdin.write('module load profile/bioinf' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('module load autoload gcc' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('module load autoload python' + '\n')
-            await proc.stdin.drain()
-            print("Module loaded")
-
-            # Export $PATH to include centrifuge
-            proc.stdin.write('export PATH=$SCRATCH/centrifuge:$PATH' + '\n')
-            await proc.stdin.drain()
-            print("Path exported")
-
-            # Create directories
-            proc.stdin.write('mkdir taxonomy library database reports' + '\n')
-            await proc.stdin.drain()
-            print("directories created")
-
-            # Download taxonomy
-            proc.stdin.write(
-                'echo "$(centrifuge-download -o taxonomy taxonomy)$"' + '\n'
-            )
-            await proc.stdin.drain()
-            result = await proc.stdout.readuntil('$')
-            print("taxonomy downloaded")
-
-            # Download sequences
-            print(f"Started library download ({dom})")     
-            for i in range(len(domains)):
-                print(f"Downloading {domains[i]} sequences --> ", end="")
-                if i == 0:
-                    if domains[i] == 'bacteria':
-                        proc.stdin.write(
-                            f'centrifuge-download -l -P 48 '
-                            f'-o library -d "{domains[i]}" -a "Chromosome" '
-                            'refseq > seqid2taxid.map'
-                            '\n'
-                        )
-                    else:
-                        proc.stdin.write(
-                            f'centrifuge-download -l -P 48 '
-                            f'-o library -d "{domains[i]}" '
-                            'refseq > seqid2taxid.map'
-                            '\n'
-                        )
-                else:
-                    if domains[i] == 'bacteria':
-                        proc.stdin.write(
-                            f'centrifuge-download -l -P 48 '
-                            f'-o library -d "{domains[i]}" -a "Chromosome" '
-                            'refseq >> seqid2taxid.map'
-                            '\n'
-                        )
-                    else:
-                        proc.stdin.write(
-                            f'centrifuge-download -l -P 48 '
-                            f'-o library -d "{domains[i]}" '
-                            'refseq >> seqid2taxid.map'
-                            '\n'
-                        )
-                await proc.stdin.drain()
-                print("DONE")
-            print("Library downloaded")                         
-
-            # Concatenate all the downloaded sequences
-            print(f"Started sequences concatenation --> ", end="")           
-            proc.stdin.write(
-                'cat library/*/*.fna > sequences.fna'
-                '\n'
-            )
-            await proc.stdin.drain()
-            print("DONE")                      
+    # Refresh the libraries unless it was done to choose the backend
+    if snapshot is None:
+        snapshot, index_cached = await refreshLibraries(
+            hostname, 
+            username, 
+            password, 
+            run_id, 
+            domains
+        )
 
-            # Execute the centrifuge script
-            print("Started running Centrifuge script")        
-            proc.stdin.write(
-                'echo "$(sbatch cen_script.sh | awk \'{print $4}\')$"'
-                '\n'
-            )
-            await proc.stdin.drain()
-            
-            # Save the JobID of the script
-            result = await proc.stdout.readuntil('$')
-            job_ID = result[:-1].replace('\n', '')
-
-            print(f"JobID = {job_ID}")
-            
-            # Wait for the job to be finished
-            print("Waiting for the centrifuge job to be finished")
-            while True:
-                proc.stdin.write(
-                    f'echo $(squeue -j {job_ID} --format="%T" -h)$'
-                    '\n'
+    async with conn.start_sftp_client() as sftp:
+        # Size the job from the reads and the index, or the libraries
+        # it is built from
+        metrics = None
+        if reads is not None:
+            metrics = dict(reads)
+            if index_cached:
+                metrics['index_bytes'] = await indexSize(
+                    hostname, 
+                    username, 
+                    password, 
+                    domains, 
+                    snapshot
                 )
-                await proc.stdin.drain()
-                result = await proc.stdout.readuntil('$')
-                state = result[:-1].replace('\n', '')
-
-                print(
-                    f"\rJobId = {job_ID}: state -> {state}", 
-                    end="",
-                    flush=True
+            else:
+                metrics['library_bytes'] = await remoteSize(
+                    conn, 
+                    [
+                        f'{cacheDir(scratch_dir)}/library/{domain}'
+                        for domain in domains
+                    ]
                 )
 
-                if state not in ['PENDING', 'RUNNING', 'CONFIGURING']:
-                    break
-                elif state == 'FAILED':
-                    print("Something went wrong")
-                else:
-                    time.sleep(3)
+        # Shard the reads of the large samples over a Slurm job array
+        shards = 1
+        if backend == 'slurm' and reads is not None:
+            shards = estimator.shards(reads['reads'])
+
+        if shards > 1:
+            # Each task loads the whole index, built by the split if
+            # needed, and classifies its shard
+            shard_metrics = {
+                metric: metrics[metric] // shards
+                for metric in ('bytes', 'raw_bytes', 'reads')
+            }
+            shard_metrics['index_bytes'] = (
+                metrics.get('index_bytes') or metrics['library_bytes']
+            )
+            resources = estimator.estimate('centrifuge', shard_metrics)
+            resources.tasks = shards
+            scatter = estimator.estimate('centrifuge_scatter', metrics)
+            gather = estimator.estimate('centrifuge_gather', metrics)
+            print(f"Centrifuge resources: {scatter.status()}, "
+                  f"{resources.status()}, {gather.status()}")
+
+            # Build the scripts of the split, the shards and the merge
+            scripts = await buildShardedScripts(
+                run_id, 
+                inputs, 
+                account, 
+                scratch_dir, 
+                domains, 
+                snapshot, 
+                index_cached, 
+                resources, 
+                scatter, 
+                gather
+            )
+        else:
+            resources = estimator.estimate('centrifuge', metrics)
+            print(f"Centrifuge resources: {resources.status()}")
 
-            print("Script executed")
+            # Build the script file
+            scripts = [await buildCentrifugeScript(
+                run_id, 
+                inputs, 
+                account, 
+                scratch_dir, 
+                domains, 
+                snapshot, 
+                index_cached, 
+                backend, 
+                resources
+            )]
+
+        # Upload the script files
+        await sftp.chdir(remoteWorkdir(scratch_dir, run_id))
+        await engine.put(sftp, scripts, progress_handler=uploadProgress)
+        print("OK")
+
+    return resources
+
+
+async def submitCentrifuge(
+    hostname: str, 
+    username: str, 
+    password: str, 
+    run_id: str, 
+    after: str = None, 
+    backend: str = 'slurm', 
+    resources: ResourceEstimate = None
+) -> str:
+    """Function to submit the uploaded Centrifuge script and return
+    the JobID.
+
+    The scripts of a sharded execution are submitted in a chain, and the
+    JobID of the merge is returned: it completes once every shard was
+    classified and merged. The job array is set as the job of the
+    estimate, to record the resources it used.
 
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param after: The JobID of a job to wait for before starting.
+    :param backend: The name of the backend running the script.
+    :param resources: The ResourceEstimate returned by prepareCentrifuge.
+    """
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    setup = [
+        f'cd {remoteWorkdir(scratch_dir, run_id)}',
+        'module load profile/bioinf',
+        'module load autoload gcc',
+        'module load autoload python',
+        'export PATH=$SCRATCH/centrifuge:$PATH',
+        'mkdir -p reports',
+        linkTaxonomyCommand(scratch_dir)
+    ]
+    executor = backends.get(backend)
+
+    # Prepare the working directory and submit the Centrifuge script
+    print("Started running Centrifuge script")
+    job_ID = await executor.submit(
+        conn, 
+        scratch_dir, 
+        setup, 
+        'cen_script.sh',
+        after
+    )
+    print(f"JobID = {job_ID}")
+
+    # Submit the job array of the shards and the merge after the split
+    if resources is not None and resources.tasks > 1:
+        resources.job_id = await executor.submit(
+            conn, 
+            scratch_dir, 
+            setup, 
+            'cen_shard.sh', 
+            job_ID
+        )
+        print(f"JobID = {resources.job_id} ({resources.tasks} shards)")
+        job_ID = await executor.submit(
+            conn, 
+            scratch_dir, 
+            setup, 
+            'cen_merge.sh', 
+            resources.job_id
+        )
+        print(f"JobID = {job_ID}")
 
-async def downloadCentrifugeReport(
+    return job_ID
+
+
+async def executeCentrifuge(
     hostname: str, 
     username: str, 
-    password: str
+    password: str, 
+    run_id: str, 
+    account: str, 
+    inputs: list, 
+    domains: list, 
+    backend: str = 'slurm', 
+    reads: dict = None, 
+    snapshot: str = None, 
+    index_cached: bool = None
 ):
-    """Function to download the Centrifuge summary report from Galileo100.
+    """Function to connect to Galileo100 and run the Centrifuge
+    script, returning the resources estimated for its job.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param inputs: Array of strings containing the names of the
+    raw sequences file/s to include in the script.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param backend: The name of the backend running the script.
+    :param reads: The size of the reads, as returned by inspectReads.
+    :param snapshot: Label of the snapshot of the libraries, as returned
+    by refreshLibraries, the library cache is refreshed if not given.
+    :param index_cached: True if the index of the domains is already in
+    the index cache, as returned by refreshLibraries.
+    """
+    print(f"Executing centrifuge ({backend})")
+
+    # Refresh the library cache and upload the script
+    resources = await prepareCentrifuge(
+        hostname, 
+        username, 
+        password, 
+        run_id, 
+        account, 
+        inputs, 
+        domains, 
+        backend, 
+        reads, 
+        snapshot, 
+        index_cached
+    )
+
+    # Submit the script
+    job_ID = await submitCentrifuge(
+        hostname, 
+        username, 
+        password, 
+        run_id, 
+        backend=backend, 
+        resources=resources
+    )
+
+    # Wait for the job to be finished
+    print("Waiting for the centrifuge job to be finished")
+    await backends.get(backend).wait(
+        hostname, 
+        username, 
+        password, 
+        job_ID, 
+        resources
+    )
+
+    print("Script executed")
+
+    return resources
+
+
+async def downloadCentrifugeReport(
+    hostname: str, 
+    username: str, 
+    password: str, 
+    run_id: str
+) -> str:
+    """Function to download the Centrifuge summary report of a run from
+    Galileo100 and return its local path.
 
     :param hostname: A string which is the host name to connect.
     :param username: A string which is the username of the account
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
     """
+    localpath = os.path.join(
+        localDir('download', run_id), 
+        'centrifuge_report.tsv'
+    )
+
     try:
-        async with asyncssh.connect(
-            hostname, 
-            username=username,
-            password=password, 
-            known_hosts=None
-        ) as conn:
-            # Get $SCRATCH directory path
-            command = await conn.run('echo $SCRATCH')
-            scratch_dir = command.stdout[:-1]
-
-            # Start the sftp client
-            async with conn.start_sftp_client() as sftp:
-                # Navigate to $SCRATCH directory
-                await sftp.chdir(scratch_dir)
-
-                # Print all the content of the scratch directory
-                ls = await sftp.listdir('.')
-                print(f"Content of the directory: \n{ls}")
-
-                # Navigate in the working directory
-                print("Moving to dec directory")
-                await sftp.chdir('dec')
-
-                # Download the centrifuge_report.tsv file
-                print("Downloading the centrifuge summary report")
-                await sftp.get(
-                    'centrifuge_report.tsv', 
-                    'download/centrifuge_report.tsv', 
+        # Get pooled connection to remote host
+        conn = await pool.connect(hostname, username, password)
+
+        # Get $SCRATCH directory path
+        scratch_dir = await pool.scratchDir(hostname, username, password)
+
+        # Start the sftp client
+        async with conn.start_sftp_client() as sftp:
+            # Navigate in the working directory
+            await sftp.chdir(remoteWorkdir(scratch_dir, run_id))
+
+            # Download the centrifuge_report.tsv file
+            print("Downloading the centrifuge summary report")
+            await engine.getFile(
+                sftp,
+                'centrifuge_report.tsv', 
+                localpath, 
+                progress_handler=downloadProgress
+            )
+            print("OK")
+
+            # Download the taxonomy tree of the report, if extracted
+            if await sftp.exists(TREE_FILE):
+                await engine.getFile(
+                    sftp,
+                    TREE_FILE, 
+                    os.path.join(localDir('download', run_id), TREE_FILE), 
                     progress_handler=downloadProgress
                 )
-                print("OK")
     except asyncssh.sftp.SFTPNoSuchFile as e:
         print(f"ERROR: Centrifuge report not found.\n{e}")
     
-    print("Report downloaded")
\ No newline at end of file
+    print("Report downloaded")
+
+    return localpath
+
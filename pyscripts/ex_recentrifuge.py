@@ -1,27 +1,38 @@
 
-import asyncssh
 import os
-import time
 
+from pyscripts.connection import pool
+from pyscripts.execution import backends
 from pyscripts.progress import uploadProgress, downloadProgress
+from pyscripts.resources import ResourceEstimate, estimator, remoteSize
+from pyscripts.transfer import engine
+from pyscripts.workspace import localDir, remoteWorkdir
 
 
-async def buildRecentrifugeScript(account: str):
+async def buildRecentrifugeScript(
+        run_id: str,
+        account: str,
+        backend: str = 'slurm',
+        resources: ResourceEstimate = None
+):
     """Build script to execute Recentrifuge.
+
+    :param run_id: The ID of the run.
+    :param backend: The name of the backend running the script.
+    :param resources: The ResourceEstimate of the job, the fallback
+    resources if not given.
     """
+    if resources is None:
+        resources = estimator.estimate('recentrifuge')
+
     # Write the script file
-    with open('scripts/rec_script.sh', 'w', newline='\n') as file:
+    script = os.path.join(localDir('scripts', run_id), 'rec_script.sh')
+    with open(script, 'w', newline='\n') as file:
         file.write('#!/bin/bash' + '\n\n')
 
         # Add directories
         file.write(
-            '#SBATCH --job-name=recentrifuge\n'
-            '#SBATCH --time=24:00:00\n'
-            '#SBATCH -p g100_usr_bmem \n'
-            '#SBATCH -N 1\n'
-            '#SBATCH -n 48 \n'
-            '#SBATCH --mem=500G \n'
-            f'#SBATCH --account {account}\n\n'
+            backends.get(backend).header('recentrifuge', account, resources)
         )
 
         # Add instructions
@@ -37,13 +48,66 @@ async def buildRecentrifugeScript(account: str):
         )
     
     # Return absolute path of the file
-    return os.path.abspath('scripts/rec_script.sh')
+    return os.path.abspath(script)
+
+
+async def submitRecentrifuge(
+    hostname: str, 
+    username: str, 
+    password: str, 
+    run_id: str, 
+    after: str = None, 
+    backend: str = 'slurm'
+) -> str:
+    """Function to submit the uploaded Recentrifuge script and return
+    the JobID.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param after: The JobID of a job to wait for before starting.
+    :param backend: The name of the backend running the script.
+    """
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    # Prepare the python environment and submit the Recentrifuge script
+    print("Started running Recentrifuge script")
+    job_ID = await backends.get(backend).submit(
+        conn, 
+        scratch_dir, 
+        [
+            f'cd {remoteWorkdir(scratch_dir, run_id)}',
+            'module load profile/bioinf',
+            'module load autoload gcc',
+            'module load python/3.8.12--gcc--10.2.0',
+            'python3 -m venv recenv',
+            'source recenv/bin/activate',
+            'pip install -q recentrifuge xlrd',
+            'export PATH=$SCRATCH/centrifuge:$PATH',
+            'mkdir -p reports/recentrifuge_reports'
+        ], 
+        'rec_script.sh',
+        after
+    )
+    print(f"JobID = {job_ID}")
+
+    return job_ID
 
 
 async def executeRecentrifuge(
     hostname: str, 
     username: str, 
-    password: str
+    password: str, 
+    run_id: str, 
+    backend: str = 'slurm', 
+    resources: ResourceEstimate = None
 ):
     """Function to connect to Galileo100 and run the Recentrifuge script.
 
@@ -52,179 +116,144 @@ async def executeRecentrifuge(
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param backend: The name of the backend running the script.
+    :param resources: The ResourceEstimate of the job.
     """
-    print("Executing Recentrifuge")
+    print(f"Executing Recentrifuge ({backend})")
 
-    # Connect to remote host
-    async with asyncssh.connect(
+    # Submit the script
+    job_ID = await submitRecentrifuge(
+        hostname, 
+        username, 
+        password, 
+        run_id, 
+        backend=backend
+    )
+
+    # Wait for the job to be finished
+    print("Waiting for the recentrifuge job to be finished")
+    await backends.get(backend).wait(
         hostname, 
-        username=username,
-        password=password, 
-        known_hosts=None
-    ) as conn:
-        async with conn.create_process() as proc:
-            # Navigate in the working directory
-            proc.stdin.write('cd $SCRATCH/dec' + '\n')
-            await proc.stdin.drain()
-
-            # Import profile and modules and activate python environment
-            proc.stdin.write('module load profile/bioinf' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('module load autoload gcc' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('module load python/3.8.12--gcc--10.2.0' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('python3 -m venv recenv' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('source recenv/bin/activate' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('echo "$(pip install recentrifuge xlrd)$"' + '\n')
-            await proc.stdin.drain()
-            result = await proc.stdout.readuntil('$')
-            print("Module loaded and python environment activated")
-
-            # Export $PATH to include centrifuge
-            proc.stdin.write('export PATH=$SCRATCH/centrifuge:$PATH' + '\n')
-            await proc.stdin.drain()
-            print("Path exported")
-
-            # Create recentrifuge_reports directory
-            proc.stdin.write('mkdir reports/recentrifuge_reports' + '\n')
-            await proc.stdin.drain()
-            print("directory created")                                              
-
-            # Execute the Recentrifuge script
-            print("Started running Recentrifuge script")        
-            proc.stdin.write(
-                'echo "$(sbatch rec_script.sh | awk \'{print $4}\')$"'
-                '\n'
-            )
-            await proc.stdin.drain()
-            
-            # Save the JobID of the script
-            result = await proc.stdout.readuntil('$')
-            job_ID = result[:-1].replace('\n', '')
-
-            print(f"JobID = {job_ID}")
-            
-            print("Waiting for the centrifuge job to be finished")
-
-            # Wait for the job to be finished
-            while True:
-                proc.stdin.write(
-                    f'echo $(squeue -j {job_ID} --format="%T" -h)$'
-                    '\n'
-                )
-                await proc.stdin.drain()
-                result = await proc.stdout.readuntil('$')
-                state = result[:-1].replace('\n', '')
-
-                print(
-                    f"\rJobId = {job_ID}: state -> {state}", 
-                    end='', 
-                    flush=True
-                )
-
-                if state not in ['PENDING', 'RUNNING', 'CONFIGURING']:
-                    break
-                elif state == 'FAILED':
-                    print("Something went wrong")
-                else:
-                    time.sleep(3)
-
-            print("Script executed")
+        username, 
+        password, 
+        job_ID, 
+        resources
+    )
+
+    print("Script executed")
 
 
 async def uploadRecentrifugeScript(
     hostname: str, 
     username: str, 
     password: str,
-    account: str
-):
-    """Upload script on cluster using SFTP.
+    run_id: str,
+    account: str,
+    backend: str = 'slurm',
+    reads: dict = None
+) -> ResourceEstimate:
+    """Upload script on cluster using SFTP and return the resources
+    estimated for its job.
 
     :param hostname: A string which is the host name to connect.
     :param username: A string which is the username of the account
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param backend: The name of the backend running the script.
+    :param reads: The size of the reads, as returned by inspectReads,
+    the job gets the fallback resources if not given.
     """
-    async with asyncssh.connect(
-        hostname, 
-        username=username,
-        password=password, 
-        known_hosts=None
-    ) as conn:
-        # Get $SCRATCH directory path
-        command = await conn.run('echo $SCRATCH')
-        scratch_dir = command.stdout[:-1]
-
-        # Start the sftp client
-        async with conn.start_sftp_client() as sftp:
-            # Navigate to $SCRATCH directory
-            await sftp.chdir(scratch_dir)
-            
-            # Navigate in the working directory
-            print("Moving to dec directory")
-            await sftp.chdir('dec')
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    workdir = remoteWorkdir(scratch_dir, run_id)
+
+    # Size the job from the reads and the Centrifuge output, if already
+    # written
+    metrics = None
+    if reads is not None:
+        metrics = dict(reads)
+        metrics['output_bytes'] = await remoteSize(
+            conn, 
+            [f'{workdir}/reports/centrifuge_output.txt']
+        )
+    resources = estimator.estimate('recentrifuge', metrics)
+    print(f"Recentrifuge resources: {resources.status()}")
+
+    # Start the sftp client
+    async with conn.start_sftp_client() as sftp:
+        # Navigate in the working directory
+        await sftp.chdir(workdir)
+
+        # Build the script file
+        script = await buildRecentrifugeScript(
+            run_id, 
+            account, 
+            backend, 
+            resources
+        )
 
-            # Build the script file
-            script = await buildRecentrifugeScript(account)
+        # Upload script file
+        await engine.put(sftp, [script], progress_handler=uploadProgress)
+        print("OK")
 
-            # Upload script file
-            await sftp.put(script, progress_handler=uploadProgress)
-            print("OK")
+    print("Recentrifuge script uploaded")
 
-        print("Recentrifuge script uploaded")
+    return resources
 
 
 async def downloadRecentrifugeReport(
     hostname: str, 
     username: str, 
-    password: str
-):
-    """Function to download the Recentrifuge report from Galileo100.
+    password: str, 
+    run_id: str
+) -> str:
+    """Function to download the Recentrifuge report of a run from 
+    Galileo100 and return its local path.
     
     :param hostname: A string which is the host name to connect.
     :param username: A string which is the username of the account
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
     """
-    async with asyncssh.connect(
-        hostname, 
-        username=username,
-        password=password, 
-        known_hosts=None
-    ) as conn:
-        # Get $SCRATCH directory path
-        command = await conn.run('echo $SCRATCH')
-        scratch_dir = command.stdout[:-1]
-
-        # Start the sftp client
-        async with conn.start_sftp_client() as sftp:
-            # Navigate to $SCRATCH directory
-            await sftp.chdir(scratch_dir)
-            
-            # Print all the content of the scratch directory
-            ls = await sftp.listdir('.')
-            print(f"Content of the directory: \n{ls}")
-            
-            # Navigate in the working directory
-            print("Moving to dec directory")
-            await sftp.chdir('dec')
-
-            # Navigate in the reports/recentrifuge_reports directory
-            print("Moving to recentrifuge_reports directory")
-            await sftp.chdir('reports/recentrifuge_reports')
-
-            # Download the recentrifuge report HTML page
-            print("Downloading the centrifuge summary report")
-            await sftp.get(
-                'centrifuge_output.txt.rcf.html', 
-                'templates/recentrifuge_output.html', 
-                progress_handler=downloadProgress
-            )
-            print("OK")
-
-    print("Report page downloaded")
\ No newline at end of file
+    localpath = os.path.join(
+        localDir('download', run_id), 
+        'recentrifuge_output.html'
+    )
+
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    # Start the sftp client
+    async with conn.start_sftp_client() as sftp:
+        # Navigate in the working directory
+        await sftp.chdir(remoteWorkdir(scratch_dir, run_id))
+
+        # Navigate in the reports/recentrifuge_reports directory
+        print("Moving to recentrifuge_reports directory")
+        await sftp.chdir('reports/recentrifuge_reports')
+
+        # Download the recentrifuge report HTML page
+        print("Downloading the centrifuge summary report")
+        await engine.getFile(
+            sftp,
+            'centrifuge_output.txt.rcf.html', 
+            localpath, 
+            progress_handler=downloadProgress
+        )
+        print("OK")
+
+    print("Report page downloaded")
+
+    return localpath
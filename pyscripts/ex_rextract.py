@@ -1,20 +1,33 @@
 
-import asyncssh
 import os
-import time
 
+from pyscripts.connection import pool
+from pyscripts.execution import backends
 from pyscripts.progress import uploadProgress, downloadProgress
+from pyscripts.resources import ResourceEstimate, estimator, remoteSize
+from pyscripts.transfer import engine
+from pyscripts.workspace import localDir, remoteWorkdir
 
 
 async def buildRextractScript(
+        run_id: str,
         inputs: list, 
-        account: str
+        account: str,
+        backend: str = 'slurm',
+        resources: ResourceEstimate = None
 ):
     """Build script to execute Rextract.
 
+    :param run_id: The ID of the run.
     :param inputs: Array containg the absolute paths of the input
     sequences (string).
+    :param backend: The name of the backend running the script.
+    :param resources: The ResourceEstimate of the job, the fallback
+    resources if not given.
     """
+    if resources is None:
+        resources = estimator.estimate('rextract')
+
     # Extracting sequences name
     if len(inputs) == 1:
         seq1 = os.path.basename(inputs[0])
@@ -23,18 +36,13 @@ async def buildRextractScript(
         seq2 = os.path.basename(inputs[1])
 
     # Write script file
-    with open('scripts/rex_script.sh', 'w', newline='\n') as file:
+    script = os.path.join(localDir('scripts', run_id), 'rex_script.sh')
+    with open(script, 'w', newline='\n') as file:
         file.write('#!/bin/bash' + '\n\n')
 
         # Add directories
         file.write(
-            '#SBATCH --job-name=rextract\n'
-            '#SBATCH --time=24:00:00\n'
-            '#SBATCH -p g100_usr_bmem \n'
-            '#SBATCH -N 1\n'
-            '#SBATCH -n 48 \n'
-            '#SBATCH --mem=500G \n'
-            f'#SBATCH --account {account}\n\n'
+            backends.get(backend).header('rextract', account, resources)
         )
 
         # Add instructions
@@ -55,13 +63,67 @@ async def buildRextractScript(
             )
     
     # Return absolute path of file
-    return os.path.abspath('scripts/rex_script.sh')
+    return os.path.abspath(script)
+
+
+async def submitRextract(
+    hostname: str, 
+    username: str, 
+    password: str, 
+    run_id: str, 
+    after: str = None, 
+    backend: str = 'slurm'
+) -> str:
+    """Function to submit the uploaded Rextract script and return
+    the JobID.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param after: The JobID of a job to wait for before starting.
+    :param backend: The name of the backend running the script.
+    """
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    # Prepare the python environment and submit the Rextract script, in
+    # a venv of its own: in pipeline mode Recentrifuge is submitted at the
+    # same time and installs its venv in the same working directory
+    print("Started running Rextract script")
+    job_ID = await backends.get(backend).submit(
+        conn, 
+        scratch_dir, 
+        [
+            f'cd {remoteWorkdir(scratch_dir, run_id)}',
+            'module load profile/bioinf',
+            'module load autoload gcc',
+            'module load python/3.8.12--gcc--10.2.0',
+            'python3 -m venv rexenv',
+            'source rexenv/bin/activate',
+            'pip install -q recentrifuge xlrd',
+            'mkdir -p cleaned_sequences'
+        ], 
+        'rex_script.sh',
+        after
+    )
+    print(f"JobID = {job_ID}")
+
+    return job_ID
 
 
 async def executeRextract(
     hostname: str, 
     username: str, 
-    password: str
+    password: str, 
+    run_id: str, 
+    backend: str = 'slurm', 
+    resources: ResourceEstimate = None
 ):
     """Function to connect to Galileo100 and run the Rextract script.
 
@@ -70,183 +132,152 @@ async def executeRextract(
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param backend: The name of the backend running the script.
+    :param resources: The ResourceEstimate of the job.
     """
-    print("Executing Rextract")
+    print(f"Executing Rextract ({backend})")
 
-    # Connect to remote host
-    async with asyncssh.connect(
+    # Submit the script
+    job_ID = await submitRextract(
         hostname, 
-        username=username,
-        password=password, 
-        known_hosts=None
-    ) as conn:
-        async with conn.create_process() as proc:
-            # Navigate in the working directory
-            proc.stdin.write('cd $SCRATCH/dec' + '\n')
-            await proc.stdin.drain()
-
-            # Import profile and modules and activate python environment
-            proc.stdin.write('module load profile/bioinf' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('module load autoload gcc' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('module load python/3.8.12--gcc--10.2.0' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('python3 -m venv recenv' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write('source recenv/bin/activate' + '\n')
-            await proc.stdin.drain()
-            proc.stdin.write(
-                'echo "$(pip install recentrifuge xlrd)$"'
-                '\n'
-            )
-            await proc.stdin.drain()
-            result = await proc.stdout.readuntil('$')
-            print("Module loaded and python environment activated")
-
-            # Create cleaned_sequences directory
-            proc.stdin.write('mkdir cleaned_sequences' + '\n')
-            await proc.stdin.drain()
-            print("directory created")                                              
-
-            # Execute the Rextract script
-            print("Started running Rextract script")        
-            proc.stdin.write(
-                'echo "$(sbatch rex_script.sh | awk \'{print $4}\')$"'
-                '\n'
-            )
-            await proc.stdin.drain()
-            
-            # Save the JobID of the script
-            result = await proc.stdout.readuntil('$')
-            job_ID = result[:-1].replace('\n', '')
-
-            print(f"JobID = {job_ID}")
-            
-            print("Waiting for the rextract job to be finished")
-
-            # Wait for the job to be finished
-            while True:
-                proc.stdin.write(
-                    f'echo $(squeue -j {job_ID} --format="%T" -h)$'
-                    '\n'
-                )
-                await proc.stdin.drain()
-                result = await proc.stdout.readuntil('$')
-                state = result[:-1].replace('\n', '')
-
-                print(
-                    f"\rJobId = {job_ID}: state -> {state}", 
-                    end='', 
-                    flush=True
-                )
-
-                if state not in ['PENDING', 'RUNNING', 'CONFIGURING']:
-                    break
-                else:
-                    time.sleep(3)
-
-            print("Script executed")
+        username, 
+        password, 
+        run_id, 
+        backend=backend
+    )
+
+    # Wait for the job to be finished
+    print("Waiting for the rextract job to be finished")
+    await backends.get(backend).wait(
+        hostname, 
+        username, 
+        password, 
+        job_ID, 
+        resources
+    )
+
+    print("Script executed")
 
 
 async def uploadRextractScript(
     hostname: str, 
     username: str, 
     password: str,
-    account: str
-):
-    """Upload script on cluster using SFTP.
+    run_id: str,
+    account: str,
+    inputs: list,
+    backend: str = 'slurm',
+    reads: dict = None
+) -> ResourceEstimate:
+    """Upload script on cluster using SFTP and return the resources
+    estimated for its job.
     
     :param hostname: A string which is the host name to connect.
     :param username: A string which is the username of the account
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param account: The account charged for the job.
+    :param inputs: Array of strings containing the names of the reads
+    linked in the working directory.
+    :param backend: The name of the backend running the script.
+    :param reads: The size of the reads, as returned by inspectReads,
+    the job gets the fallback resources if not given.
     """
-    async with asyncssh.connect(
-        hostname, 
-        username=username,
-        password=password, 
-        known_hosts=None
-    ) as conn:
-        # Get $SCRATCH directory path
-        command = await conn.run('echo $SCRATCH')
-        scratch_dir = command.stdout[:-1]
-
-        # Get input files names
-        command = await conn.run('echo $(ls $SCRATCH/dec/*fastq*)')
-        inputs = (command.stdout[:-1]).split()
-
-        # Start the sftp client
-        async with conn.start_sftp_client() as sftp:
-            # Navigate to $SCRATCH directory
-            await sftp.chdir(scratch_dir)
-            
-            # Navigate in the working directory
-            print("Moving to dec directory")
-            await sftp.chdir('dec')
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    workdir = remoteWorkdir(scratch_dir, run_id)
+
+    # Size the job from the reads and the Centrifuge output, if already
+    # written
+    metrics = None
+    if reads is not None:
+        metrics = dict(reads)
+        metrics['output_bytes'] = await remoteSize(
+            conn, 
+            [f'{workdir}/reports/centrifuge_output.txt']
+        )
+    resources = estimator.estimate('rextract', metrics)
+    print(f"Rextract resources: {resources.status()}")
+
+    # Start the sftp client
+    async with conn.start_sftp_client() as sftp:
+        # Navigate in the working directory
+        await sftp.chdir(workdir)
+
+        # Build the script file
+        script = await buildRextractScript(
+            run_id, 
+            inputs, 
+            account, 
+            backend, 
+            resources
+        )
 
-            # Build the script file
-            script = await buildRextractScript(inputs, account)
+        # Upload script file
+        await engine.put(sftp, [script], progress_handler=uploadProgress)
+        print("OK")
 
-            # Upload script file
-            await sftp.put(script, progress_handler=uploadProgress)
-            print("OK")
+    print("Rextract script uploaded")
 
-        print("Rextract script uploaded")
+    return resources
 
 
 async def downloadRextractSequences(
     hostname: str, 
     username: str, 
-    password: str
-):
-    """Function to download the Rextract cleaned sequences from Galileo100.
+    password: str, 
+    run_id: str
+) -> list:
+    """Function to download the Rextract cleaned sequences of a run from
+    Galileo100 and return their local paths.
     
     :param hostname: A string which is the host name to connect.
     :param username: A string which is the username of the account
     to connect in the host machine.
     :param password: A string which is the password of the account
     to connect in the host machine.
+    :param run_id: The ID of the run.
     """
-    async with asyncssh.connect(
-        hostname, 
-        username=username,
-        password=password, 
-        known_hosts=None
-    ) as conn:
-        # Get $SCRATCH directory path
-        command = await conn.run('echo $SCRATCH')
-        scratch_dir = command.stdout[:-1]
-
-        # Start the sftp client
-        async with conn.start_sftp_client() as sftp:
-            # Navigate to $SCRATCH directory
-            await sftp.chdir(scratch_dir)
-            
-            # Navigate in the working directory
-            print("Moving to dec directory")
-            await sftp.chdir('dec')
-
-            # Print all the content of scratch directory
-            ls = await sftp.listdir('.')
-            print(f"Content of the directory: \n{ls}")
-
-            # Get the names of "cleaned" sequences
-            files = []
-            for file in ls:
-                if "rxtr" in file:
-                    files.append(file)
-                    print(file)
-
-            # Download the cleaned_sequences directory
-            print("Downloading the cleaned sequences")
-            for file in files:
-                await sftp.get(
-                    file, 
-                    'download/', 
-                    progress_handler=downloadProgress
-                )
-            print("OK")
-
-    print("Cleaned sequences downloaded")
\ No newline at end of file
+    localdir = localDir('download', run_id)
+
+    # Get pooled connection to remote host
+    conn = await pool.connect(hostname, username, password)
+
+    # Get $SCRATCH directory path
+    scratch_dir = await pool.scratchDir(hostname, username, password)
+
+    # Start the sftp client
+    async with conn.start_sftp_client() as sftp:
+        # Navigate in the working directory
+        await sftp.chdir(remoteWorkdir(scratch_dir, run_id))
+
+        # Print all the content of scratch directory
+        ls = await sftp.listdir('.')
+        print(f"Content of the directory: \n{ls}")
+
+        # Get the names of "cleaned" sequences
+        files = []
+        for file in ls:
+            if "rxtr" in file:
+                files.append(file)
+
+        # Download the cleaned_sequences directory
+        print("Downloading the cleaned sequences")
+        await engine.get(
+            sftp,
+            files, 
+            localdir, 
+            progress_handler=downloadProgress
+        )
+        print("OK")
+
+    print("Cleaned sequences downloaded")
+
+    return [os.path.join(localdir, file) for file in files]
@@ -0,0 +1,509 @@
+import abc
+import shlex
+import uuid
+
+from pyscripts.connection import pool
+from pyscripts.job_monitor import (
+    LOCAL_JOB_PREFIX,
+    JobFailedError,
+    jobUsage,
+    localJobsDir,
+    monitor,
+    submitJob
+)
+from pyscripts.resources import (
+    ResourceEstimate,
+    estimator,
+    formatMemory,
+    formatWalltime
+)
+from pyscripts.run_manager import manager
+
+
+# States of the failed jobs which used all the resources they were given
+EXHAUSTED_STATES = {'TIMEOUT', 'OUT_OF_MEMORY'}
+
+# Threads of the programs run without Slurm
+DEFAULT_LOCAL_THREADS = 8
+
+# Jobs run without Slurm at the same time by a user
+DEFAULT_LOCAL_JOBS = 2
+
+# Seconds between two checks of a job run without Slurm waiting for
+# another job or for a free slot
+LOCAL_WAIT_INTERVAL = 1
+
+# Bytes of reads, as stored on the cluster, up to which a run is
+# executed without Slurm
+DEFAULT_LOCAL_MAX_BYTES = 256 * 1024 * 1024
+
+# Memory, as estimated for the Centrifuge job, up to which a run is
+# executed without Slurm: Centrifuge loads the whole index
+DEFAULT_LOCAL_MAX_MEMORY = 16 * 1024 * 1024 * 1024
+
+
+def dependencyOptions(job_id: str) -> str:
+    """Build the sbatch options making a job start after another one
+    completed successfully.
+
+    The dependent job is cancelled if the other one fails, instead of
+    pending forever.
+
+    :param job_id: The JobID of the job to wait for.
+    """
+    return f'--dependency=afterok:{job_id} --kill-on-invalid-dep=yes'
+
+
+class ExecutionBackend(abc.ABC):
+    """Way of executing the scripts of the stages on the cluster.
+
+    A backend writes the header of the scripts, chooses the threads of
+    the programs, submits the scripts and waits for them. The scripts run
+    in the working directory of the run whatever the backend, so their
+    results are fetched from there in the same way. A backend must
+    implement cores, header and submit.
+    """
+
+    # Name of the backend, recorded in the runs
+    name = None
+
+    @abc.abstractmethod
+    def cores(self, resources: ResourceEstimate) -> int:
+        """Get the threads given to the programs of a script.
+
+        :param resources: The resources estimated for the job.
+        """
+
+    @abc.abstractmethod
+    def header(
+        self,
+        job_name: str,
+        account: str,
+        resources: ResourceEstimate
+    ) -> str:
+        """Build the header of a script.
+
+        :param job_name: The name of the job.
+        :param account: The account charged for the job.
+        :param resources: The resources estimated for the job.
+        """
+
+    @abc.abstractmethod
+    async def submit(
+        self,
+        conn,
+        scratch_dir: str,
+        setup: list,
+        script: str,
+        after: str = None
+    ) -> str:
+        """Start a script after preparing its environment and return its
+        job ID.
+
+        :param conn: The SSH connection to use.
+        :param scratch_dir: The $SCRATCH directory path.
+        :param setup: Array of strings containing the commands preparing
+        the environment of the script.
+        :param script: Path of the script to start.
+        :param after: ID of a job which must complete before the script
+        starts, the script is cancelled if the job fails.
+        """
+
+    async def wait(
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        job_id: str,
+        resources: ResourceEstimate = None
+    ) -> str:
+        """Wait for a job to finish, raising JobFailedError on failure.
+
+        The stage waiting gives back its run manager slot meanwhile.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        :param job_id: The job ID.
+        :param resources: The resources estimated for the job.
+        """
+        async with manager.released():
+            return await monitor.waitCompleted(
+                hostname,
+                username,
+                password,
+                job_id
+            )
+
+
+class SlurmBackend(ExecutionBackend):
+    """Backend submitting the scripts as Slurm jobs sized by the
+    resource estimator.
+    """
+
+    name = 'slurm'
+
+    def cores(self, resources: ResourceEstimate) -> int:
+        """Get the threads given to the programs of a script, one per
+        core of the job.
+
+        :param resources: The resources estimated for the job.
+        """
+        return resources.cores
+
+    def header(
+        self,
+        job_name: str,
+        account: str,
+        resources: ResourceEstimate
+    ) -> str:
+        """Build the #SBATCH header of a script, of a job array if the
+        estimate has several tasks.
+
+        :param job_name: The name of the job.
+        :param account: The account charged for the job.
+        :param resources: The resources estimated for the job.
+        """
+        array = ''
+        if resources.tasks > 1:
+            array = f'#SBATCH --array=0-{resources.tasks - 1}\n'
+
+        return (
+            f'#SBATCH --job-name={job_name}\n'
+            f'#SBATCH --time={formatWalltime(resources.seconds)}\n'
+            f'#SBATCH -p {resources.partition} \n'
+            '#SBATCH -N 1\n'
+            f'#SBATCH -n {resources.cores} \n'
+            f'#SBATCH --mem={formatMemory(resources.memory)} \n'
+            f'{array}'
+            f'#SBATCH --account {account}\n\n'
+        )
+
+    async def submit(
+        self,
+        conn,
+        scratch_dir: str,
+        setup: list,
+        script: str,
+        after: str = None
+    ) -> str:
+        """Submit a script with sbatch and return its JobID.
+
+        :param conn: The SSH connection to use.
+        :param scratch_dir: The $SCRATCH directory path.
+        :param setup: Array of strings containing the commands to run
+        before sbatch.
+        :param script: Path of the script to submit.
+        :param after: JobID of a job which must complete before the
+        script starts.
+        """
+        options = dependencyOptions(after) if after else ''
+
+        return await submitJob(conn, setup, script, options)
+
+    async def wait(
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        job_id: str,
+        resources: ResourceEstimate = None
+    ) -> str:
+        """Wait for a job to finish, raising JobFailedError on failure,
+        and record the resources used by the job of the estimate to
+        calibrate the next ones.
+
+        The job of the estimate is the one waited for, unless another job
+        was given the estimate (see ResourceEstimate.job_id): then it is
+        recorded only once the job waited for completed.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        :param job_id: The Slurm job ID.
+        :param resources: The resources estimated for the job.
+        """
+        if resources is not None and resources.job_id is not None:
+            job_id, waited = resources.job_id, job_id
+        else:
+            waited = job_id
+
+        try:
+            state = await super().wait(hostname, username, password, waited)
+        except JobFailedError as e:
+            # A job out of time or memory tells its needs were larger
+            if waited == job_id and e.state in EXHAUSTED_STATES:
+                await self.record(
+                    hostname,
+                    username,
+                    password,
+                    job_id,
+                    resources
+                )
+            raise
+
+        await self.record(hostname, username, password, job_id, resources)
+
+        return state
+
+    async def record(
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        job_id: str,
+        resources: ResourceEstimate = None
+    ):
+        """Record the resources used by a finished job in the history of
+        the resource estimator.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        :param job_id: The Slurm job ID.
+        :param resources: The resources estimated for the job.
+        """
+        if resources is None or resources.model is None:
+            return
+
+        try:
+            conn = await pool.connect(hostname, username, password)
+            usage = await jobUsage(conn, job_id)
+        except Exception as e:
+            print(f"WARNING: resources used by job {job_id} unknown ({e})")
+            return
+
+        if usage is not None:
+            estimator.record(resources, usage)
+
+
+class LocalBackend(ExecutionBackend):
+    """Backend running the scripts as plain processes on the host the
+    application connects to, without waiting in the Slurm queue.
+
+    The programs get a bounded number of threads and at most max_jobs
+    scripts of a user run at the same time, the others wait for a free
+    slot. Every job keeps its state in a file polled by the job monitor,
+    with the names of the Slurm states.
+
+    :param threads: Threads given to the programs of the scripts.
+    :param max_jobs: Scripts of a user run at the same time.
+    """
+
+    name = 'local'
+
+    def __init__(
+        self,
+        threads: int = DEFAULT_LOCAL_THREADS,
+        max_jobs: int = DEFAULT_LOCAL_JOBS
+    ):
+        self.threads = threads
+        self.max_jobs = max_jobs
+
+    def configure(self, **options):
+        """Update the settings of the backend.
+
+        :param options: Any of threads and max_jobs.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown local backend option: {name}")
+            setattr(self, name, value)
+
+    def cores(self, resources: ResourceEstimate) -> int:
+        """Get the threads given to the programs of a script, bounded by
+        the threads of the backend.
+
+        :param resources: The resources estimated for the job.
+        """
+        return min(self.threads, resources.cores)
+
+    def header(
+        self,
+        job_name: str,
+        account: str,
+        resources: ResourceEstimate
+    ) -> str:
+        """Build the header of a script, a comment as no scheduler reads
+        it.
+
+        :param job_name: The name of the job.
+        :param account: The account charged for the job.
+        :param resources: The resources estimated for the job.
+        """
+        if resources.tasks > 1:
+            raise ValueError("Job arrays are run only through Slurm")
+
+        return (
+            f'# {job_name}: run without Slurm, '
+            f'{self.cores(resources)} threads\n\n'
+        )
+
+    def runner(
+        self,
+        jobs: str,
+        job_id: str,
+        script: str,
+        after: str = None
+    ) -> str:
+        """Build the command running a script in the background of the
+        host as a job, updating its state file.
+
+        :param jobs: Directory of the state files of the jobs.
+        :param job_id: The ID of the job.
+        :param script: Path of the script to run.
+        :param after: ID of a job which must complete before the script
+        starts.
+        """
+        return (
+            f'JOBS={jobs}; ID={job_id}\n'
+            # The state is replaced at once, a reader never sees it empty
+            'setState() { echo $1 > $JOBS/.$ID.tmp '
+            '&& mv -f $JOBS/.$ID.tmp $JOBS/$ID; }\n'
+            # 1. Wait for the job the script depends on
+            f'for DEP in {after or ""}; do\n'
+            '    while :; do\n'
+            '        case $(cat $JOBS/$DEP 2> /dev/null) in\n'
+            '            COMPLETED) break;;\n'
+            f'            PENDING|RUNNING) sleep {LOCAL_WAIT_INTERVAL};;\n'
+            '            *) setState CANCELLED; exit;;\n'
+            '        esac\n'
+            '    done\n'
+            'done\n'
+            # 2. Wait for a free slot, held until the script ends
+            'while :; do\n'
+            f'    for SLOT in $(seq {self.max_jobs}); do\n'
+            '        exec 9> $JOBS/.slot$SLOT\n'
+            '        flock -n 9 && break 2\n'
+            '    done\n'
+            f'    sleep {LOCAL_WAIT_INTERVAL}\n'
+            'done\n'
+            # 3. Run the script
+            'setState RUNNING\n'
+            f'if nice bash {script} > {job_id}.out 2>&1; then\n'
+            '    setState COMPLETED\n'
+            'else\n'
+            '    setState FAILED\n'
+            'fi\n'
+        )
+
+    async def submit(
+        self,
+        conn,
+        scratch_dir: str,
+        setup: list,
+        script: str,
+        after: str = None
+    ) -> str:
+        """Start a script in the background of the host and return its
+        job ID.
+
+        The script is detached from the SSH session, so it survives the
+        connection.
+
+        :param conn: The SSH connection to use.
+        :param scratch_dir: The $SCRATCH directory path.
+        :param setup: Array of strings containing the commands preparing
+        the environment of the script.
+        :param script: Path of the script to run.
+        :param after: ID of a job which must complete before the script
+        starts.
+        """
+        job_id = f'{LOCAL_JOB_PREFIX}{uuid.uuid4().hex[:12]}'
+        jobs = localJobsDir(scratch_dir)
+        runner = self.runner(jobs, job_id, script, after)
+
+        command = ' && '.join(setup + [
+            f'mkdir -p {jobs}',
+            f'echo PENDING > {jobs}/{job_id}',
+            f'{{ setsid nohup bash -c {shlex.quote(runner)} '
+            '> /dev/null 2>&1 < /dev/null & }'
+        ])
+        await conn.run(f'bash -lc {shlex.quote(command)}', check=True)
+
+        return job_id
+
+
+class BackendSelector:
+    """Chooser of the backend executing a run.
+
+    The runs with few reads are executed without Slurm, as they would
+    wait in the queue longer than they run, unless the index they need
+    must be built, as the build takes a whole node, or is too large to be
+    loaded outside of a compute node.
+
+    :param backend: Name of the backend of every run, chosen by the size
+    of the reads if None.
+    :param local_max_bytes: Bytes of reads up to which a run is executed
+    by the local backend.
+    :param local_max_memory: Memory of the Centrifuge job up to which a
+    run is executed by the local backend.
+    """
+
+    def __init__(
+        self,
+        backend: str = None,
+        local_max_bytes: int = DEFAULT_LOCAL_MAX_BYTES,
+        local_max_memory: int = DEFAULT_LOCAL_MAX_MEMORY
+    ):
+        self.backend = backend
+        self.local_max_bytes = local_max_bytes
+        self.local_max_memory = local_max_memory
+        self.backends = {
+            backend.name: backend for backend in (
+                SlurmBackend(),
+                LocalBackend()
+            )
+        }
+
+    def configure(self, **options):
+        """Update the settings of the selector.
+
+        :param options: Any of backend, local_max_bytes and
+        local_max_memory.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown backend selector option: {name}")
+            if name == 'backend' and value not in (None, *self.backends):
+                raise ValueError(f"Unknown execution backend: {value}")
+            setattr(self, name, value)
+
+    def get(self, name: str) -> ExecutionBackend:
+        """Get a backend by its name.
+
+        :param name: The name of the backend.
+        """
+        return self.backends[name]
+
+    def select(
+        self,
+        size: int,
+        index_cached: bool = True,
+        memory: int = 0
+    ) -> ExecutionBackend:
+        """Choose the backend of a run.
+
+        :param size: Bytes of the reads of the run.
+        :param index_cached: True if the index of the run is already in
+        the index cache, the run is executed by Slurm otherwise.
+        :param memory: Memory estimated for the Centrifuge job of the run.
+        """
+        if not index_cached:
+            return self.get('slurm')
+        if self.backend is not None:
+            return self.get(self.backend)
+        if size <= self.local_max_bytes and memory <= self.local_max_memory:
+            return self.get('local')
+
+        return self.get('slurm')
+
+
+# Selector shared by every run
+backends = BackendSelector()
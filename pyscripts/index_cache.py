@@ -0,0 +1,145 @@
+import hashlib
+import json
+import time
+
+import asyncssh
+
+
+# Directory in $SCRATCH holding the cached Centrifuge indexes
+INDEX_CACHE = 'cleanseq_cache/index'
+
+# Name of the index files inside each cache entry
+INDEX_NAME = 'abv'
+
+# Days after which a cached index is considered stale and rebuilt
+INDEX_MAX_AGE_DAYS = 90
+
+# Assembly level filter applied to the library of each domain
+ASSEMBLY_LEVELS = {'bacteria': 'Chromosome'}
+
+# Minutes after which the replaced builds of an index are removed, longer
+# than the walltime of any job still reading them
+INDEX_KEEP_MINUTES = 2 * 24 * 60  # 2 days
+
+
+def _indexDescription(domains: list, snapshot: str) -> dict:
+    """Describe the content of the index of a set of domains.
+
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the library snapshot.
+    """
+    return {
+        'domains': sorted(domains),
+        'assembly_levels': {
+            domain: ASSEMBLY_LEVELS[domain]
+            for domain in sorted(domains) if domain in ASSEMBLY_LEVELS
+        },
+        'snapshot': snapshot
+    }
+
+
+def indexKey(domains: list, snapshot: str) -> str:
+    """Build the cache key of the index of a set of domains.
+
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the library snapshot.
+    """
+    description = json.dumps(
+        _indexDescription(domains, snapshot),
+        sort_keys=True
+    )
+
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def indexDir(scratch_dir: str, key: str) -> str:
+    """Get the absolute path of a cache entry, a link to the current
+    build of the index.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param key: The cache key of the index.
+    """
+    return f'{scratch_dir}/{INDEX_CACHE}/{key}'
+
+
+def indexMetadata(domains: list, snapshot: str) -> dict:
+    """Build the metadata stored next to a cached index.
+
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the library snapshot.
+    """
+    return {
+        'key': indexKey(domains, snapshot),
+        **_indexDescription(domains, snapshot)
+    }
+
+
+async def lookupIndex(sftp, scratch_dir: str, key: str) -> bool:
+    """Check if a usable index is in the cache.
+
+    An entry older than INDEX_MAX_AGE_DAYS is stale and not used.
+
+    :param sftp: The SFTP client to use.
+    :param scratch_dir: The $SCRATCH directory path.
+    :param key: The cache key of the index.
+    """
+    entry = indexDir(scratch_dir, key)
+
+    try:
+        async with sftp.open(f'{entry}/meta.json', 'r') as file:
+            meta = json.loads(await file.read())
+
+        await sftp.stat(f'{entry}/{INDEX_NAME}.1.cf')
+    except (asyncssh.SFTPNoSuchFile, json.JSONDecodeError):
+        return False
+
+    age_days = (time.time() - meta['created']) / (24 * 60 * 60)
+    if age_days > INDEX_MAX_AGE_DAYS:
+        print(f"Cached index {key} is stale ({age_days:.0f} days old)")
+        return False
+
+    return True
+
+
+def buildIndexCommands(
+    scratch_dir: str,
+    domains: list,
+    snapshot: str,
+    threads: int = 48
+) -> str:
+    """Build the script lines building an index into the cache.
+
+    Every build has its own directory, and the link of the cache entry
+    is switched to it atomically once complete. A failed or concurrent
+    job never leaves a partial index in the cache, and the jobs reading
+    the previous build keep it until INDEX_KEEP_MINUTES later.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param snapshot: Label of the library snapshot.
+    :param threads: Number of threads of centrifuge-build.
+    """
+    meta = indexMetadata(domains, snapshot)
+    key = meta['key']
+    entry = indexDir(scratch_dir, key)
+
+    return (
+        f'build={key}.$(date +%s).$(hostname -s).$$\n'
+        f'mkdir -p {scratch_dir}/{INDEX_CACHE}/$build\n'
+        f'centrifuge-build -p {threads} --conversion-table seqid2taxid.map '
+        '--taxonomy-tree taxonomy/nodes.dmp --name-table '
+        f'taxonomy/names.dmp sequences.fna '
+        f'{scratch_dir}/{INDEX_CACHE}/$build/{INDEX_NAME} || exit 1\n'
+        f"echo '{json.dumps(meta)[:-1]}, \"created\": '$(date +%s)'}}' "
+        f'> {scratch_dir}/{INDEX_CACHE}/$build/meta.json\n'
+        # An entry cached before the builds were linked is a directory
+        f'[ -L {entry} ] || rm -rf {entry}\n'
+        f'ln -sfn $build {entry}.$$ && mv -Tf {entry}.$$ {entry}\n'
+        # Remove the old builds, and the ones of failed jobs
+        f'find {scratch_dir}/{INDEX_CACHE} -maxdepth 1 -name "{key}.*" '
+        f'-mmin +{INDEX_KEEP_MINUTES} ! -name $build -exec rm -rf {{}} +\n'
+    )
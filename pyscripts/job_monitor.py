@@ -0,0 +1,457 @@
+import asyncio
+import contextvars
+import shlex
+import weakref
+
+from pyscripts.connection import pool
+from pyscripts.resources import parseMemory
+from pyscripts.workspace import REMOTE_WORKSPACES
+
+
+# States after which a job will not change anymore
+TERMINAL_STATES = {
+    'COMPLETED',
+    'FAILED',
+    'TIMEOUT',
+    'OUT_OF_MEMORY',
+    'CANCELLED',
+    'NODE_FAIL',
+    'PREEMPTED',
+    'BOOT_FAIL',
+    'DEADLINE',
+    'UNKNOWN'
+}
+
+# Terminal states of the jobs that did not complete their work, or not
+# for sure
+FAILURE_STATES = TERMINAL_STATES - {'COMPLETED'}
+
+# Seconds between two polls while a job is in a state: short while the
+# job is about to change, long while it is waiting in the queue
+POLL_INTERVALS = {
+    'CONFIGURING': 2,
+    'COMPLETING': 3,
+    'RUNNING': 15,
+    'PENDING': 30
+}
+DEFAULT_POLL_INTERVAL = 10
+
+# Growth of the poll interval while no job changes state, and its limit
+BACKOFF_FACTOR = 1.5
+MAX_BACKOFF = 4
+
+# Consecutive polls after which a job missing from both squeue and sacct
+# is considered finished in an UNKNOWN state
+MAX_MISSING_POLLS = 3
+
+# Prefix of the IDs of the jobs run without Slurm, whose state is kept
+# in a file named after the ID
+LOCAL_JOB_PREFIX = 'local-'
+
+
+class JobFailedError(Exception):
+    """Raised when a Slurm job ends in a failure state.
+
+    :param job_id: The Slurm job ID.
+    :param state: The terminal state of the job.
+    """
+
+    def __init__(self, job_id: str, state: str):
+        super().__init__(f"Job {job_id} ended in state {state}")
+        self.job_id = job_id
+        self.state = state
+
+
+def parseStates(output: str) -> dict:
+    """Parse the 'JobID State' lines printed by squeue and sacct.
+
+    :param output: The output of the command.
+    """
+    states = {}
+
+    for line in output.splitlines():
+        fields = line.replace('|', ' ').split()
+        # sacct prints states like 'CANCELLED by 1234'
+        if len(fields) >= 2:
+            states[fields[0]] = fields[1].rstrip('+')
+
+    return states
+
+
+def parseUsage(output: str, job_id: str) -> dict:
+    """Parse the 'JobID|ElapsedRaw|MaxRSS' lines printed by sacct for a
+    job and its steps, None if the job is not in the output. The usage of
+    a job array is the largest one of its tasks.
+
+    :param output: The output of the command.
+    :param job_id: The Slurm job ID.
+    """
+    seconds = None
+    memory = 0
+
+    for line in output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 3:
+            continue
+        # Lines of the job, of its array tasks ('<job>_<task>') and steps
+        job = fields[0].split('.')[0]
+        if job.split('_')[0] != job_id:
+            continue
+        if job == fields[0] and fields[1].isdigit():
+            seconds = max(seconds or 0, int(fields[1]))
+        # The peak memory is reported by the steps, in kilobytes by default
+        if fields[2]:
+            rss = fields[2] if fields[2][-1].isalpha() else f'{fields[2]}K'
+            memory = max(memory, parseMemory(rss))
+
+    if seconds is None:
+        return None
+
+    return {'seconds': seconds, 'memory': memory}
+
+
+def isLocalJob(job_id: str) -> bool:
+    """Check if a job is run without Slurm.
+
+    :param job_id: The job ID.
+    """
+    return job_id.startswith(LOCAL_JOB_PREFIX)
+
+
+def localJobsDir(scratch_dir: str) -> str:
+    """Get the absolute path of the directory holding the state files of
+    the jobs run without Slurm.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    """
+    return f'{scratch_dir}/{REMOTE_WORKSPACES}/.jobs'
+
+
+def localStatesCommand(scratch_dir: str, job_ids: list) -> str:
+    """Build the command printing the 'JobID State' lines of the jobs run
+    without Slurm, skipping the unknown ones.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param job_ids: The IDs of the jobs.
+    """
+    return (
+        f'cd {localJobsDir(scratch_dir)} 2> /dev/null && '
+        f'for ID in {" ".join(job_ids)}; do '
+        '[ -f $ID ] && echo "$ID $(cat $ID)"; done; true'
+    )
+
+
+async def submitJob(
+    conn,
+    setup: list,
+    script: str,
+    options: str = ''
+) -> str:
+    """Submit a Slurm script after preparing the submission environment.
+
+    The job inherits the environment of the login shell running the
+    setup commands (modules, $PATH, python environment).
+
+    :param conn: The SSH connection to use.
+    :param setup: Array of strings containing the commands to run
+    before sbatch.
+    :param script: Path of the script to submit.
+    :param options: Additional sbatch options.
+    """
+    command = ' && '.join(setup + [f'sbatch --parsable {options} {script}'])
+    result = await conn.run(f'bash -lc {shlex.quote(command)}', check=True)
+
+    # The last line is '<job id>[;<cluster>]'
+    return result.stdout.strip().split('\n')[-1].split(';')[0]
+
+
+async def jobUsage(conn, job_id: str) -> dict:
+    """Get the seconds and the peak memory used by a finished Slurm job
+    from the accounting, None if they are unknown.
+
+    :param conn: The SSH connection to use.
+    :param job_id: The Slurm job ID.
+    """
+    result = await conn.run(
+        f'sacct -n -P -j {job_id} -o JobID,ElapsedRaw,MaxRSS 2> /dev/null'
+    )
+
+    return parseUsage(result.stdout, job_id)
+
+
+class ClusterMonitor:
+    """Poller of the jobs of one user on one cluster.
+
+    All the tracked jobs are polled with a single squeue call, followed by
+    a single sacct call for the jobs that left the queue. The jobs run
+    without Slurm are polled with a single read of their state files.
+
+    The password is given with every tracked job and forgotten with it,
+    each poll connects with the password of the last job tracked.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param listeners: List of the callables notified of the transitions.
+    """
+
+    def __init__(self, hostname, username, listeners):
+        self.hostname = hostname
+        self.username = username
+        self.listeners = listeners
+        self.passwords = {}
+        self.states = {}
+        self.missing = {}
+        self.waiters = {}
+        self.contexts = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def track(self, job_id: str, password: str) -> asyncio.Future:
+        """Start tracking a job.
+
+        :param job_id: The Slurm job ID.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.passwords.pop(job_id, None)
+        self.passwords[job_id] = password
+        self.waiters.setdefault(job_id, []).append(future)
+        self.states.setdefault(job_id, None)
+        self.missing.setdefault(job_id, 0)
+
+        # The listeners are notified in the context of the first waiter
+        self.contexts.setdefault(job_id, contextvars.copy_context())
+
+        # Poll immediately to catch the first state
+        self.wakeup.set()
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+
+        return future
+
+    def _interval(self, backoff: float) -> float:
+        """Get the seconds to wait before the next poll.
+
+        :param backoff: The current backoff multiplier.
+        """
+        intervals = [
+            POLL_INTERVALS.get(state, DEFAULT_POLL_INTERVAL)
+            for state in self.states.values()
+        ]
+
+        return min(intervals, default=DEFAULT_POLL_INTERVAL) * backoff
+
+    def _publish(self, job_id: str, state: str):
+        """Record a state transition and notify the listeners and waiters.
+
+        :param job_id: The Slurm job ID.
+        :param state: The new state of the job.
+        """
+        previous = self.states.get(job_id)
+        self.states[job_id] = state
+
+        print(f"\rJobId = {job_id}: state -> {state}", end='', flush=True)
+
+        context = self.contexts[job_id]
+        for listener in list(self.listeners):
+            context.run(listener, job_id, previous, state)
+
+        if state in TERMINAL_STATES:
+            print()
+            del self.states[job_id]
+            del self.passwords[job_id]
+            del self.missing[job_id]
+            del self.contexts[job_id]
+            for future in self.waiters.pop(job_id, []):
+                if not future.done():
+                    future.set_result(state)
+
+    async def _poll(self) -> bool:
+        """Poll the tracked jobs, return True if any changed state.
+        """
+        password = list(self.passwords.values())[-1]
+        conn = await pool.connect(self.hostname, self.username, password)
+        states = {}
+
+        local = [job for job in self.states if isLocalJob(job)]
+        if local:
+            scratch_dir = await pool.scratchDir(
+                self.hostname,
+                self.username,
+                password
+            )
+            result = await conn.run(localStatesCommand(scratch_dir, local))
+            states.update(parseStates(result.stdout))
+
+        slurm = [job for job in self.states if not isLocalJob(job)]
+        if slurm:
+            result = await conn.run(
+                f'squeue -h -j {",".join(slurm)} -o "%i %T" 2> /dev/null'
+            )
+            states.update(parseStates(result.stdout))
+
+        # Jobs which left the queue are looked up in the accounting
+        gone = [job for job in slurm if job not in states]
+        if gone:
+            result = await conn.run(
+                f'sacct -n -X -P -j {",".join(gone)} -o JobID,State '
+                '2> /dev/null'
+            )
+            states.update({
+                job: state for job, state in parseStates(result.stdout).items()
+                if state in TERMINAL_STATES
+            })
+
+        changed = False
+
+        for job_id in list(self.states):
+            state = states.get(job_id)
+
+            if state is None:
+                self.missing[job_id] += 1
+                if self.missing[job_id] < MAX_MISSING_POLLS:
+                    continue
+                state = 'UNKNOWN'
+            else:
+                # Only a job missing at every poll is lost, not one
+                # missed now and then by a lagging sacct
+                self.missing[job_id] = 0
+
+            if state != self.states[job_id]:
+                self._publish(job_id, state)
+                changed = True
+
+        return changed
+
+    async def _run(self):
+        """Poll the jobs until none is left, adapting the interval.
+        """
+        backoff = 1
+
+        while self.states:
+            self.wakeup.clear()
+
+            try:
+                changed = await self._poll()
+            except Exception as e:
+                # Keep the waiters alive across transient SSH errors
+                print(f"\nERROR: job polling failed ({e})")
+                changed = False
+
+            backoff = 1 if changed else min(backoff * BACKOFF_FACTOR, MAX_BACKOFF)
+
+            if not self.states:
+                break
+
+            try:
+                await asyncio.wait_for(
+                    self.wakeup.wait(),
+                    timeout=self._interval(backoff)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+class JobMonitor:
+    """Event loop friendly monitor of Slurm jobs.
+
+    Listeners registered with subscribe() receive every state transition
+    as (job_id, previous_state, new_state), in the context variables of
+    the first coroutine waiting for the job.
+    """
+
+    def __init__(self):
+        self._clusters = weakref.WeakKeyDictionary()
+        self.listeners = []
+
+    def subscribe(self, listener):
+        """Register a callable notified of every state transition.
+
+        :param listener: Callable receiving job_id, previous and new state.
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """Remove a callable registered with subscribe().
+
+        :param listener: The callable to remove.
+        """
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _cluster(self, hostname, username) -> ClusterMonitor:
+        """Get the poller of a user and cluster on the running loop.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account.
+        """
+        clusters = self._clusters.setdefault(asyncio.get_running_loop(), {})
+        key = (hostname, username)
+
+        if key not in clusters:
+            clusters[key] = ClusterMonitor(hostname, username, self.listeners)
+
+        return clusters[key]
+
+    def forget(self, hostname: str, username: str):
+        """Drop the pollers of a user and cluster which track no job.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account.
+        """
+        for clusters in list(self._clusters.values()):
+            cluster = clusters.get((hostname, username))
+
+            if cluster is not None and not cluster.states:
+                del clusters[(hostname, username)]
+
+    async def wait(
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        job_id: str
+    ) -> str:
+        """Wait for a job to reach a terminal state and return it.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        :param job_id: The Slurm job ID.
+        """
+        cluster = self._cluster(hostname, username)
+
+        return await cluster.track(job_id, password)
+
+    async def waitCompleted(
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        job_id: str
+    ) -> str:
+        """Wait for a job to finish, raising JobFailedError on failure or
+        if its final state is unknown, as its results may be missing.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        :param password: A string which is the password of the account
+        to connect in the host machine.
+        :param job_id: The Slurm job ID.
+        """
+        state = await self.wait(hostname, username, password, job_id)
+
+        if state in FAILURE_STATES:
+            raise JobFailedError(job_id, state)
+
+        return state
+
+
+# Monitor shared by every pipeline stage
+monitor = JobMonitor()
@@ -0,0 +1,200 @@
+import os
+import re
+
+from pyscripts.index_cache import ASSEMBLY_LEVELS
+from pyscripts.workspace import localDir
+
+
+# Directory in $SCRATCH holding the shared taxonomy and RefSeq libraries
+LIBRARY_CACHE = 'cleanseq_cache/refseq'
+
+# Days after which the taxonomy and the libraries are checked for updates
+CACHE_MAX_AGE_DAYS = 30
+
+# Number of assemblies downloaded at the same time during a refresh
+DOWNLOAD_PARALLELISM = 16
+
+# Assembly level used for the domains without an explicit filter
+DEFAULT_ASSEMBLY_LEVEL = 'Complete Genome'
+
+# Base URL of the RefSeq genomes
+REFSEQ_URL = 'https://ftp.ncbi.nlm.nih.gov/genomes/refseq'
+
+
+def cacheDir(scratch_dir: str) -> str:
+    """Get the absolute path of the library cache.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    """
+    return f'{scratch_dir}/{LIBRARY_CACHE}'
+
+
+def buildRefreshScript(run_id: str) -> str:
+    """Build the script refreshing the library cache on the cluster.
+
+    Every domain keeps the list of the assemblies it holds, compared at
+    each refresh with the RefSeq assembly summary: only the new or
+    changed assemblies are downloaded and the withdrawn ones removed.
+    The script prints the snapshot label of the requested domains, which
+    changes only when a library actually changed.
+
+    :param run_id: The ID of the run.
+    """
+    # Write the script file
+    script = os.path.join(localDir('scripts', run_id), 'refresh_library.sh')
+    with open(script, 'w', newline='\n') as file:
+        file.write(
+            '#!/bin/bash\n'
+            '# Usage: refresh_library.sh <cache> <domain>:<level>...\n\n'
+            'export LC_ALL=C\n'
+            'CACHE=$1\n'
+            'shift\n'
+            f'MAX_AGE={CACHE_MAX_AGE_DAYS}\n'
+            f'PARALLEL={DOWNLOAD_PARALLELISM}\n\n'
+        )
+
+        # 1. Serialize the refreshes of concurrent runs
+        file.write(
+            'mkdir -p $CACHE/taxonomy $CACHE/library $CACHE/seqid2taxid\n'
+            'exec 9> $CACHE/.lock\n'
+            'flock 9\n\n'
+            'stale() {\n'
+            '    [ ! -f "$1" ] || [ -n "$(find "$1" -mtime +$MAX_AGE)" ]\n'
+            '}\n\n'
+        )
+
+        # 2. Download one assembly and its seqid -> taxid map fragment
+        file.write(
+            'fetch() {\n'
+            '    DIR=$1; ACC=$2; TAXID=$3; FTP=${4/ftp:/https:}\n'
+            '    FILE=$(basename $FTP)_genomic.fna.gz\n'
+            '    wget -q -O - $FTP/$FILE | gunzip > $DIR/$ACC.fna.tmp '
+            '|| { rm -f $DIR/$ACC.fna.tmp; return 1; }\n'
+            '    mv $DIR/$ACC.fna.tmp $DIR/$ACC.fna\n'
+            '    grep "^>" $DIR/$ACC.fna | cut -d " " -f 1 | cut -c 2- '
+            '| sed "s/$/\\t$TAXID/" > $DIR/$ACC.map\n'
+            '    printf "%s\\t%s\\t%s\\n" $ACC $TAXID $4 >> $DIR/.fetched\n'
+            '}\n'
+            'export -f fetch\n\n'
+        )
+
+        # 3. Refresh the taxonomy
+        file.write(
+            'if stale $CACHE/taxonomy/.updated; then\n'
+            '    centrifuge-download -o $CACHE/taxonomy taxonomy '
+            '&& touch $CACHE/taxonomy/.updated\n'
+            'fi\n\n'
+        )
+
+        # 4. Refresh the library of each domain
+        file.write(
+            'for SPEC in "$@"; do\n'
+            '    DOMAIN=${SPEC%%:*}\n'
+            '    LEVEL=${SPEC#*:}\n'
+            '    DIR=$CACHE/library/$DOMAIN\n'
+            '    mkdir -p $DIR\n'
+            '    touch $DIR/.assemblies\n'
+            '    stale $DIR/.updated || continue\n\n'
+            f'    wget -q -O $DIR/assembly_summary.txt '
+            f'{REFSEQ_URL}/$DOMAIN/assembly_summary.txt || continue\n'
+            '    awk -F "\\t" -v level="$LEVEL" '
+            '\'$11 == "latest" && $12 == level {print $1"\\t"$6"\\t"$20}\' '
+            '$DIR/assembly_summary.txt | sort > $DIR/.wanted\n\n'
+            '    # Remove the withdrawn or replaced assemblies\n'
+            '    comm -13 $DIR/.wanted $DIR/.assemblies | cut -f 1 '
+            '| while read ACC; do rm -f $DIR/$ACC.fna $DIR/$ACC.map; done\n\n'
+            '    # Download the new or changed assemblies\n'
+            '    rm -f $DIR/.fetched\n'
+            '    comm -23 $DIR/.wanted $DIR/.assemblies '
+            '| xargs -r -P $PARALLEL -L 1 bash -c \'fetch "$0" "$@"\' $DIR\n'
+            '    touch $DIR/.fetched\n\n'
+            '    # Record the assemblies now held by the library\n'
+            '    CHANGED=$(comm -3 $DIR/.wanted $DIR/.assemblies | wc -l)\n'
+            '    sort -m <(comm -12 $DIR/.wanted $DIR/.assemblies) '
+            '<(sort $DIR/.fetched) > $DIR/.assemblies.new\n'
+            '    mv $DIR/.assemblies.new $DIR/.assemblies\n'
+            '    if [ $CHANGED -gt 0 ] || [ ! -f $DIR/.snapshot ]; then\n'
+            '        cat $DIR/*.map > $CACHE/seqid2taxid/$DOMAIN.map 2> /dev/null\n'
+            '        date +%Y-%m-%d > $DIR/.snapshot\n'
+            '    fi\n\n'
+            '    # Retry at the next run if some download failed\n'
+            '    cmp -s $DIR/.wanted $DIR/.assemblies && touch $DIR/.updated\n'
+            'done\n\n'
+        )
+
+        # 5. Print the snapshot label of the requested libraries
+        file.write(
+            'for SPEC in "$@"; do\n'
+            '    DOMAIN=${SPEC%%:*}\n'
+            '    echo "$DOMAIN@$(cat $CACHE/library/$DOMAIN/.snapshot)"\n'
+            'done | sort | paste -sd ","\n'
+        )
+
+    # Return absolute path of the file
+    return os.path.abspath(script)
+
+
+def refreshCommand(scratch_dir: str, domains: list, script: str) -> str:
+    """Build the command running the refresh script for some domains.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param script: Path of the refresh script on the cluster.
+    """
+    specs = ' '.join(
+        f'"{domain}:{ASSEMBLY_LEVELS.get(domain, DEFAULT_ASSEMBLY_LEVEL)}"'
+        for domain in domains
+    )
+
+    return f'bash {script} {cacheDir(scratch_dir)} {specs}'
+
+
+def snapshotLabel(output: str, domains: list) -> str:
+    """Get the snapshot label printed by the refresh script, as
+    'domain@date' for every domain separated by commas, raising
+    ValueError if the output does not end with the label of the domains.
+
+    :param output: The output of the refresh script.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    """
+    lines = output.strip().split('\n')
+    label = lines[-1].strip()
+    parts = [part.partition('@') for part in label.split(',')]
+    if (
+        sorted(domain for domain, _, _ in parts) != sorted(domains)
+        or not all(
+            re.fullmatch(r'\d{4}-\d{2}-\d{2}', date) for _, _, date in parts
+        )
+    ):
+        raise ValueError(f"Invalid library snapshot: {label!r}")
+
+    return label
+
+
+def libraryCommands(scratch_dir: str, domains: list) -> str:
+    """Build the script lines gathering the cached libraries of the
+    domains in the working directory, as input of centrifuge-build.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    """
+    cache = cacheDir(scratch_dir)
+    maps = ' '.join(f'{cache}/seqid2taxid/{domain}.map' for domain in domains)
+    libraries = ' '.join(f'{cache}/library/{domain}/*.fna' for domain in domains)
+
+    return (
+        f'cat {maps} > seqid2taxid.map\n'
+        f'cat {libraries} > sequences.fna\n'
+    )
+
+
+def linkTaxonomyCommand(scratch_dir: str) -> str:
+    """Build the command linking the cached taxonomy in the working
+    directory.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    """
+    return f'ln -sfn {cacheDir(scratch_dir)}/taxonomy taxonomy'
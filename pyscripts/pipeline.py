@@ -0,0 +1,520 @@
+import asyncio
+import functools
+import os
+import zipfile
+
+from pyscripts.data_visualization import createReport, reportCharts
+from pyscripts.ex_centrifuge import (
+    inspectReads,
+    indexSize,
+    linkReads,
+    uploadReads,
+    prepareCentrifuge,
+    refreshLibraries,
+    submitCentrifuge,
+    executeCentrifuge,
+    downloadCentrifugeReport
+)
+from pyscripts.ex_recentrifuge import (
+    uploadRecentrifugeScript,
+    submitRecentrifuge,
+    executeRecentrifuge,
+    downloadRecentrifugeReport
+)
+from pyscripts.ex_rextract import (
+    uploadRextractScript,
+    submitRextract,
+    executeRextract,
+    downloadRextractSequences
+)
+from pyscripts.execution import backends
+from pyscripts.resources import ResourceEstimate, estimator
+from pyscripts.run_manager import manager
+from pyscripts.workspace import localDir
+
+
+# Stages of the pipeline, in submission order
+PIPELINE_STAGES = ('centrifuge', 'recentrifuge', 'rextract')
+
+# Functions downloading the results of each stage
+STAGE_DOWNLOADS = {
+    'centrifuge': downloadCentrifugeReport,
+    'recentrifuge': downloadRecentrifugeReport,
+    'rextract': downloadRextractSequences
+}
+
+
+async def submitPipeline(
+    hostname: str,
+    username: str,
+    password: str,
+    run_id: str,
+    account: str,
+    inputs: list,
+    domains: list,
+    backend: str = 'slurm',
+    reads: dict = None,
+    snapshot: str = None,
+    index_cached: bool = None
+) -> tuple:
+    """Function to submit Centrifuge, Recentrifuge and Rextract at once,
+    chained with job dependencies, and return the JobID and the resources
+    estimated for the job of each stage.
+
+    The reads must be already uploaded.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param account: The account charged for the jobs.
+    :param inputs: Array of strings containing the names of the
+    raw sequences file/s to include in the scripts.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param backend: The name of the backend running the scripts.
+    :param reads: The size of the reads, as returned by inspectReads,
+    the jobs get the fallback resources if not given.
+    :param snapshot: Label of the snapshot of the libraries, as returned
+    by refreshLibraries, the library cache is refreshed if not given.
+    :param index_cached: True if the index of the domains is already in
+    the index cache, as returned by refreshLibraries.
+    """
+    # Upload all the scripts before submitting anything
+    resources = {}
+    resources['centrifuge'] = await prepareCentrifuge(
+        hostname,
+        username,
+        password,
+        run_id,
+        account,
+        inputs,
+        domains,
+        backend,
+        reads,
+        snapshot,
+        index_cached
+    )
+    resources['recentrifuge'], resources['rextract'] = await asyncio.gather(
+        uploadRecentrifugeScript(
+            hostname,
+            username,
+            password,
+            run_id,
+            account,
+            backend,
+            reads
+        ),
+        uploadRextractScript(
+            hostname,
+            username,
+            password,
+            run_id,
+            account,
+            inputs,
+            backend,
+            reads
+        )
+    )
+
+    # Submit the jobs, the downstream ones queue while Centrifuge runs
+    jobs = {}
+    jobs['centrifuge'] = await submitCentrifuge(
+        hostname,
+        username,
+        password,
+        run_id,
+        backend=backend,
+        resources=resources['centrifuge']
+    )
+    jobs['recentrifuge'], jobs['rextract'] = await asyncio.gather(
+        submitRecentrifuge(
+            hostname,
+            username,
+            password,
+            run_id,
+            jobs['centrifuge'],
+            backend
+        ),
+        submitRextract(
+            hostname,
+            username,
+            password,
+            run_id,
+            jobs['centrifuge'],
+            backend
+        )
+    )
+    print(f"Pipeline submitted: {jobs}")
+
+    return jobs, resources
+
+
+async def collectStage(
+    hostname: str,
+    username: str,
+    password: str,
+    run_id: str,
+    stage: str,
+    job_id: str,
+    backend: str = 'slurm',
+    resources: ResourceEstimate = None
+):
+    """Function to wait for the job of a stage and download its results
+    as soon as it finishes, returning what the download function returns.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param run_id: The ID of the run.
+    :param stage: The name of the stage (one of PIPELINE_STAGES).
+    :param job_id: The JobID of the job of the stage.
+    :param backend: The name of the backend running the job.
+    :param resources: The ResourceEstimate of the job.
+    """
+    print(f"Waiting for the {stage} job to be finished")
+    await backends.get(backend).wait(
+        hostname,
+        username,
+        password,
+        job_id,
+        resources
+    )
+
+    results = await STAGE_DOWNLOADS[stage](
+        hostname,
+        username,
+        password,
+        run_id
+    )
+    print(f"Results of the {stage} job collected")
+
+    return results
+
+
+def chartsRendered(run, future):
+    """Function to record on a run the result of the rendering of the
+    charts of its report, executed in the background.
+
+    :param run: The Run of the report.
+    :param future: The future of reportCharts.
+    """
+    if future.cancelled():
+        return
+
+    error = future.exception()
+    if error is not None:
+        print(f"ERROR: charts of run {run.id} not rendered: {error}")
+        run.error = f"Rendering the charts failed: {error}"
+        run.changed()
+        return
+
+    failed = [name for name, chart in future.result().items() if chart is None]
+    if failed:
+        print(f"WARNING: charts of run {run.id} not rendered: {failed}")
+
+
+def zipSequences(rxtr_files: list, zip_path: str):
+    """Function to zip the downloaded cleaned sequences and delete them.
+
+    :param rxtr_files: Array of strings containing the paths of the
+    cleaned sequences.
+    :param zip_path: Path of the zip file to create.
+    """
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for file in rxtr_files:
+            zipf.write(file, os.path.basename(file))
+
+    # Delete files after zip file creation
+    for file in rxtr_files:
+        os.remove(file)
+
+
+async def centrifugeStage(run):
+    """Function to upload the reads of a run, execute Centrifuge and
+    generate the charts of its report.
+
+    In pipeline mode the downstream stages are submitted too, and their
+    results collected in the background as soon as each job finishes.
+
+    :param run: The Run to execute.
+    """
+    hostname, username, password = run.credentials()
+
+    if run.objects is not None:
+        # The reads were relayed to the cluster while being received
+        run.setProgress('Linking reads files', 10)
+        run.reads = await linkReads(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.inputs,
+            run.objects
+        )
+    else:
+        # Upload reads files in the cluster
+        run.setProgress('Uploading reads files', 10)
+        run.reads = await uploadReads(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.inputs
+        )
+
+    # Run the small inputs without waiting in the Slurm queue, unless the
+    # index must be built or needs too much memory, and size the Slurm
+    # jobs from the reads
+    run.reads_size = await inspectReads(
+        hostname,
+        username,
+        password,
+        run.id,
+        run.reads
+    )
+    run.snapshot, index_cached = await refreshLibraries(
+        hostname,
+        username,
+        password,
+        run.id,
+        run.domains
+    )
+    memory = 0
+    if index_cached:
+        index_bytes = await indexSize(
+            hostname,
+            username,
+            password,
+            run.domains,
+            run.snapshot
+        )
+        memory = estimator.estimate(
+            'centrifuge',
+            {**run.reads_size, 'index_bytes': index_bytes}
+        ).memory
+    run.backend = backends.select(
+        run.reads_size['bytes'],
+        index_cached,
+        memory
+    ).name
+    print(
+        f"Run {run.id}: {run.reads_size['bytes']} bytes of reads, "
+        f"{run.backend} backend"
+    )
+
+    if run.pipeline:
+        # Submit the whole pipeline and wait for the Centrifuge report
+        run.setProgress('Executing the pipeline', 60)
+        run.jobs, run.resources = await submitPipeline(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.account,
+            run.reads,
+            run.domains,
+            run.backend,
+            run.reads_size,
+            run.snapshot,
+            index_cached
+        )
+        report = await collectStage(
+            hostname,
+            username,
+            password,
+            run.id,
+            'centrifuge',
+            run.jobs['centrifuge'],
+            run.backend,
+            run.resources['centrifuge']
+        )
+
+        for stage in PIPELINE_STAGES[1:]:
+            manager.start(run, stage, STAGE_FUNCTIONS[stage])
+    else:
+        # Execute Centrifuge on the cluster
+        run.setProgress('Executing Centrifuge', 60)
+        run.resources['centrifuge'] = await executeCentrifuge(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.account,
+            run.reads,
+            run.domains,
+            run.backend,
+            run.reads_size,
+            run.snapshot,
+            index_cached
+        )
+
+        # Get the Centrifuge report from the cluster
+        run.setProgress('Downloading Centrifuge report', 90)
+        report = await downloadCentrifugeReport(
+            hostname,
+            username,
+            password,
+            run.id
+        )
+
+    # Parse the report out of the event loop
+    run.setProgress('Generating the charts', 95)
+    loop = asyncio.get_running_loop()
+    run.results['report'] = await loop.run_in_executor(
+        None,
+        createReport,
+        report
+    )
+
+    # Render the charts in the background, the report page gets them from
+    # the cache or waits for them
+    run.charts = loop.run_in_executor(
+        None,
+        reportCharts,
+        run.results['report']['report_id']
+    )
+    run.charts.add_done_callback(functools.partial(chartsRendered, run))
+    run.results['centrifuge'] = report
+    run.setProgress('Centrifuge report ready', 100)
+
+
+async def recentrifugeStage(run):
+    """Function to execute Recentrifuge on the results of a run, or to
+    collect the job submitted with the pipeline.
+
+    :param run: The Run to execute.
+    """
+    hostname, username, password = run.credentials()
+
+    if 'recentrifuge' in run.jobs:
+        run.setProgress('Executing Recentrifuge', 60)
+        page = await collectStage(
+            hostname,
+            username,
+            password,
+            run.id,
+            'recentrifuge',
+            run.jobs['recentrifuge'],
+            run.backend,
+            run.resources['recentrifuge']
+        )
+    else:
+        # Upload Recentrifuge script in the cluster
+        run.setProgress('Uploading Recentrifuge script', 10)
+        run.resources['recentrifuge'] = await uploadRecentrifugeScript(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.account,
+            run.backend,
+            run.reads_size
+        )
+
+        # Execute Recentrifuge on the cluster
+        run.setProgress('Executing Recentrifuge', 60)
+        await executeRecentrifuge(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.backend,
+            run.resources['recentrifuge']
+        )
+
+        # Get the Recentrifuge report from the cluster
+        run.setProgress('Downloading Recentrifuge report page', 90)
+        page = await downloadRecentrifugeReport(
+            hostname,
+            username,
+            password,
+            run.id
+        )
+
+    run.results['recentrifuge'] = page
+    run.setProgress('Recentrifuge report ready', 100)
+
+
+async def rextractStage(run):
+    """Function to execute Rextract on the results of a run, or to
+    collect the job submitted with the pipeline, and zip the cleaned
+    sequences.
+
+    :param run: The Run to execute.
+    """
+    hostname, username, password = run.credentials()
+
+    if 'rextract' in run.jobs:
+        run.setProgress('Executing Rextract', 60)
+        sequences = await collectStage(
+            hostname,
+            username,
+            password,
+            run.id,
+            'rextract',
+            run.jobs['rextract'],
+            run.backend,
+            run.resources['rextract']
+        )
+    else:
+        # Upload Rextract script in the cluster
+        run.setProgress('Uploading Rextract script', 10)
+        run.resources['rextract'] = await uploadRextractScript(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.account,
+            run.reads,
+            run.backend,
+            run.reads_size
+        )
+
+        # Execute Rextract on the cluster
+        run.setProgress('Executing Rextract', 60)
+        await executeRextract(
+            hostname,
+            username,
+            password,
+            run.id,
+            run.backend,
+            run.resources['rextract']
+        )
+
+        # Get the Rextract cleaned sequences from the cluster
+        run.setProgress('Downloading cleaned sequences', 90)
+        sequences = await downloadRextractSequences(
+            hostname,
+            username,
+            password,
+            run.id
+        )
+
+    # Zip the cleaned sequences out of the event loop
+    run.setProgress('Zipping cleaned sequences', 95)
+    zip_path = os.path.join(
+        localDir('download', run.id),
+        'cleaned_sequences.zip'
+    )
+    await asyncio.get_running_loop().run_in_executor(
+        None,
+        zipSequences,
+        sequences,
+        zip_path
+    )
+
+    run.results['rextract'] = zip_path
+    run.setProgress('Cleaned sequences ready', 100)
+
+
+# Functions executing each stage of a run
+STAGE_FUNCTIONS = {
+    'centrifuge': centrifugeStage,
+    'recentrifuge': recentrifugeStage,
+    'rextract': rextractStage
+}
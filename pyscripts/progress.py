@@ -1,5 +1,108 @@
+import contextvars
+import threading
 
 
+# Channel (run ID) of the code being executed, set by the run manager
+current_channel = contextvars.ContextVar('current_channel', default=None)
+
+
+class ProgressBus:
+    """Push-based bus of the progress events of the runs.
+
+    Every run has its own channel. The publishers registered with
+    subscribe() receive (channel, event, data) for every event, and an
+    event identical to the previous one of the same kind on the same
+    channel is not published again.
+    """
+
+    def __init__(self):
+        self._publishers = []
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, publisher):
+        """Register a callable receiving channel, event name and data.
+
+        :param publisher: The callable to register.
+        """
+        self._publishers.append(publisher)
+
+    def unsubscribe(self, publisher):
+        """Unregister a callable registered with subscribe().
+
+        :param publisher: The callable to unregister.
+        """
+        self._publishers.remove(publisher)
+
+    def publish(self, channel: str, event: str, data: dict, key: str = ''):
+        """Publish an event on a channel, unless nothing changed.
+
+        :param channel: The channel (run ID).
+        :param event: The name of the event.
+        :param data: The JSON serializable data of the event.
+        :param key: Distinguishes the events of the same kind that are
+        compared separately (for example the transferred files).
+        """
+        if channel is None:
+            return
+
+        with self._lock:
+            if self._last.get((channel, event, key)) == data:
+                return
+            self._last[(channel, event, key)] = data
+
+        for publisher in list(self._publishers):
+            publisher(channel, event, data)
+
+    def close(self, channel: str):
+        """Forget the last events of a channel.
+
+        :param channel: The channel (run ID).
+        """
+        with self._lock:
+            for last in [last for last in self._last if last[0] == channel]:
+                del self._last[last]
+
+    def transfer(self, direction: str, filename: str, done: int, total: int):
+        """Publish the progress of a file transfer on the current channel,
+        once per percent.
+
+        :param direction: 'upload' or 'download'.
+        :param filename: Name of the file.
+        :param done: Number of bytes transferred.
+        :param total: Number of bytes of the file.
+        """
+        self.publish(
+            current_channel.get(),
+            'transfer',
+            {
+                'direction': direction,
+                'file': filename,
+                'percent': int(done * 100 / total) if total else 100,
+                'total': total
+            },
+            key=f'{direction}:{filename}'
+        )
+
+    def jobState(self, job_id: str, previous: str, state: str):
+        """Publish a Slurm job state transition on the current channel,
+        as a listener of the job monitor.
+
+        :param job_id: The Slurm job ID.
+        :param previous: The previous state of the job.
+        :param state: The new state of the job.
+        """
+        self.publish(
+            current_channel.get(),
+            'job',
+            {'job_id': job_id, 'state': state},
+            key=job_id
+        )
+
+
+# Bus shared by every pipeline stage
+bus = ProgressBus()
+
 
 def uploadProgress(localpath, filename, sent, total):
     """Function to watch the progress of upload operation.
@@ -16,6 +119,7 @@ def uploadProgress(localpath, filename, sent, total):
         end='', 
         flush=True
     )
+    bus.transfer('upload', filename.decode(), sent, total)
 
 
 def downloadProgress(localpath, filename, downloaded, total):
@@ -32,4 +136,5 @@ def downloadProgress(localpath, filename, downloaded, total):
         f"{percent:.0f}%: {downloaded}/{total} (bytes)", 
         end='', 
         flush=True  
-    )
\ No newline at end of file
+    )
+    bus.transfer('download', filename.decode(), downloaded, total)
@@ -0,0 +1,389 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import asyncssh
+
+from pyscripts.allowed_file import fileExtension
+from pyscripts.compression import compressor
+from pyscripts.transfer import engine, TransferStats
+
+
+# Directory in $SCRATCH holding the content-addressed reads
+REMOTE_STORE = 'cleanseq_store'
+
+# Local manifest of the hashes computed for the uploaded reads
+LOCAL_MANIFEST = 'uploads/.read_hashes.json'
+
+# Size of the chunks hashed while saving the browser uploads
+SAVE_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def _loadLocalManifest() -> dict:
+    """Load the local manifest of the reads hashes.
+    """
+    try:
+        with open(LOCAL_MANIFEST, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _fileKey(path: str) -> str:
+    """Build the key identifying a local file in the local manifest.
+
+    :param path: Path of the local file.
+    """
+    stat = os.stat(path)
+    return f'{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def recordHash(path: str, sha256: str):
+    """Remember the hash of a local file until it is modified.
+
+    :param path: Path of the local file.
+    :param sha256: Hex digest of the content of the file.
+    """
+    manifest = _loadLocalManifest()
+
+    # Forget the entries of the files that no longer exist
+    manifest = {
+        key: value for key, value in manifest.items()
+        if os.path.exists(key.rsplit(':', 2)[0])
+    }
+    manifest[_fileKey(path)] = sha256
+
+    os.makedirs(os.path.dirname(LOCAL_MANIFEST), exist_ok=True)
+    with open(LOCAL_MANIFEST, 'w') as file:
+        json.dump(manifest, file, indent=1)
+
+
+def knownHash(path: str) -> str:
+    """Get the hash of a local file if it was computed before.
+
+    :param path: Path of the local file.
+    """
+    return _loadLocalManifest().get(_fileKey(path))
+
+
+def saveUpload(storage, path: str) -> str:
+    """Save a browser upload to disk hashing it while it is written.
+
+    :param storage: The werkzeug FileStorage of the upload.
+    :param path: Path of the local file to create.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, 'wb') as file:
+        while True:
+            chunk = storage.stream.read(SAVE_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            file.write(chunk)
+
+    sha256 = digest.hexdigest()
+    recordHash(path, sha256)
+
+    return sha256
+
+
+def objectName(path: str, sha256: str) -> str:
+    """Get the name of the remote object storing a reads file.
+
+    The extension is kept so that the tools recognize compressed files.
+
+    :param path: Path of the local file.
+    :param sha256: Hex digest of the content of the file.
+    """
+    return f'{sha256}.{fileExtension(os.path.basename(path))}'
+
+
+def linkName(path: str, object: str) -> str:
+    """Get the name of the link to a stored reads file in the working
+    directory of a run, compressed on the way if the object is.
+
+    :param path: Path or name of the reads file.
+    :param object: Path of the stored object.
+    """
+    name = os.path.basename(path)
+    if object.endswith('.gz') and not name.endswith('.gz'):
+        name += '.gz'
+
+    return name
+
+
+async def _hashingBlocks(blocks, digest):
+    """Pass through a stream of blocks updating a hash with them.
+
+    :param blocks: Async iterable of the bytes blocks.
+    :param digest: The hashlib object to update.
+    """
+    async for data in blocks:
+        digest.update(data)
+        yield data
+
+
+async def _isStored(sftp, store_dir: str, name: str, sha256: str) -> bool:
+    """Check that an object is in the store with the size in its manifest.
+
+    :param sftp: The SFTP client to use.
+    :param store_dir: Absolute path of the remote store.
+    :param name: Name of the object.
+    :param sha256: Hex digest of the content of the object.
+    """
+    try:
+        async with sftp.open(
+            f'{store_dir}/manifest/{sha256}.json', 'r'
+        ) as file:
+            entry = json.loads(await file.read())
+
+        attrs = await sftp.stat(f'{store_dir}/objects/{name}')
+    except (asyncssh.SFTPNoSuchFile, json.JSONDecodeError):
+        return False
+
+    return attrs.size == entry['size']
+
+
+async def _storeBlocks(
+    sftp,
+    store_dir: str,
+    path: str,
+    blocks,
+    total: int,
+    progress_handler,
+    stats
+) -> tuple:
+    """Upload a stream of reads in the store and return the path of the
+    object and the hash of its content.
+
+    The plain FASTQ reads are compressed while sent, the object is still
+    named after the hash of the plain reads so that it is found from the
+    hash of the local file.
+
+    :param sftp: The SFTP client to use.
+    :param store_dir: Absolute path of the remote store.
+    :param path: Path or name of the reads file.
+    :param blocks: Async iterable of the bytes blocks of the reads.
+    :param total: Expected number of bytes, 0 if unknown.
+    :param progress_handler: Callable with the signature of the
+    asyncssh progress handlers.
+    :param stats: TransferStats to update.
+    """
+    digest = hashlib.sha256()
+    blocks = _hashingBlocks(blocks, digest)
+
+    if compressor.compresses(path):
+        # The progress follows the plain bytes, the compressed size is
+        # known only at the end
+        filename = os.path.basename(path).encode()
+        handler = progress_handler
+        expected = total
+        read = 0
+
+        def onRead(size):
+            nonlocal read
+            read += size
+            if handler is not None:
+                handler(filename, filename, read, max(expected, read))
+
+        blocks = compressor.compress(blocks, onRead)
+        total = 0
+        progress_handler = None
+
+    # Upload to a temporary object, the name is known only at the end
+    part = f'{store_dir}/objects/{uuid.uuid4().hex}.part'
+    try:
+        size = await engine.putStream(
+            sftp,
+            blocks,
+            part,
+            total,
+            progress_handler,
+            stats
+        )
+    except (Exception, asyncio.CancelledError):
+        # Do not leave the partial object in the store
+        try:
+            await sftp.remove(part)
+        except asyncssh.Error:
+            pass
+        raise
+    sha256 = digest.hexdigest()
+    stored = compressor.storedName(os.path.basename(path))
+    name = objectName(stored, sha256)
+    target = f'{store_dir}/objects/{name}'
+
+    # Another upload may have stored the same content in the meanwhile
+    try:
+        await sftp.rename(part, target)
+    except asyncssh.SFTPFailure:
+        if not await sftp.exists(target):
+            raise
+        await sftp.remove(part)
+
+    entry = {
+        'sha256': sha256,
+        'size': size,
+        'name': stored,
+        'uploaded': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    async with sftp.open(
+        f'{store_dir}/manifest/{sha256}.json', 'w'
+    ) as file:
+        await file.write(json.dumps(entry))
+
+    return target, sha256
+
+
+async def _storeFile(
+    sftp,
+    store_dir: str,
+    path: str,
+    progress_handler,
+    stats
+) -> str:
+    """Upload a reads file in the store, unless it is already there.
+
+    :param sftp: The SFTP client to use.
+    :param store_dir: Absolute path of the remote store.
+    :param path: Path of the local file.
+    :param progress_handler: Callable with the signature of the
+    asyncssh progress handlers.
+    :param stats: TransferStats to update.
+    """
+    sha256 = knownHash(path)
+
+    if sha256 is not None:
+        name = objectName(compressor.storedName(path), sha256)
+        if await _isStored(sftp, store_dir, name, sha256):
+            print(f"{os.path.basename(path)} already on the cluster, skipped")
+            return f'{store_dir}/objects/{name}'
+
+    target, sha256 = await _storeBlocks(
+        sftp,
+        store_dir,
+        path,
+        engine.readLocalBlocks(path),
+        os.path.getsize(path),
+        progress_handler,
+        stats
+    )
+    recordHash(path, sha256)
+
+    return target
+
+
+async def _makeStore(sftp, scratch_dir: str) -> str:
+    """Create the remote store if needed and return its path.
+
+    :param sftp: The SFTP client to use.
+    :param scratch_dir: The $SCRATCH directory path.
+    """
+    store_dir = f'{scratch_dir}/{REMOTE_STORE}'
+    await sftp.makedirs(f'{store_dir}/objects', exist_ok=True)
+    await sftp.makedirs(f'{store_dir}/manifest', exist_ok=True)
+
+    return store_dir
+
+
+async def storeReads(
+    sftp,
+    scratch_dir: str,
+    inputs: list,
+    progress_handler=None
+) -> list:
+    """Store reads files in the content-addressed store of the cluster.
+
+    The files already stored by a previous run are not uploaded again,
+    the plain FASTQ files are compressed while sent.
+
+    :param sftp: The SFTP client to use.
+    :param scratch_dir: The $SCRATCH directory path.
+    :param inputs: Array of strings containing the paths of the
+    reads files.
+    :param progress_handler: Callable with the signature of the
+    asyncssh progress handlers.
+    """
+    store_dir = await _makeStore(sftp, scratch_dir)
+
+    stats = TransferStats()
+    slots = asyncio.Semaphore(engine.parallelism)
+
+    async def store(path):
+        async with slots:
+            return await _storeFile(
+                sftp,
+                store_dir,
+                path,
+                progress_handler,
+                stats
+            )
+
+    objects = await asyncio.gather(*[store(path) for path in inputs])
+    stats.end = time.monotonic()
+    print(f"\nUploaded {stats}")
+
+    return objects
+
+
+async def storeStream(
+    sftp,
+    scratch_dir: str,
+    filename: str,
+    blocks,
+    progress_handler=None,
+    sha256: str = None,
+    size: int = 0
+) -> str:
+    """Store a stream of reads in the content-addressed store of the
+    cluster and return the path of the object.
+
+    When the hash of the reads is known in advance and they are already
+    stored, the stream is only read to check the hash, nothing is sent
+    to the cluster.
+
+    :param sftp: The SFTP client to use.
+    :param scratch_dir: The $SCRATCH directory path.
+    :param filename: Name of the reads file.
+    :param blocks: Async iterable of the bytes blocks of the reads.
+    :param progress_handler: Callable with the signature of the
+    asyncssh progress handlers.
+    :param sha256: Hex digest of the content of the reads computed by the
+    browser, None if unknown.
+    :param size: Expected number of bytes of the reads, for the progress,
+    0 if unknown.
+    """
+    store_dir = await _makeStore(sftp, scratch_dir)
+
+    if sha256 is not None:
+        name = objectName(compressor.storedName(filename), sha256)
+        if await _isStored(sftp, store_dir, name, sha256):
+            digest = hashlib.sha256()
+            async for data in blocks:
+                digest.update(data)
+            if digest.hexdigest() != sha256:
+                raise ValueError(f"Checksum of {filename} does not match")
+            print(f"{filename} already on the cluster, skipped")
+            return f'{store_dir}/objects/{name}'
+
+    stats = TransferStats()
+    target, stored = await _storeBlocks(
+        sftp,
+        store_dir,
+        filename,
+        blocks,
+        size,
+        progress_handler,
+        stats
+    )
+    stats.end = time.monotonic()
+    print(f"\nRelayed {stats}")
+
+    if sha256 is not None and stored != sha256:
+        raise ValueError(f"Checksum of {filename} does not match")
+
+    return target
@@ -0,0 +1,214 @@
+import threading
+
+import numpy as np
+
+from pyscripts.taxonomy_report import TaxonomyReport
+
+
+# Columns of the report that can sort the rows, by their name in the
+# report and their attribute of TaxonomyReport
+SORT_COLUMNS = {
+    'name': 'name',
+    'taxID': 'tax_id',
+    'taxRank': 'rank',
+    'genomeSize': 'genome_size',
+    'numReads': 'num_reads',
+    'numUniqueReads': 'num_unique_reads',
+    'abundance': 'abundance'
+}
+
+# Rows of a page, when not chosen by the page
+DEFAULT_PAGE_SIZE = 100
+
+# Largest number of rows of a page
+MAX_PAGE_SIZE = 1000
+
+
+def _number(args, name: str, kind=float, default=None):
+    """Parse a number of the arguments of a query.
+
+    :param args: Mapping of the arguments.
+    :param name: The name of the argument.
+    :param kind: The type of the number.
+    :param default: Value of the missing or empty argument.
+    """
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"The {name} must be a number")
+
+
+def queryArgs(args) -> dict:
+    """Get the parameters of ReportQuery.query from the arguments of a
+    request.
+
+    :param args: Mapping of the arguments of the request.
+    """
+    params = {
+        'sort': args.get('sort') or 'numReads',
+        'descending': args.get('order', 'desc') != 'asc',
+        'rank': args.get('rank') or None,
+        'name': args.get('name') or None,
+        'min_reads': _number(args, 'min_reads', int),
+        'min_abundance': _number(args, 'min_abundance'),
+        'max_abundance': _number(args, 'max_abundance'),
+        'offset': _number(args, 'offset', int, 0),
+        'limit': _number(args, 'limit', int, DEFAULT_PAGE_SIZE)
+    }
+
+    if params['sort'] not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {params['sort']}")
+    if params['offset'] < 0:
+        raise ValueError("The offset must not be negative")
+    if not 0 < params['limit'] <= MAX_PAGE_SIZE:
+        raise ValueError(f"The limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    return params
+
+
+class ReportQuery:
+    """Sorted, filtered and paged access to the rows of a report.
+
+    The order of the rows by every column and the rows of every rank
+    are computed once, on the first query needing them, so a query costs
+    a pass over the rows at most and only the rows of the page are
+    converted to Python objects.
+
+    :param report: The TaxonomyReport.
+    """
+
+    def __init__(self, report: TaxonomyReport):
+        self.report = report
+        self._orders = {}
+        self._ranks = {}
+        self._names = None
+        self._lock = threading.Lock()
+
+    def order(self, column: str) -> np.ndarray:
+        """Get the positions of the rows sorted by a column, ascending.
+
+        :param column: The name of the column, a key of SORT_COLUMNS.
+        """
+        with self._lock:
+            order = self._orders.get(column)
+            if order is None:
+                values = getattr(self.report, SORT_COLUMNS[column])
+                if column == 'taxRank':
+                    # By the name of the rank, not by its code
+                    codes = np.argsort(
+                        np.array(self.report.rank_names, dtype=object)
+                    )
+                    values = np.argsort(codes)[values]
+                order = np.argsort(values, kind='stable')
+                self._orders[column] = order
+
+        return order
+
+    def rankMask(self, rank: str) -> np.ndarray:
+        """Get the mask of the rows of a rank.
+
+        :param rank: The name of the rank.
+        """
+        with self._lock:
+            mask = self._ranks.get(rank)
+            if mask is None:
+                mask = self.report.rank == self.report.rankCode(rank)
+                self._ranks[rank] = mask
+
+        return mask
+
+    def nameMask(self, name: str) -> np.ndarray:
+        """Get the mask of the rows with a name containing a text, case
+        insensitive.
+
+        The names are searched in a single string, so the text is scanned
+        by str.find and only the rows found are visited in Python.
+
+        :param name: The text to search.
+        """
+        with self._lock:
+            if self._names is None:
+                # Lowercased before measured, as lowercasing may change
+                # the length of a name ('İ' gives 'i̇')
+                names = [name.lower() for name in self.report.name.tolist()]
+                lengths = np.fromiter(
+                    (len(name) + 1 for name in names),
+                    dtype=np.int64,
+                    count=len(names)
+                )
+                self._names = (
+                    '\n'.join(names) + '\n',
+                    np.cumsum(lengths) - lengths
+                )
+        text, starts = self._names
+
+        mask = np.zeros(len(self.report), dtype=bool)
+        name = name.lower()
+        position = text.find(name)
+        while position >= 0:
+            row = int(np.searchsorted(starts, position, side='right')) - 1
+            mask[row] = True
+            # Search from the next row
+            if row + 1 >= len(starts):
+                break
+            position = text.find(name, starts[row + 1])
+
+        return mask
+
+    def query(
+        self,
+        sort: str = 'numReads',
+        descending: bool = True,
+        rank: str = None,
+        name: str = None,
+        min_reads: int = None,
+        min_abundance: float = None,
+        max_abundance: float = None,
+        offset: int = 0,
+        limit: int = DEFAULT_PAGE_SIZE
+    ) -> dict:
+        """Get a page of the rows matching the filters.
+
+        :param sort: The column sorting the rows, a key of SORT_COLUMNS.
+        :param descending: Sort from the largest value.
+        :param rank: Keep the rows of this rank.
+        :param name: Keep the rows with a name containing this text.
+        :param min_reads: Keep the rows with at least this many reads.
+        :param min_abundance: Keep the rows with at least this abundance.
+        :param max_abundance: Keep the rows with at most this abundance.
+        :param offset: Number of matching rows skipped.
+        :param limit: Number of rows of the page.
+        """
+        report = self.report
+        order = self.order(sort)
+        if descending:
+            order = order[::-1]
+
+        # Combine the filters, then keep the matching rows in the order
+        mask = None
+        filters = []
+        if rank is not None:
+            filters.append(self.rankMask(rank))
+        if name is not None:
+            filters.append(self.nameMask(name))
+        if min_reads is not None:
+            filters.append(report.num_reads >= min_reads)
+        if min_abundance is not None:
+            filters.append(report.abundance >= min_abundance)
+        if max_abundance is not None:
+            filters.append(report.abundance <= max_abundance)
+        for condition in filters:
+            mask = condition if mask is None else mask & condition
+
+        if mask is not None:
+            order = order[mask[order]]
+
+        return {
+            'total': len(order),
+            'offset': offset,
+            'rows': list(report.rows(order[offset:offset + limit]))
+        }
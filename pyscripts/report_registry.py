@@ -0,0 +1,197 @@
+import collections
+import json
+import os
+import threading
+
+from pyscripts.chart_cache import reportHash
+from pyscripts.report_query import ReportQuery
+from pyscripts.taxonomy_report import TaxonomyReport, loadParents, treeFile
+
+
+# Directory holding the location of the registered reports
+DEFAULT_REPORT_REGISTRY = 'download/.reports'
+
+# Number of parsed reports kept in memory
+DEFAULT_LOADED_REPORTS = 8
+
+
+class LoadedReport:
+    """A parsed report and the taxonomy tree downloaded with it.
+
+    :param report: The TaxonomyReport.
+    :param parents: The parent taxID of every taxID, None without tree.
+    """
+
+    def __init__(self, report: TaxonomyReport, parents: dict = None):
+        self.report = report
+        self.parents = parents
+        self._query = None
+
+    @property
+    def query(self) -> ReportQuery:
+        """Query of the rows of the report, built on first use."""
+        if self._query is None:
+            self._query = ReportQuery(self.report)
+
+        return self._query
+
+
+class ReportRegistry:
+    """Registry of the reports shown by the report page, by report ID.
+
+    The ID of a report is the hash of its content (see reportHash), so
+    the charts and the queries of the page are requested by ID after the
+    page is displayed. The location of the reports is kept on disk, and
+    the last parsed reports in memory.
+
+    :param directory: Directory of the registry.
+    :param max_loaded: Number of parsed reports kept in memory.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_REPORT_REGISTRY,
+        max_loaded: int = DEFAULT_LOADED_REPORTS
+    ):
+        self.directory = directory
+        self.max_loaded = max_loaded
+        self._paths = {}
+        self._loaded = collections.OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **options):
+        """Update the settings of the registry.
+
+        :param options: Any of directory and max_loaded.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown report registry option: {name}")
+            setattr(self, name, value)
+
+    def _entryPath(self, report_id: str) -> str:
+        """Get the path of the file holding the location of a report.
+
+        :param report_id: The ID of the report.
+        """
+        return os.path.join(self.directory, f'{report_id}.json')
+
+    def register(self, filepath: str, report: TaxonomyReport = None) -> str:
+        """Register a report and return its ID.
+
+        :param filepath: Path of the report.
+        :param report: The report already parsed, if any.
+        """
+        report_id = reportHash(filepath)
+        stat = os.stat(filepath)
+        entry = {
+            'path': os.path.abspath(filepath),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._entryPath(report_id), 'w') as file:
+            json.dump(entry, file)
+
+        with self._lock:
+            self._paths[report_id] = entry
+
+        if report is not None:
+            tree = treeFile(filepath)
+            self._remember(
+                report_id,
+                LoadedReport(report, loadParents(tree) if tree else None)
+            )
+
+        return report_id
+
+    def path(self, report_id: str) -> str:
+        """Get the path of a registered report, None if it is unknown or
+        its file changed since it was registered.
+
+        :param report_id: The ID of the report.
+        """
+        with self._lock:
+            entry = self._paths.get(report_id)
+
+        if entry is None:
+            try:
+                with open(self._entryPath(report_id), 'r') as file:
+                    entry = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError, OSError):
+                return None
+
+        try:
+            stat = os.stat(entry['path'])
+        except OSError:
+            return None
+        current = (stat.st_size, stat.st_mtime_ns)
+        if current != (entry['size'], entry['mtime_ns']):
+            return None
+
+        with self._lock:
+            self._paths[report_id] = entry
+
+        return entry['path']
+
+    def __contains__(self, report_id: str) -> bool:
+        with self._lock:
+            if report_id in self._loaded:
+                return True
+
+        return self.path(report_id) is not None
+
+    def _remember(self, report_id: str, loaded: LoadedReport):
+        """Keep a parsed report in memory, forgetting the oldest ones.
+
+        :param report_id: The ID of the report.
+        :param loaded: The LoadedReport.
+        """
+        with self._lock:
+            self._loaded[report_id] = loaded
+            self._loaded.move_to_end(report_id)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+    def load(self, report_id: str) -> LoadedReport:
+        """Get a registered report parsed, parsing it only once also for
+        concurrent requests.
+
+        :param report_id: The ID of the report.
+        """
+        with self._lock:
+            loaded = self._loaded.get(report_id)
+            if loaded is not None:
+                self._loaded.move_to_end(report_id)
+                return loaded
+            lock = self._loading.setdefault(report_id, threading.Lock())
+
+        try:
+            with lock:
+                # Parsed by another request in the meanwhile
+                with self._lock:
+                    loaded = self._loaded.get(report_id)
+                if loaded is not None:
+                    return loaded
+
+                filepath = self.path(report_id)
+                if filepath is None:
+                    raise KeyError(report_id)
+
+                tree = treeFile(filepath)
+                loaded = LoadedReport(
+                    TaxonomyReport.fromTSV(filepath),
+                    loadParents(tree) if tree is not None else None
+                )
+                self._remember(report_id, loaded)
+        finally:
+            with self._lock:
+                self._loading.pop(report_id, None)
+
+        return loaded
+
+
+# Registry shared by every report page
+reports = ReportRegistry()
@@ -0,0 +1,605 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+# Partitions of Galileo100 the jobs are sized for, from the smallest
+# nodes, as (cores, usable memory in bytes, longest walltime in seconds)
+PARTITIONS = {
+    'g100_usr_prod': (48, 375 * GB, 24 * 3600),
+    'g100_usr_bmem': (48, 3000 * GB, 24 * 3600)
+}
+
+# Resources of the jobs whose inputs are unknown: a whole bigmem node
+# for a day
+FALLBACK_RESOURCES = {
+    'cores': 48,
+    'memory': 500 * GB,
+    'seconds': 24 * 3600,
+    'partition': 'g100_usr_bmem'
+}
+
+# Factor applied to the estimated memory and walltime
+DEFAULT_SAFETY_MARGIN = 1.5
+
+# Smallest memory and walltime requested
+MIN_MEMORY = 4 * GB
+MIN_WALLTIME = 15 * 60
+
+# File of the resources used by the past jobs
+DEFAULT_RESOURCE_HISTORY = 'download/.resources/history.json'
+
+# Past jobs of each stage used to calibrate the estimates
+HISTORY_RECORDS = 20
+
+# Bounds of the calibration of the estimates by the past jobs
+MIN_CORRECTION = 0.5
+MAX_CORRECTION = 8
+
+# Past jobs calibrate the estimates of the jobs up to this many times
+# larger than them
+HISTORY_SCALE_RANGE = 10
+
+# Bytes read from the head of the reads to estimate their number
+READS_SAMPLE_BYTES = 1 * MB
+
+# Bytes of a FASTQ record when the sample holds none
+DEFAULT_RECORD_BYTES = 360
+
+# Reads classified by Centrifuge in a second by a core, and seconds of
+# classification the cores of a job are sized for
+CENTRIFUGE_READS_PER_CORE_SECOND = 3000
+CENTRIFUGE_TARGET_SECONDS = 3600
+
+# Centrifuge loads the whole index in memory
+CENTRIFUGE_INDEX_MEMORY_FACTOR = 1.2
+CENTRIFUGE_BASE_MEMORY = 2 * GB
+INDEX_LOAD_BYTES_PER_SECOND = 200 * MB
+
+# centrifuge-build needs some times the size of the libraries in memory
+BUILD_MEMORY_FACTOR = 3
+BUILD_BYTES_PER_CORE_SECOND = 200 * KB
+
+# Cores given to the programs which do not scale
+MIN_CORES = 4
+
+# Reads classified by each task of a sharded Centrifuge job, and largest
+# number of tasks
+DEFAULT_SHARD_READS = 50000000
+DEFAULT_MAX_SHARDS = 16
+
+# Bytes of reads split in shards, and of Centrifuge output merged, in a
+# second
+SPLIT_BYTES_PER_SECOND = 100 * MB
+MERGE_BYTES_PER_SECOND = 100 * MB
+
+# Bytes of the Centrifuge output per read, with the secondary hits
+OUTPUT_BYTES_PER_READ = 150
+
+# Recentrifuge keeps the parsed output and the taxonomy in memory
+RECENTRIFUGE_CORES = 2
+RECENTRIFUGE_MEMORY_FACTOR = 4
+RECENTRIFUGE_BASE_MEMORY = 4 * GB
+RECENTRIFUGE_BYTES_PER_SECOND = 5 * MB
+
+# Rextract streams the reads, keeping the IDs of the matched reads
+REXTRACT_CORES = 1
+REXTRACT_MEMORY_FACTOR = 2
+REXTRACT_BASE_MEMORY = 4 * GB
+REXTRACT_BYTES_PER_SECOND = 20 * MB
+
+# Units of the memory sizes of Slurm
+MEMORY_UNITS = {'': 1, 'K': KB, 'M': MB, 'G': GB, 'T': 1024 * GB}
+
+
+def parseMemory(value) -> int:
+    """Convert a memory size to bytes.
+
+    :param value: Bytes, or a string in the format of Slurm like '500G'
+    (megabytes without unit).
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)B?\s*', value.upper())
+    if match is None:
+        raise ValueError(f"Invalid memory size: {value}")
+    number, unit = match.groups()
+
+    return int(float(number) * MEMORY_UNITS[unit or 'M'])
+
+
+def formatMemory(memory: int) -> str:
+    """Format a memory size for sbatch, rounded up to the megabyte or to
+    the gigabyte.
+
+    :param memory: The size in bytes.
+    """
+    if memory >= 10 * GB:
+        return f'{math.ceil(memory / GB)}G'
+
+    return f'{math.ceil(memory / MB)}M'
+
+
+def parseWalltime(value) -> int:
+    """Convert a walltime to seconds.
+
+    :param value: Seconds, or a string like 'HH:MM:SS' or 'D-HH:MM:SS'.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = re.fullmatch(r'\s*(?:(\d+)-)?(\d+):(\d+):(\d+)\s*', value)
+    if match is None:
+        raise ValueError(f"Invalid walltime: {value}")
+    days, hours, minutes, seconds = (
+        int(field or 0) for field in match.groups()
+    )
+
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def formatWalltime(seconds: int) -> str:
+    """Format a walltime for sbatch, rounded up to the minute.
+
+    :param seconds: The walltime in seconds.
+    """
+    minutes = math.ceil(seconds / 60)
+
+    return f'{minutes // 60:02d}:{minutes % 60:02d}:00'
+
+
+def sampleReads(head: bytes, size: int) -> dict:
+    """Estimate the number of reads of a FASTQ file, plain or gzipped,
+    and its uncompressed size from the head of the file.
+
+    :param head: The first bytes of the file.
+    :param size: The size of the file in bytes.
+    """
+    raw = head
+    consumed = len(head)
+
+    # Decompress the head, made of one or more gzip members
+    if head[:2] == b'\x1f\x8b':
+        pieces = []
+        data = head
+        while data[:2] == b'\x1f\x8b':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                pieces.append(decompressor.decompress(data))
+            except zlib.error:
+                break
+            data = decompressor.unused_data
+        raw = b''.join(pieces)
+        consumed = len(head) - len(data)
+
+    raw_bytes = size * len(raw) // consumed if consumed else size
+
+    # Size of the complete records of the head
+    records = raw.count(b'\n') // 4
+    if records:
+        lines = raw.split(b'\n')[:records * 4]
+        record_bytes = (sum(map(len, lines)) + len(lines)) / records
+    else:
+        record_bytes = DEFAULT_RECORD_BYTES
+
+    return {
+        'bytes': size,
+        'raw_bytes': raw_bytes,
+        'reads': int(raw_bytes / record_bytes)
+    }
+
+
+async def remoteSize(conn, paths: list) -> int:
+    """Get the total size in bytes of some files or directories on the
+    cluster, the missing ones counting as empty.
+
+    :param conn: The SSH connection to use.
+    :param paths: The absolute paths of the files or directories.
+    """
+    result = await conn.run(
+        f'du -scbL {" ".join(paths)} 2> /dev/null | tail -n 1 | cut -f 1'
+    )
+
+    try:
+        return int(result.stdout.strip())
+    except ValueError:
+        return 0
+
+
+def _centrifugeModel(metrics: dict) -> tuple:
+    """Estimate the cores, memory and seconds of a Centrifuge job.
+
+    :param metrics: The reads, index_bytes and library_bytes, the
+    latter only if the index must be built.
+    """
+    node_cores = PARTITIONS['g100_usr_prod'][0]
+    reads = metrics.get('reads', 0)
+    index_bytes = metrics.get('index_bytes', 0)
+    library_bytes = metrics.get('library_bytes', 0)
+
+    cores = math.ceil(
+        reads / CENTRIFUGE_READS_PER_CORE_SECOND / CENTRIFUGE_TARGET_SECONDS
+    )
+    memory = CENTRIFUGE_BASE_MEMORY + (
+        CENTRIFUGE_INDEX_MEMORY_FACTOR * max(index_bytes, library_bytes)
+    )
+    seconds = max(index_bytes, library_bytes) / INDEX_LOAD_BYTES_PER_SECOND
+
+    # The index is built on the whole node
+    if library_bytes:
+        cores, build_memory, build_seconds = _buildModel(library_bytes)
+        memory = max(memory, build_memory)
+        seconds += build_seconds
+
+    cores = min(max(cores, MIN_CORES), node_cores)
+    seconds += reads / CENTRIFUGE_READS_PER_CORE_SECOND / cores
+
+    return cores, memory, seconds
+
+
+def _buildModel(library_bytes: int) -> tuple:
+    """Estimate the cores, memory and seconds of the build of an index,
+    on the whole node.
+
+    :param library_bytes: The size of the libraries of the index.
+    """
+    cores = PARTITIONS['g100_usr_prod'][0]
+
+    return (
+        cores,
+        BUILD_MEMORY_FACTOR * library_bytes,
+        library_bytes / BUILD_BYTES_PER_CORE_SECOND / cores
+    )
+
+
+def _scatterModel(metrics: dict) -> tuple:
+    """Estimate the cores, memory and seconds of the job splitting the
+    reads in shards, after building the index if needed.
+
+    :param metrics: The raw_bytes of the reads and library_bytes, the
+    latter only if the index must be built.
+    """
+    cores, memory, seconds = 2, 0, 0
+    if metrics.get('library_bytes'):
+        cores, memory, seconds = _buildModel(metrics['library_bytes'])
+
+    return (
+        cores,
+        memory,
+        seconds + metrics.get('raw_bytes', 0) / SPLIT_BYTES_PER_SECOND
+    )
+
+
+def _gatherModel(metrics: dict) -> tuple:
+    """Estimate the cores, memory and seconds of the job merging the
+    results of the shards.
+
+    :param metrics: The reads and output_bytes.
+    """
+    return 1, 0, _outputBytes(metrics) / MERGE_BYTES_PER_SECOND
+
+
+def _outputBytes(metrics: dict) -> int:
+    """Get the size of the Centrifuge output, estimated from the reads
+    if it was not written yet.
+
+    :param metrics: The reads and output_bytes.
+    """
+    return metrics.get('output_bytes') or (
+        OUTPUT_BYTES_PER_READ * metrics.get('reads', 0)
+    )
+
+
+def _recentrifugeModel(metrics: dict) -> tuple:
+    """Estimate the cores, memory and seconds of a Recentrifuge job.
+
+    :param metrics: The reads and output_bytes.
+    """
+    output = _outputBytes(metrics)
+
+    return (
+        RECENTRIFUGE_CORES,
+        RECENTRIFUGE_BASE_MEMORY + RECENTRIFUGE_MEMORY_FACTOR * output,
+        output / RECENTRIFUGE_BYTES_PER_SECOND
+    )
+
+
+def _rextractModel(metrics: dict) -> tuple:
+    """Estimate the cores, memory and seconds of a Rextract job.
+
+    :param metrics: The reads, raw_bytes and output_bytes.
+    """
+    output = _outputBytes(metrics)
+
+    return (
+        REXTRACT_CORES,
+        REXTRACT_BASE_MEMORY + REXTRACT_MEMORY_FACTOR * output,
+        (metrics.get('raw_bytes', 0) + output) / REXTRACT_BYTES_PER_SECOND
+    )
+
+
+# Functions estimating the resources of the job of each stage, and of
+# the jobs before and after the shards of Centrifuge
+STAGE_MODELS = {
+    'centrifuge': _centrifugeModel,
+    'centrifuge_scatter': _scatterModel,
+    'centrifuge_gather': _gatherModel,
+    'recentrifuge': _recentrifugeModel,
+    'rextract': _rextractModel
+}
+
+
+class ResourceEstimate:
+    """Resources requested for the job of a stage.
+
+    :param stage: The name of the stage.
+    :param cores: Cores of the job.
+    :param memory: Memory of the job in bytes.
+    :param seconds: Walltime of the job.
+    :param partition: Partition of the job.
+    :param metrics: The inputs of the estimate, None if unknown.
+    :param model: Memory and seconds estimated by the model of the
+    stage before the calibration and the safety margin.
+    :param tasks: Tasks of the job array, each one with these resources.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        cores: int,
+        memory: int,
+        seconds: int,
+        partition: str,
+        metrics: dict = None,
+        model: dict = None,
+        tasks: int = 1
+    ):
+        self.stage = stage
+        self.cores = cores
+        self.memory = memory
+        self.seconds = seconds
+        self.partition = partition
+        self.metrics = metrics
+        self.model = model
+        self.tasks = tasks
+
+        # ID of the job given these resources, once submitted, when it is
+        # not the job waited for
+        self.job_id = None
+
+    def status(self) -> dict:
+        """Get the JSON serializable resources, as given to sbatch.
+        """
+        status = {
+            'cores': self.cores,
+            'memory': formatMemory(self.memory),
+            'walltime': formatWalltime(self.seconds),
+            'partition': self.partition
+        }
+        if self.tasks > 1:
+            status['tasks'] = self.tasks
+
+        return status
+
+
+class ResourceEstimator:
+    """Estimator of the cores, memory and walltime of the jobs of the
+    stages from the size of their inputs.
+
+    Every stage has a model of its resources, calibrated by the memory
+    and walltime used by the past jobs of the stage with respect to the
+    model, then increased by a safety margin. The partition is the one
+    of the smallest nodes holding the memory. Any resource of a stage
+    can be fixed by the overrides.
+
+    :param history_file: File of the resources used by the past jobs.
+    :param overrides: Dictionary of the resources fixed for each stage,
+    any of cores, memory ('500G'), walltime ('24:00:00') and partition.
+    :param margin: Factor applied to the estimated memory and walltime.
+    :param shard_reads: Reads classified by each task of a sharded
+    Centrifuge job, None to never shard.
+    :param max_shards: Largest number of tasks of a sharded Centrifuge
+    job.
+    """
+
+    def __init__(
+        self,
+        history_file: str = DEFAULT_RESOURCE_HISTORY,
+        overrides: dict = None,
+        margin: float = DEFAULT_SAFETY_MARGIN,
+        shard_reads: int = DEFAULT_SHARD_READS,
+        max_shards: int = DEFAULT_MAX_SHARDS
+    ):
+        self.history_file = history_file
+        self.overrides = overrides or {}
+        self.margin = margin
+        self.shard_reads = shard_reads
+        self.max_shards = max_shards
+        self._history = None
+        self._lock = threading.Lock()
+
+    def configure(self, **options):
+        """Update the settings of the estimator.
+
+        :param options: Any of history_file, overrides, margin,
+        shard_reads and max_shards.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown resource estimator option: {name}")
+            if name == 'overrides':
+                for stage, resources in (value or {}).items():
+                    unknown = set(resources) - {
+                        'cores', 'memory', 'walltime', 'partition'
+                    }
+                    if stage not in STAGE_MODELS or unknown:
+                        raise ValueError(
+                            f"Invalid resource overrides of {stage}"
+                        )
+                value = value or {}
+            setattr(self, name, value)
+            if name == 'history_file':
+                self._history = None
+
+    def _load(self) -> dict:
+        """Get the records of the past jobs of every stage, read from the
+        history file on first use.
+        """
+        if self._history is None:
+            try:
+                with open(self.history_file, 'r') as file:
+                    self._history = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError, OSError):
+                self._history = {}
+
+        return self._history
+
+    def shards(self, reads: int) -> int:
+        """Get the number of shards the reads are classified in, 1 if
+        they are classified by a single job.
+
+        :param reads: The number of reads.
+        """
+        if not self.shard_reads:
+            return 1
+
+        shards = math.ceil(reads / self.shard_reads)
+
+        return max(1, min(shards, self.max_shards))
+
+    def correction(self, stage: str, model: dict) -> tuple:
+        """Get the factors calibrating the memory and the seconds of the
+        model of a stage, the largest ratio between the resources used by
+        the past jobs of a similar size and their model.
+
+        :param stage: The name of the stage.
+        :param model: The memory and seconds estimated by the model.
+        """
+        with self._lock:
+            records = list(self._load().get(stage, []))
+
+        factors = []
+        for resource in ('memory', 'seconds'):
+            ratios = [
+                record['used'][resource] / record['model'][resource]
+                for record in records
+                if record['model'][resource] > 0
+                and record['model'][resource] * HISTORY_SCALE_RANGE
+                >= model[resource]
+            ]
+            factor = max(ratios, default=1)
+            factors.append(min(max(factor, MIN_CORRECTION), MAX_CORRECTION))
+
+        return tuple(factors)
+
+    def estimate(self, stage: str, metrics: dict = None) -> ResourceEstimate:
+        """Estimate the resources of the job of a stage.
+
+        :param stage: The name of the stage.
+        :param metrics: The size of the inputs of the stage: any of reads,
+        bytes and raw_bytes of the reads, index_bytes, library_bytes and
+        output_bytes. The job gets FALLBACK_RESOURCES if None.
+        """
+        if metrics is None:
+            resources = dict(FALLBACK_RESOURCES)
+            model = None
+        else:
+            cores, memory, seconds = STAGE_MODELS[stage](metrics)
+            model = {'memory': memory, 'seconds': seconds}
+            memory_factor, seconds_factor = self.correction(stage, model)
+            resources = {
+                'cores': cores,
+                'memory': max(
+                    memory * memory_factor * self.margin,
+                    MIN_MEMORY
+                ),
+                'seconds': max(
+                    seconds * seconds_factor * self.margin,
+                    MIN_WALLTIME
+                ),
+                'partition': None
+            }
+
+        # Fixed resources of the stage
+        overrides = self.overrides.get(stage, {})
+        for name, value in overrides.items():
+            if name == 'memory':
+                value = parseMemory(value)
+            if name == 'walltime':
+                name, value = 'seconds', parseWalltime(value)
+            resources[name] = value
+
+        # Smallest nodes holding the memory, the largest ones otherwise
+        if resources['partition'] is None:
+            resources['partition'] = next(
+                (
+                    partition
+                    for partition, (_, memory, _) in PARTITIONS.items()
+                    if resources['memory'] <= memory
+                ),
+                list(PARTITIONS)[-1]
+            )
+
+        # Bound the estimates to the nodes of the partition
+        if resources['partition'] in PARTITIONS:
+            cores, memory, seconds = PARTITIONS[resources['partition']]
+            for name, limit in (
+                ('cores', cores),
+                ('memory', memory),
+                ('seconds', seconds)
+            ):
+                if name not in overrides and resources[name] > limit:
+                    resources[name] = limit
+
+        return ResourceEstimate(
+            stage,
+            int(resources['cores']),
+            int(resources['memory']),
+            int(resources['seconds']),
+            resources['partition'],
+            metrics,
+            model
+        )
+
+    def record(self, estimate: ResourceEstimate, usage: dict):
+        """Record the resources used by the job of an estimate, to
+        calibrate the next estimates of its stage.
+
+        :param estimate: The estimate of the job.
+        :param usage: The memory in bytes and the seconds used by the job.
+        """
+        if estimate.model is None:
+            return
+
+        with self._lock:
+            history = self._load()
+            records = history.setdefault(estimate.stage, [])
+            records.append({
+                'time': time.time(),
+                'metrics': estimate.metrics,
+                'model': estimate.model,
+                'used': {
+                    'memory': usage['memory'],
+                    'seconds': usage['seconds']
+                }
+            })
+            del records[:-HISTORY_RECORDS]
+
+            directory = os.path.dirname(self.history_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.history_file, 'w') as file:
+                json.dump(history, file)
+
+
+# Estimator shared by every run
+estimator = ResourceEstimator()
@@ -0,0 +1,377 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import threading
+import time
+import traceback
+import uuid
+
+from pyscripts.connection import pool
+from pyscripts.job_monitor import monitor
+from pyscripts.progress import bus, current_channel
+
+
+# Number of stages executed at the same time, across all the runs
+DEFAULT_MAX_CONCURRENT_STAGES = 4
+
+# Seconds a finished run is kept after its last change
+DEFAULT_RUN_TTL = 24 * 3600  # 1 day
+
+# States of a run and of its stages
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# Slot of the stage being executed, set by the run manager
+current_slot = contextvars.ContextVar('current_slot', default=None)
+
+
+class Run:
+    """A submission of reads to analyze on the cluster.
+
+    Every change of the status is published on the progress bus, in the
+    channel named after the ID of the run.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param account: The account charged for the jobs.
+    :param inputs: Array of strings containing the paths of the
+    reads files.
+    :param domains: Array of strings containing the names of the
+    biological domains.
+    :param pipeline: Submit all the stages at once.
+    :param objects: Array of strings containing the paths of the reads
+    already stored on the cluster, in the same order of inputs.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        account: str,
+        inputs: list,
+        domains: list,
+        pipeline: bool = False,
+        objects: list = None
+    ):
+        self.id = uuid.uuid4().hex[:12]
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.account = account
+        self.inputs = inputs
+        self.domains = domains
+        self.pipeline = pipeline
+        self.objects = objects
+        self.reads = None
+        self.reads_size = None
+        self.snapshot = None
+        self.backend = None
+        self.resources = {}
+
+        self.state = QUEUED
+        self.stage = None
+        self.stages = {}
+        self.timings = {}
+        self.progress = {'state': 'Queued', 'value': 0}
+        self.jobs = {}
+        self.results = {}
+        self.charts = None
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+
+    def credentials(self) -> tuple:
+        """Get the hostname, username and password of the run.
+        """
+        if self.password is None:
+            raise ValueError(f"The credentials of run {self.id} were dropped")
+
+        return self.hostname, self.username, self.password
+
+    def dropCredentials(self):
+        """Forget the password of the run, once no stage needs it.
+        """
+        self.password = None
+
+    def finished(self) -> bool:
+        """Check if no stage of the run is queued or running.
+        """
+        return all(
+            state not in (QUEUED, RUNNING) for state in self.stages.values()
+        )
+
+    def setProgress(self, state: str, value: int):
+        """Update the progress of the current stage.
+
+        :param state: Description of the current step.
+        :param value: Percentage of the stage completed.
+        """
+        self.progress = {'state': state, 'value': value}
+        self.changed()
+
+    def setStage(self, stage: str, state: str):
+        """Update the state of a stage and record when it changed.
+
+        :param stage: The name of the stage.
+        :param state: The new state of the stage.
+        """
+        self.stages[stage] = state
+        self.timings.setdefault(stage, {})[state] = time.time()
+        self.changed()
+
+    def changed(self):
+        """Publish the status of the run on the progress bus.
+        """
+        self.updated = time.time()
+        bus.publish(self.id, 'progress', self.status())
+
+    def status(self) -> dict:
+        """Get the JSON serializable status of the run, without the
+        credentials.
+        """
+        return {
+            'id': self.id,
+            'state': self.state,
+            'stage': self.stage,
+            'stages': dict(self.stages),
+            'timings': {
+                stage: dict(timing) for stage, timing in self.timings.items()
+            },
+            'progress': dict(self.progress),
+            'jobs': dict(self.jobs),
+            'backend': self.backend,
+            'resources': {
+                stage: resources.status()
+                for stage, resources in self.resources.items()
+            },
+            'error': self.error,
+            'created': self.created
+        }
+
+
+class RunManager:
+    """Executor of the stages of the runs in the background.
+
+    The stages are coroutines executed on an event loop owned by the
+    manager, so the SSH connections and the job monitor are shared by
+    all the runs. At most max_concurrent stages are executed at the
+    same time, the others wait in a queue. A stage gives back its slot
+    while it only waits for a job (see released()), so the slots bound
+    the SSH commands and the transfers, not the time spent in the queue
+    of the cluster.
+
+    The password of a run is dropped once all its stages completed, and
+    the finished runs are forgotten run_ttl seconds after their last
+    change. The pooled connection and the job poller of a user are
+    closed with the last password of the user held by a run.
+
+    :param max_concurrent: Number of stages executed at the same time.
+    :param stages: Names of the stages of a run.
+    :param run_ttl: Seconds a finished run is kept.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT_STAGES,
+        stages: tuple = (),
+        run_ttl: float = DEFAULT_RUN_TTL
+    ):
+        self.max_concurrent = max_concurrent
+        self.stages = stages
+        self.run_ttl = run_ttl
+        self.runs = {}
+        self.relays = set()
+        self._loop = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def configure(self, **options):
+        """Update the settings of the manager, max_concurrent before the
+        first stage starts.
+
+        :param options: Any of max_concurrent, stages and run_ttl.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown run manager option: {name}")
+            setattr(self, name, value)
+
+    def _eventLoop(self) -> asyncio.AbstractEventLoop:
+        """Get the event loop of the manager, starting it if needed.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name='run-manager',
+                    daemon=True
+                ).start()
+
+        return self._loop
+
+    def runCoroutine(self, coroutine) -> concurrent.futures.Future:
+        """Schedule a coroutine on the event loop of the manager, from
+        another thread.
+
+        :param coroutine: The coroutine to execute.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._eventLoop())
+
+    def create(self, *args, **kwargs) -> Run:
+        """Register a new run, see Run for the arguments.
+        """
+        self.expire()
+        run = Run(*args, **kwargs)
+        self.runs[run.id] = run
+
+        return run
+
+    def expire(self):
+        """Forget the finished runs not changed for run_ttl seconds, and
+        the last events of their channels.
+        """
+        deadline = time.time() - self.run_ttl
+        users = set()
+
+        with self._lock:
+            for run in list(self.runs.values()):
+                if run.updated < deadline and run.finished():
+                    del self.runs[run.id]
+                    bus.close(run.id)
+
+                    # A failed run keeps its password for the retries
+                    if run.password is not None:
+                        run.dropCredentials()
+                        users.add((run.hostname, run.username))
+
+        for hostname, username in users:
+            self.runCoroutine(self._disconnect(hostname, username))
+
+    async def _disconnect(self, hostname: str, username: str):
+        """Close the connection and the job poller of a user, unless a
+        run or a relay of reads still holds a password of the user.
+
+        :param hostname: A string which is the host name to connect.
+        :param username: A string which is the username of the account
+        to connect in the host machine.
+        """
+        if any(
+            run.hostname == hostname
+            and run.username == username
+            and run.password is not None
+            for run in list(self.runs.values()) + list(self.relays)
+        ):
+            return
+
+        monitor.forget(hostname, username)
+        await pool.close(hostname, username)
+
+    def get(self, run_id: str) -> Run:
+        """Get a run by its ID, None if it does not exist.
+
+        :param run_id: The ID of the run.
+        """
+        return self.runs.get(run_id)
+
+    def start(self, run: Run, stage: str, function):
+        """Queue the execution of a stage of a run, unless the stage is
+        already queued, running or completed.
+
+        :param run: The run.
+        :param stage: The name of the stage.
+        :param function: Coroutine function executing the stage, called
+        with the run.
+        """
+        with self._lock:
+            if run.stages.get(stage) in (QUEUED, RUNNING, COMPLETED):
+                return
+            run.setStage(stage, QUEUED)
+
+        self.runCoroutine(self._execute(run, stage, function))
+
+    @contextlib.asynccontextmanager
+    async def released(self):
+        """Give back the slot of the stage being executed while the body
+        is executed, and wait for a free slot again once it ends.
+
+        Nothing is released out of a stage, and concurrent bodies of the
+        same stage release its slot once.
+        """
+        slot = current_slot.get()
+        if slot is None:
+            yield
+            return
+
+        slot['waiting'] += 1
+        if slot['waiting'] == 1:
+            self._slots.release()
+
+        try:
+            yield
+        finally:
+            slot['waiting'] -= 1
+            if slot['waiting'] == 0:
+                await self._slots.acquire()
+
+    async def _execute(self, run: Run, stage: str, function):
+        """Execute a stage of a run when a slot is free.
+
+        :param run: The run.
+        :param stage: The name of the stage.
+        :param function: Coroutine function executing the stage.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+
+        # Progress events of the stage are published in the run channel
+        current_channel.set(run.id)
+
+        async with self._slots:
+            current_slot.set({'waiting': 0})
+            run.state = RUNNING
+            run.stage = stage
+            run.error = None
+            run.setStage(stage, RUNNING)
+            started = time.monotonic()
+
+            try:
+                await function(run)
+            except Exception as e:
+                traceback.print_exc()
+                run.state = FAILED
+                run.error = f'{stage}: {e}'
+                run.setStage(stage, FAILED)
+                return
+
+            print(
+                f"Run {run.id}: {stage} completed in "
+                f"{time.monotonic() - started:.0f} s"
+            )
+
+            # The run is completed when no other stage is pending
+            if all(
+                state == COMPLETED or name == stage
+                for name, state in run.stages.items()
+            ):
+                run.state = COMPLETED
+
+            # No stage left to run needs the password
+            if self.stages and all(
+                run.stages.get(name) == COMPLETED or name == stage
+                for name in self.stages
+            ):
+                run.dropCredentials()
+                await self._disconnect(run.hostname, run.username)
+            run.setStage(stage, COMPLETED)
+
+
+# Manager shared by every request of the application
+manager = RunManager()
@@ -0,0 +1,117 @@
+import os
+
+from pyscripts.taxonomy_report import treeCommand
+
+
+# Directory of the working directory holding the shards of the reads and
+# the results of their classification
+SHARDS_DIR = 'shards'
+
+
+def shardReads(inputs: list, task: str) -> list:
+    """Get the names of the reads files of a shard, in the order of the
+    inputs.
+
+    :param inputs: Array of strings containing the names of the reads
+    files.
+    :param task: The index of the shard, or an expression of it in the
+    script.
+    """
+    if len(inputs) == 1:
+        return [f'{SHARDS_DIR}/{task}.fastq']
+
+    return [
+        f'{SHARDS_DIR}/{task}_{mate}.fastq'
+        for mate in range(1, len(inputs) + 1)
+    ]
+
+
+def splitCommands(inputs: list, shards: int) -> str:
+    """Build the script lines splitting the reads in shards.
+
+    The record n of every file goes to the shard n % shards, so the
+    shards have the same number of reads and the mates of a pair end up
+    in the same shard at the same position. The files are split at the
+    same time, plain or gzipped.
+
+    :param inputs: Array of strings containing the names of the reads
+    files.
+    :param shards: The number of shards.
+    """
+    lines = f'rm -rf {SHARDS_DIR} && mkdir -p {SHARDS_DIR}\nPIDS=\n'
+
+    for input, shard in zip(inputs, shardReads(inputs, '" SHARD "')):
+        lines += (
+            f'(set -o pipefail; gzip -cdf {os.path.basename(input)} '
+            f'| awk -v shards={shards} '
+            f"'{{ SHARD = int((NR - 1) / 4) % shards; "
+            f'print > ("{shard}") }}\') & PIDS="$PIDS $!"\n'
+        )
+
+    return lines + 'for PID in $PIDS; do wait $PID || exit 1; done\n'
+
+
+def classifyCommand(index: str, inputs: list, threads: int) -> str:
+    """Build the script line classifying the shard of a task of the job
+    array.
+
+    :param index: Path of the index in the working directory.
+    :param inputs: Array of strings containing the names of the reads
+    files.
+    :param threads: Number of threads of Centrifuge.
+    """
+    task = '${SLURM_ARRAY_TASK_ID}'
+    reads = shardReads(inputs, task)
+    if len(reads) == 1:
+        options = f'-U {reads[0]}'
+    else:
+        options = f'-1 {reads[0]} -2 {reads[1]}'
+
+    return (
+        f'centrifuge -x {index} {options} '
+        f'-S {SHARDS_DIR}/output_{task}.txt '
+        f'--report-file {SHARDS_DIR}/report_{task}.tsv -p {threads}\n'
+    )
+
+
+def mergeCommands(shards: int) -> str:
+    """Build the script lines merging the results of the shards in the
+    files written by an unsharded Centrifuge job, then extracting the
+    taxonomy tree of the merged report.
+
+    The outputs are concatenated. In the reports the reads and the unique
+    reads of each taxon are summed, and the abundances averaged: Centrifuge
+    estimates them on each shard, and the shards hold the same number of
+    reads, so this is their read-weighted mean. It approximates the
+    abundance estimated on all the reads at once.
+
+    :param shards: The number of shards.
+    """
+    tasks = ' '.join(str(task) for task in range(shards))
+    reports = ' '.join(
+        f'{SHARDS_DIR}/report_{task}.tsv' for task in range(shards)
+    )
+
+    return (
+        # 1. Check that every shard was classified
+        f'for TASK in {tasks}; do\n'
+        f'    [ -f {SHARDS_DIR}/output_$TASK.txt ] '
+        f'&& [ -f {SHARDS_DIR}/report_$TASK.tsv ] || exit 1\n'
+        'done\n'
+        # 2. Concatenate the outputs, with the header of the first one
+        f'{{ head -n 1 {SHARDS_DIR}/output_0.txt; for TASK in {tasks}; do '
+        f'tail -n +2 {SHARDS_DIR}/output_$TASK.txt; done; }} '
+        '> reports/centrifuge_output.txt || exit 1\n'
+        # 3. Merge the reports, keeping the taxa in order of appearance
+        f"awk -F '\\t' -v OFS='\\t' -v shards={shards} "
+        "'FNR == 1 { if (NR == 1) print; next } "
+        "!($2 in reads) { order[++taxa] = $2; "
+        "taxon[$2] = $1 OFS $2 OFS $3 OFS $4 } "
+        "{ reads[$2] += $5; unique[$2] += $6; abundance[$2] += $7 } "
+        "END { for (i = 1; i <= taxa; i++) { id = order[i]; "
+        "print taxon[id], reads[id], unique[id], abundance[id] / shards } }' "
+        f'{reports} > centrifuge_report.tsv || exit 1\n'
+        # 4. Extract the taxonomy tree of the taxa in the merged report
+        + treeCommand()
+        + f'rm -rf {SHARDS_DIR}\n'
+    )
@@ -0,0 +1,410 @@
+import json
+import os
+
+import numpy as np
+
+
+# Taxonomic ranks of the hierarchy, from the root to the leaves. Their
+# position is the code of the rank in TaxonomyReport.rank
+RANKS = (
+    'superkingdom',
+    'phylum',
+    'class',
+    'order',
+    'family',
+    'genus',
+    'species',
+    'leaf'
+)
+
+# Depth of the ranks in the hierarchy, the ranks missing here (for
+# example 'no rank' and 'clade') are unranked
+RANK_LEVELS = {
+    'superkingdom': 0,
+    'kingdom': 5,
+    'phylum': 10,
+    'subphylum': 15,
+    'class': 20,
+    'subclass': 25,
+    'order': 30,
+    'suborder': 35,
+    'family': 40,
+    'subfamily': 45,
+    'tribe': 47,
+    'genus': 50,
+    'subgenus': 55,
+    'species group': 57,
+    'species subgroup': 58,
+    'species': 60,
+    'subspecies': 70,
+    'strain': 75,
+    'leaf': 80
+}
+
+# Level of the unranked taxa
+UNRANKED = -1
+
+# Parents of the taxa of a report, written next to it on the cluster
+TREE_FILE = 'taxonomy_parents.tsv'
+
+# Columns of the Centrifuge report
+REPORT_COLUMNS = (
+    'name',
+    'taxID',
+    'taxRank',
+    'genomeSize',
+    'numReads',
+    'numUniqueReads',
+    'abundance'
+)
+
+# Columns of TaxonomyReport saved as .npy files, loaded memory-mapped
+SAVED_COLUMNS = (
+    'tax_id',
+    'rank',
+    'genome_size',
+    'num_reads',
+    'num_unique_reads',
+    'abundance'
+)
+
+
+def loadParents(filepath: str) -> dict:
+    """Load the parent of each taxID from a NCBI nodes.dmp file or from
+    a tab separated file of taxID, parent taxID and rank.
+
+    :param filepath: Path of the file.
+    """
+    parents = {}
+
+    with open(filepath, 'r') as file:
+        for line in file:
+            fields = line.replace('\t|', '').split('\t')
+            if len(fields) < 2 or not fields[0].strip().isdigit():
+                continue
+            parents[int(fields[0])] = int(fields[1])
+
+    return parents
+
+
+def treeCommand(report: str = 'centrifuge_report.tsv') -> str:
+    """Build the command writing in TREE_FILE the taxID, parent taxID and
+    rank of the taxa of a report and of their ancestors, from the
+    nodes.dmp of the taxonomy linked in the working directory.
+
+    A failure removes the file instead of failing the job, the report
+    is then shown without the taxonomy tree.
+
+    :param report: Path of the report in the working directory.
+    """
+    return (
+        "awk -F '\\t' 'NR == FNR { if (FNR > 1) want[$2] = 1; next } "
+        "{ parent[$1] = $3; rank[$1] = $5 } "
+        "END { for (taxon in want) { node = taxon; "
+        "while (node in parent && !(node in seen)) { seen[node] = 1; "
+        "print node \"\\t\" parent[node] \"\\t\" rank[node]; "
+        "node = parent[node] } } }' "
+        f"{report} taxonomy/nodes.dmp > {TREE_FILE} || rm -f {TREE_FILE}\n"
+    )
+
+
+def treeFile(filepath: str) -> str:
+    """Get the path of the parents file of a report, None if the report
+    has none.
+
+    :param filepath: Path of the report.
+    """
+    tree = os.path.join(os.path.dirname(filepath), TREE_FILE)
+
+    return tree if os.path.exists(tree) else None
+
+
+class TaxonomyReport:
+    """Centrifuge report stored as typed columns, one row per taxon.
+
+    The rank is stored as a categorical code: the ranks of RANKS have
+    their position as code, the other ranks found in the report follow
+    in alphabetical order. Rows are keyed by taxID, two taxa with the
+    same name are both kept.
+
+    :param name: Array of the names of the taxa.
+    :param tax_id: Array of the taxIDs.
+    :param rank: Array of the codes of the ranks.
+    :param rank_names: Names of the ranks, indexed by code.
+    :param genome_size: Array of the genome sizes.
+    :param num_reads: Array of the numbers of reads.
+    :param num_unique_reads: Array of the numbers of unique reads.
+    :param abundance: Array of the abundances.
+    """
+
+    def __init__(
+        self,
+        name: np.ndarray,
+        tax_id: np.ndarray,
+        rank: np.ndarray,
+        rank_names: tuple,
+        genome_size: np.ndarray,
+        num_reads: np.ndarray,
+        num_unique_reads: np.ndarray,
+        abundance: np.ndarray
+    ):
+        self.name = name
+        self.tax_id = tax_id
+        self.rank = rank
+        self.rank_names = rank_names
+        self.genome_size = genome_size
+        self.num_reads = num_reads
+        self.num_unique_reads = num_unique_reads
+        self.abundance = abundance
+        self._index = None
+
+    @classmethod
+    def fromTSV(cls, filepath: str) -> 'TaxonomyReport':
+        """Parse a centrifuge_report.tsv file.
+
+        The file is split at once and every column is converted by
+        NumPy, without building a Python object per row.
+
+        :param filepath: Path of the report.
+        """
+        with open(filepath, 'r') as file:
+            header = file.readline().rstrip('\r\n').split('\t')
+            rows = file.read().splitlines()
+
+        missing = [column for column in REPORT_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"Missing columns in the report: {missing}")
+
+        rows = [row for row in rows if row]
+        width = len(header)
+        # A report without taxa has empty columns
+        fields = '\t'.join(rows).split('\t') if rows else []
+        if len(fields) != len(rows) * width:
+            raise ValueError(
+                f"The rows of the report must have {width} columns"
+            )
+
+        def column(name):
+            return fields[header.index(name)::width]
+
+        # Categorical codes of the ranks
+        ranks = column('taxRank')
+        rank_names = RANKS + tuple(sorted(set(ranks) - set(RANKS)))
+        codes = {rank: code for code, rank in enumerate(rank_names)}
+
+        return cls(
+            name=np.array(column('name'), dtype=object),
+            tax_id=np.array(column('taxID'), dtype=np.int64),
+            rank=np.fromiter(
+                (codes[rank] for rank in ranks),
+                dtype=np.int16,
+                count=len(ranks)
+            ),
+            rank_names=rank_names,
+            genome_size=np.array(column('genomeSize'), dtype=np.int64),
+            num_reads=np.array(column('numReads'), dtype=np.int64),
+            num_unique_reads=np.array(
+                column('numUniqueReads'),
+                dtype=np.int64
+            ),
+            abundance=np.array(column('abundance'), dtype=np.float64)
+        )
+
+    def save(self, directory: str):
+        """Save the columns in a directory, one .npy file per column.
+
+        The names are saved as a single UTF-8 buffer, one per line.
+
+        :param directory: Path of the directory, created if needed.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        for column in SAVED_COLUMNS:
+            path = os.path.join(directory, f'{column}.npy')
+            np.save(path, getattr(self, column))
+
+        names = '\n'.join(self.name.tolist()).encode()
+        np.save(
+            os.path.join(directory, 'name.npy'),
+            np.frombuffer(names, dtype=np.uint8)
+        )
+        with open(os.path.join(directory, 'rank_names.json'), 'w') as file:
+            json.dump(list(self.rank_names), file)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: str = 'r') -> 'TaxonomyReport':
+        """Load a report saved by save, the numeric columns are mapped in
+        memory instead of read.
+
+        :param directory: Path of the directory.
+        :param mmap_mode: The mmap_mode of numpy.load, None to read them.
+        """
+        columns = {
+            column: np.load(
+                os.path.join(directory, f'{column}.npy'),
+                mmap_mode=mmap_mode
+            )
+            for column in SAVED_COLUMNS
+        }
+
+        names = np.load(os.path.join(directory, 'name.npy')).tobytes()
+        if len(columns['tax_id']) > 0:
+            names = names.decode().split('\n')
+        else:
+            names = []
+
+        with open(os.path.join(directory, 'rank_names.json'), 'r') as file:
+            rank_names = tuple(json.load(file))
+
+        return cls(
+            name=np.array(names, dtype=object),
+            rank_names=rank_names,
+            **columns
+        )
+
+    def __len__(self) -> int:
+        return len(self.tax_id)
+
+    def __contains__(self, tax_id: int) -> bool:
+        return int(tax_id) in self.index
+
+    @property
+    def index(self) -> dict:
+        """Position of the row of each taxID."""
+        if self._index is None:
+            self._index = {
+                tax_id: position
+                for position, tax_id in enumerate(self.tax_id.tolist())
+            }
+
+        return self._index
+
+    def ranks(self) -> np.ndarray:
+        """Get the names of the ranks of the rows.
+        """
+        return np.array(self.rank_names, dtype=object)[self.rank]
+
+    def levels(self) -> np.ndarray:
+        """Get the level in the hierarchy of the rank of every row,
+        UNRANKED for the ranks out of RANK_LEVELS.
+        """
+        lookup = np.array(
+            [RANK_LEVELS.get(rank, UNRANKED) for rank in self.rank_names],
+            dtype=np.int16
+        )
+
+        return lookup[self.rank]
+
+    def linkParents(self, parents: dict) -> np.ndarray:
+        """Get the position of the parent of every row, -1 for the roots.
+
+        The parent of a row is its nearest ancestor in the report. The
+        ancestors out of the report are visited once, so the whole tree
+        is linked in linear time.
+
+        :param parents: The parent taxID of every taxID.
+        """
+        index = self.index
+        nearest = {}
+        result = np.full(len(self), -1, dtype=np.int64)
+
+        for position, tax_id in enumerate(self.tax_id.tolist()):
+            path = []
+            found = -1
+            node = parents.get(tax_id)
+            node = None if node == tax_id else node
+
+            while node is not None:
+                if node in index:
+                    found = index[node]
+                    break
+                if node in nearest:
+                    found = nearest[node]
+                    break
+
+                # Marked before the parent is visited, to stop on cycles
+                nearest[node] = -1
+                path.append(node)
+
+                parent = parents.get(node)
+                node = None if parent == node else parent
+
+            for node in path:
+                nearest[node] = found
+            if found != position:
+                result[position] = found
+
+        return result
+
+    def inferParents(self) -> np.ndarray:
+        """Get the position of the parent of every row, -1 for the roots,
+        inferred from the order of the rows.
+
+        Valid only for reports listing every taxon right after its
+        ancestors: the parent of a row is the last previous row of a
+        higher rank. The unranked rows are children of the last ranked
+        row and never parents.
+        """
+        levels = self.levels().tolist()
+        result = np.full(len(self), -1, dtype=np.int64)
+        stack = []
+
+        for position, level in enumerate(levels):
+            if level == UNRANKED:
+                if stack:
+                    result[position] = stack[-1]
+                continue
+
+            while stack and levels[stack[-1]] >= level:
+                stack.pop()
+            if stack:
+                result[position] = stack[-1]
+            stack.append(position)
+
+        return result
+
+    def rankCode(self, rank: str) -> int:
+        """Get the code of a rank, -1 if no row has it.
+
+        :param rank: The name of the rank.
+        """
+        try:
+            return self.rank_names.index(rank)
+        except ValueError:
+            return -1
+
+    def _row(self, position: int) -> dict:
+        """Get a row by its position, with the keys of the report.
+
+        :param position: The position of the row.
+        """
+        return {
+            'name': self.name[position],
+            'taxID': int(self.tax_id[position]),
+            'taxRank': self.rank_names[self.rank[position]],
+            'genomeSize': int(self.genome_size[position]),
+            'numReads': int(self.num_reads[position]),
+            'numUniqueReads': int(self.num_unique_reads[position]),
+            'abundance': float(self.abundance[position])
+        }
+
+    def row(self, tax_id: int) -> dict:
+        """Get the row of a taxID, with the keys of the report.
+
+        :param tax_id: The taxID.
+        """
+        return self._row(self.index[int(tax_id)])
+
+    def rows(self, positions=None):
+        """Iterate over the rows in the order of the report, or of the
+        given positions, with the keys of the report.
+
+        :param positions: The positions of the rows, all if None.
+        """
+        if positions is None:
+            positions = range(len(self))
+        else:
+            positions = np.asarray(positions).tolist()
+
+        for position in positions:
+            yield self._row(position)
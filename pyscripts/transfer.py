@@ -0,0 +1,387 @@
+import asyncio
+import os
+import time
+
+
+# Size of the blocks read from the source and written to the destination
+DEFAULT_BLOCK_SIZE = 1024 * 1024  # 1 MB
+
+# Number of outstanding block requests for each file
+DEFAULT_MAX_REQUESTS = 32
+
+# Number of files transferred at the same time
+DEFAULT_PARALLELISM = 2
+
+
+class TransferStats:
+    """Aggregate statistics of a group of transfers.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self.end = None
+
+    def elapsed(self) -> float:
+        """Get the seconds spent in the transfers.
+        """
+        end = self.end if self.end is not None else time.monotonic()
+        return max(end - self.start, 1e-6)
+
+    def throughput(self) -> float:
+        """Get the aggregate throughput in bytes per second.
+        """
+        return self.bytes / self.elapsed()
+
+    def __str__(self):
+        return (
+            f"{self.files} file/s, {self.bytes / 1024 ** 2:.1f} MB "
+            f"in {self.elapsed():.1f} s "
+            f"({self.throughput() / 1024 ** 2:.1f} MB/s)"
+        )
+
+
+class RateLimiter:
+    """Token bucket limiting the aggregate bandwidth of the transfers.
+
+    :param rate: Maximum number of bytes per second.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def consume(self, size: int):
+        """Wait until size bytes can be sent without exceeding the rate.
+
+        :param size: Number of bytes about to be sent.
+        """
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.rate,
+                self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= size
+
+            # Sleep off the debt with the lock held so that the
+            # waiting transfers are served in order
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate)
+
+
+class TransferEngine:
+    """Concurrent and pipelined SFTP transfer engine.
+
+    Files are transferred in parallel and each file keeps many block
+    requests outstanding, so the link stays busy even with a high latency.
+
+    :param block_size: Size of the blocks in bytes.
+    :param max_requests: Number of outstanding block requests per file.
+    :param parallelism: Number of files transferred at the same time.
+    :param bandwidth_limit: Aggregate bandwidth cap in bytes per second,
+    no cap if None.
+    """
+
+    def __init__(
+        self,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+        parallelism: int = DEFAULT_PARALLELISM,
+        bandwidth_limit: int = None
+    ):
+        self.block_size = block_size
+        self.max_requests = max_requests
+        self.parallelism = parallelism
+        self.bandwidth_limit = bandwidth_limit
+        self._limiters = {}
+
+    def configure(self, **options):
+        """Update the settings of the engine.
+
+        :param options: Any of block_size, max_requests, parallelism and
+        bandwidth_limit.
+        """
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown transfer option: {name}")
+            setattr(self, name, value)
+
+        self._limiters = {}
+
+    def _limiter(self):
+        """Get the rate limiter of the running event loop, if any.
+        """
+        if not self.bandwidth_limit:
+            return None
+
+        loop = asyncio.get_running_loop()
+
+        if loop not in self._limiters:
+            self._limiters = {loop: RateLimiter(self.bandwidth_limit)}
+
+        return self._limiters[loop]
+
+    async def readLocalBlocks(self, localpath: str):
+        """Read a local file block by block without blocking the loop.
+
+        :param localpath: Path of the local file.
+        """
+        loop = asyncio.get_running_loop()
+
+        with open(localpath, 'rb') as file:
+            while True:
+                data = await loop.run_in_executor(
+                    None,
+                    file.read,
+                    self.block_size
+                )
+                if not data:
+                    break
+                yield data
+
+    async def writeBlocks(
+        self,
+        remote_file,
+        blocks,
+        on_block=None
+    ) -> int:
+        """Write a stream of blocks keeping many write requests in flight.
+
+        :param remote_file: The open SFTP file to write.
+        :param blocks: Async iterable of the bytes blocks to write.
+        :param on_block: Callable receiving the size of each written block.
+        """
+        limiter = self._limiter()
+        slots = asyncio.Semaphore(self.max_requests)
+        pending = set()
+        errors = []
+        offset = 0
+
+        async def writeBlock(data, offset):
+            try:
+                await remote_file.write(data, offset)
+                if on_block is not None:
+                    on_block(len(data))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                slots.release()
+
+        async for data in blocks:
+            await slots.acquire()
+
+            if errors:
+                slots.release()
+                break
+
+            if limiter is not None:
+                await limiter.consume(len(data))
+
+            task = asyncio.ensure_future(writeBlock(data, offset))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            offset += len(data)
+
+        if pending:
+            await asyncio.gather(*pending)
+
+        if errors:
+            raise errors[0]
+
+        return offset
+
+    async def putStream(
+        self,
+        sftp,
+        blocks,
+        remotepath: str,
+        total: int = 0,
+        progress_handler=None,
+        stats: TransferStats = None
+    ) -> int:
+        """Upload a stream of blocks to a remote file.
+
+        :param sftp: The SFTP client to use.
+        :param blocks: Async iterable of the bytes blocks to upload.
+        :param remotepath: Path of the remote file to create.
+        :param total: Expected number of bytes, used for progress.
+        :param progress_handler: Callable with the signature of the
+        asyncssh progress handlers.
+        :param stats: TransferStats to update.
+        """
+        sent = 0
+        name = os.path.basename(remotepath).encode()
+
+        def onBlock(size):
+            nonlocal sent
+            sent += size
+            if stats is not None:
+                stats.bytes += size
+            if progress_handler is not None:
+                progress_handler(name, name, sent, max(total, sent))
+
+        async with sftp.open(remotepath, 'wb') as remote_file:
+            written = await self.writeBlocks(remote_file, blocks, onBlock)
+
+        if stats is not None:
+            stats.files += 1
+
+        return written
+
+    async def getFile(
+        self,
+        sftp,
+        remotepath: str,
+        localpath: str,
+        progress_handler=None,
+        stats: TransferStats = None
+    ) -> TransferStats:
+        """Download a remote file keeping many read requests in flight.
+
+        :param sftp: The SFTP client to use.
+        :param remotepath: Path of the remote file.
+        :param localpath: Path of the local file to create.
+        :param progress_handler: Callable with the signature of the
+        asyncssh progress handlers.
+        :param stats: TransferStats to update, a new one is created
+        if not given.
+        """
+        if stats is None:
+            stats = TransferStats()
+
+        limiter = self._limiter()
+        slots = asyncio.Semaphore(self.max_requests)
+        total = (await sftp.stat(remotepath)).size
+        name = os.path.basename(remotepath).encode()
+        received = 0
+
+        async def readBlock(remote_file, local_file, offset):
+            nonlocal received
+            try:
+                data = await remote_file.read(self.block_size, offset)
+                local_file.seek(offset)
+                local_file.write(data)
+                received += len(data)
+                stats.bytes += len(data)
+                if progress_handler is not None:
+                    progress_handler(name, name, received, total)
+            finally:
+                slots.release()
+
+        async with sftp.open(remotepath, 'rb') as remote_file:
+            with open(localpath, 'wb') as local_file:
+                tasks = []
+
+                try:
+                    for offset in range(0, total, self.block_size):
+                        await slots.acquire()
+
+                        if limiter is not None:
+                            await limiter.consume(
+                                min(self.block_size, total - offset)
+                            )
+
+                        tasks.append(asyncio.ensure_future(
+                            readBlock(remote_file, local_file, offset)
+                        ))
+
+                        # Stop scheduling reads as soon as one fails
+                        if any(t.done() and t.exception() for t in tasks):
+                            break
+
+                    await asyncio.gather(*tasks)
+                finally:
+                    # Stop the reads still in flight before the local file
+                    # is closed, on failure or cancellation
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+
+        stats.files += 1
+
+        return stats
+
+    async def put(
+        self,
+        sftp,
+        localpaths: list,
+        remotedir: str = '.',
+        progress_handler=None
+    ) -> TransferStats:
+        """Upload local files concurrently.
+
+        :param sftp: The SFTP client to use.
+        :param localpaths: Array of strings containing the paths of the
+        files to upload.
+        :param remotedir: Remote directory receiving the files.
+        :param progress_handler: Callable with the signature of the
+        asyncssh progress handlers.
+        """
+        stats = TransferStats()
+        slots = asyncio.Semaphore(self.parallelism)
+
+        async def putFile(localpath):
+            async with slots:
+                remotepath = f'{remotedir}/{os.path.basename(localpath)}'
+                await self.putStream(
+                    sftp,
+                    self.readLocalBlocks(localpath),
+                    remotepath,
+                    os.path.getsize(localpath),
+                    progress_handler,
+                    stats
+                )
+
+        await asyncio.gather(*[putFile(path) for path in localpaths])
+        stats.end = time.monotonic()
+        print(f"\nUploaded {stats}")
+
+        return stats
+
+    async def get(
+        self,
+        sftp,
+        remotepaths: list,
+        localdir: str,
+        progress_handler=None
+    ) -> TransferStats:
+        """Download remote files concurrently.
+
+        :param sftp: The SFTP client to use.
+        :param remotepaths: Array of strings containing the paths of the
+        files to download.
+        :param localdir: Local directory receiving the files.
+        :param progress_handler: Callable with the signature of the
+        asyncssh progress handlers.
+        """
+        stats = TransferStats()
+        slots = asyncio.Semaphore(self.parallelism)
+
+        async def getFile(remotepath):
+            async with slots:
+                localpath = os.path.join(
+                    localdir,
+                    os.path.basename(remotepath)
+                )
+                await self.getFile(
+                    sftp,
+                    remotepath,
+                    localpath,
+                    progress_handler,
+                    stats
+                )
+
+        await asyncio.gather(*[getFile(path) for path in remotepaths])
+        stats.end = time.monotonic()
+        print(f"\nDownloaded {stats}")
+
+        return stats
+
+
+# Engine shared by every pipeline stage
+engine = TransferEngine()
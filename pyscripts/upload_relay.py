@@ -0,0 +1,294 @@
+import asyncio
+import re
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData
+)
+from werkzeug.utils import secure_filename
+
+from pyscripts.allowed_file import fileExtension
+from pyscripts.connection import pool
+from pyscripts.progress import uploadProgress
+from pyscripts.read_store import storeStream
+from pyscripts.run_manager import manager
+
+
+# Size of the chunks read from the request body
+RELAY_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+# Blocks waiting to be written on the cluster, per file. When the queue
+# is full the request body is not read until the cluster catches up, so
+# the memory used by a relay is bounded.
+RELAY_QUEUE_BLOCKS = 8
+
+# Maximum size of the text fields of the form
+RELAY_MAX_FIELD_SIZE = 64 * 1024  # 64 KB
+
+# Number of reads files of each type of reads
+READS_FILES = {'single': 1, 'paired': 2}
+
+
+class StreamRelay:
+    """Relay of a reads file from the browser to the read store of the
+    cluster, written while the request body is still being received.
+
+    The SFTP write is executed on the event loop of the run manager,
+    the request thread feeds it through a bounded queue.
+
+    :param hostname: A string which is the host name to connect.
+    :param username: A string which is the username of the account
+    to connect in the host machine.
+    :param password: A string which is the password of the account
+    to connect in the host machine.
+    :param filename: Name of the reads file.
+    :param sha256: Hex digest of the content of the file computed by the
+    browser, the file is not sent again if already stored. None if
+    unknown.
+    :param size: Expected number of bytes of the file, for the progress,
+    0 if unknown.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        filename: str,
+        sha256: str = None,
+        size: int = 0
+    ):
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+
+        self._queue = None
+        self._task = None
+        manager.runCoroutine(self._open()).result()
+
+    async def _open(self):
+        """Create the queue and start the SFTP write on the manager loop.
+        """
+        self._queue = asyncio.Queue(RELAY_QUEUE_BLOCKS)
+        self._task = asyncio.ensure_future(self._store())
+
+        # The connection of the user is kept open until the end
+        manager.relays.add(self)
+        self._task.add_done_callback(lambda _: manager.relays.discard(self))
+
+    async def _blocks(self):
+        """Get the blocks received from the browser, until the end of
+        the file.
+        """
+        while True:
+            data = await self._queue.get()
+            if data is None:
+                return
+            yield data
+
+    async def _store(self) -> str:
+        """Write the received blocks in the read store of the cluster.
+        """
+        conn = await pool.connect(self.hostname, self.username, self.password)
+        scratch_dir = await pool.scratchDir(
+            self.hostname,
+            self.username,
+            self.password
+        )
+
+        async with conn.start_sftp_client() as sftp:
+            print(f"Relaying {self.filename} to the cluster")
+            return await storeStream(
+                sftp,
+                scratch_dir,
+                self.filename,
+                self._blocks(),
+                progress_handler=uploadProgress,
+                sha256=self.sha256,
+                size=self.size
+            )
+
+    async def _put(self, data):
+        """Queue a block, failing if the SFTP write failed meanwhile.
+
+        :param data: The bytes block, None at the end of the file.
+        """
+        put = asyncio.ensure_future(self._queue.put(data))
+        await asyncio.wait(
+            {put, self._task},
+            return_when=asyncio.FIRST_COMPLETED
+        )
+
+        if not put.done():
+            put.cancel()
+        if self._task.done():
+            # Raise the error of the SFTP write, if any
+            self._task.result()
+
+    def feed(self, data: bytes):
+        """Send a block of the file, waiting if the queue is full.
+
+        :param data: The bytes block.
+        """
+        manager.runCoroutine(self._put(data)).result()
+
+    def finish(self) -> str:
+        """Wait for the end of the SFTP write and return the path of the
+        stored reads.
+        """
+        manager.runCoroutine(self._put(None)).result()
+
+        async def wait():
+            return await self._task
+
+        return manager.runCoroutine(wait()).result()
+
+    def abort(self):
+        """Stop the SFTP write, removing the partial file.
+        """
+        async def cancel():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        manager.runCoroutine(cancel()).result()
+
+
+def _startRelay(
+    form: MultiDict,
+    filename: str,
+    started: int,
+    content_length: int = 0
+) -> StreamRelay:
+    """Check a reads file announced in the form and start its relay.
+
+    The whole form is checked before the first byte is sent to the
+    cluster, so an invalid form is rejected without uploading the reads.
+
+    :param form: The text fields received before the file.
+    :param filename: Name of the file given by the browser.
+    :param started: Number of reads files already relayed.
+    :param content_length: Size of the request body, the size of the
+    file for the progress if the form does not give it.
+    """
+    file_ext = fileExtension(filename) if '.' in filename else ''
+    if file_ext != 'fastq' and file_ext != 'fastq.gz':
+        raise ValueError(
+            "Selected files are in the wrong format "
+            "(accepted fastq or fastq.gz)"
+        )
+
+    for field in ('hostname', 'username', 'password', 'readType'):
+        if not form.get(field):
+            raise ValueError(f"The {field} must be sent before the files")
+
+    # Check at least one domain selected
+    if len(form.getlist('domains')) == 0:
+        raise ValueError("At least one domain must be selected")
+
+    # Check the number of files of the type of reads
+    read_type = form['readType']
+    if read_type not in READS_FILES:
+        raise ValueError(f"Unknown type of reads: {read_type}")
+    if started >= READS_FILES[read_type]:
+        raise ValueError(
+            "If single-end reads selected, one file must be uploaded"
+            if read_type == 'single' else
+            "If paired-end reads selected, two files must be uploaded"
+        )
+
+    # Hash of the file computed by the browser, sent before the files in
+    # their order
+    checksums = form.getlist('sha256')
+    sha256 = checksums[started] if started < len(checksums) else ''
+    if not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        sha256 = None
+
+    # Size of the file for the progress, the whole body bounds it
+    sizes = form.getlist('size')
+    size = sizes[started] if started < len(sizes) else ''
+    size = int(size) if size.isdigit() else content_length
+
+    return StreamRelay(
+        form['hostname'],
+        form['username'],
+        form['password'],
+        secure_filename(filename),
+        sha256,
+        size
+    )
+
+
+def relayForm(stream, boundary: str, content_length: int = 0) -> tuple:
+    """Function to parse a multipart form relaying its reads files to the
+    cluster while they are received, without saving them on disk.
+
+    The text fields of the form must precede the files, the form page
+    sends the files last.
+
+    :param stream: The stream of the request body.
+    :param boundary: The boundary of the multipart form.
+    :param content_length: Size of the request body, 0 if unknown.
+    :return: The text fields of the form, and the list of (filename,
+    remote path) of the stored reads files.
+    """
+    decoder = MultipartDecoder(boundary.encode('ascii'))
+    form = MultiDict()
+    files = []
+    relays = []
+
+    relay = None
+    field = None
+    value = bytearray()
+    finished = False
+
+    try:
+        while not finished:
+            event = decoder.next_event()
+
+            if isinstance(event, NeedData):
+                if decoder.complete:
+                    raise ValueError("The upload was interrupted")
+                decoder.receive_data(stream.read(RELAY_CHUNK_SIZE) or None)
+            elif isinstance(event, Field):
+                field = event.name
+                value = bytearray()
+            elif isinstance(event, File):
+                relay = _startRelay(
+                    form,
+                    event.filename,
+                    len(relays),
+                    content_length
+                )
+                relays.append(relay)
+            elif isinstance(event, Data):
+                if relay is not None:
+                    relay.feed(event.data)
+                else:
+                    value += event.data
+                    if len(value) > RELAY_MAX_FIELD_SIZE:
+                        raise RequestEntityTooLarge()
+
+                if not event.more_data:
+                    if relay is not None:
+                        files.append((relay.filename, relay.finish()))
+                        relay = None
+                    else:
+                        form.add(field, value.decode('utf-8', 'replace'))
+            elif isinstance(event, Epilogue):
+                finished = True
+    except BaseException:
+        # Stop the relays still writing on the cluster
+        for relay in relays:
+            relay.abort()
+        raise
+
+    return form, files
@@ -0,0 +1,47 @@
+import os
+
+
+# Directory in $SCRATCH holding the working directories of the runs
+REMOTE_WORKSPACES = 'cleanseq'
+
+# Days after which the working directory of a run is removed
+WORKSPACE_MAX_AGE_DAYS = 7
+
+
+def remoteWorkdir(scratch_dir: str, run_id: str) -> str:
+    """Get the absolute path of the remote working directory of a run.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param run_id: The ID of the run.
+    """
+    return f'{scratch_dir}/{REMOTE_WORKSPACES}/{run_id}'
+
+
+def localDir(base: str, run_id: str) -> str:
+    """Get the absolute path of the local directory of a run inside a
+    base directory ('scripts', 'download'), creating it if needed.
+
+    The path is absolute as the results are sent by Flask, which resolves
+    the relative paths from the root of the app instead of the working
+    directory.
+
+    :param base: The base directory.
+    :param run_id: The ID of the run.
+    """
+    path = os.path.abspath(os.path.join(base, run_id))
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def cleanupCommand(scratch_dir: str) -> str:
+    """Build the command removing the remote working directories older
+    than WORKSPACE_MAX_AGE_DAYS.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    """
+    return (
+        f'find {scratch_dir}/{REMOTE_WORKSPACES} -mindepth 1 -maxdepth 1 '
+        f'-type d -mtime +{WORKSPACE_MAX_AGE_DAYS} -exec rm -rf {{}} + '
+        '2> /dev/null'
+    )
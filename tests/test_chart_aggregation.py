@@ -0,0 +1,77 @@
+import numpy as np
+
+from pyscripts.chart_aggregation import OTHER, rollup, topN, withOther
+from pyscripts.taxonomy_report import TaxonomyReport
+
+from tests.test_taxonomy_report import writeReport
+
+
+# Report listing every taxon right after its ancestors
+ROWS = [
+    ('Bacteria', 2, 'superkingdom', 0, 1, 1, 0.0),
+    ('Escherichia', 561, 'genus', 0, 2, 2, 0.1),
+    ('Escherichia coli', 562, 'species', 5000, 40, 30, 0.4),
+    ('Escherichia coli K-12', 83333, 'strain', 4600, 7, 7, 0.05),
+    ('Escherichia albertii', 208962, 'species', 4700, 10, 8, 0.15),
+    ('Salmonella', 590, 'genus', 0, 0, 0, 0.0),
+    ('Salmonella enterica', 28901, 'species', 4800, 20, 15, 0.3)
+]
+
+
+def testTopN():
+    values = np.array([5, 1, 9, 5, 3])
+
+    assert topN(values).tolist() == [2, 0, 3, 4, 1]
+    assert topN(values, 2).tolist() == [2, 0]
+    assert topN(values, 10).tolist() == [2, 0, 3, 4, 1]
+
+
+def testWithOther():
+    names = np.array(['a', 'b', 'c', 'd'], dtype=object)
+    values = np.array([3, 10, 1, 6])
+
+    names_top, values_top = withOther(names, values, 2)
+    assert names_top.tolist() == ['b', 'd', OTHER]
+    assert values_top.tolist() == [10, 6, 4]
+
+    # No bucket when nothing is left out
+    names_all, values_all = withOther(names, values)
+    assert names_all.tolist() == ['b', 'd', 'a', 'c']
+    assert values_all.tolist() == [10, 6, 3, 1]
+
+
+def testRollupInferred(tmp_path):
+    report = TaxonomyReport.fromTSV(writeReport(tmp_path, ROWS))
+    genera = rollup(report, 'genus')
+
+    # The superkingdom above the rank is left out
+    assert genera.name.tolist() == ['Escherichia', 'Salmonella']
+    assert genera.num_reads.tolist() == [59, 20]
+    assert genera.num_unique_reads.tolist() == [47, 15]
+    assert genera.genome_size.tolist() == [5000, 4800]
+    assert np.allclose(genera.abundance, [0.7, 0.3])
+
+
+def testRollupTree(tmp_path):
+    # Sorted by taxID, the tree comes from the parents
+    report = TaxonomyReport.fromTSV(
+        writeReport(tmp_path, sorted(ROWS, key=lambda row: row[1]))
+    )
+    parents = {
+        2: 1,
+        561: 543,
+        543: 2,
+        562: 561,
+        83333: 562,
+        208962: 561,
+        590: 543,
+        28901: 590
+    }
+    species = rollup(report, 'species', parents)
+
+    assert species.name.tolist() == [
+        'Escherichia coli',
+        'Salmonella enterica',
+        'Escherichia albertii'
+    ]
+    assert species.num_reads.tolist() == [47, 20, 10]
@@ -0,0 +1,87 @@
+import hashlib
+
+import pytest
+
+from pyscripts.chunked_upload import ChunkError, ChunkedUploads
+from pyscripts.read_store import knownHash
+
+
+CHUNK_SIZE = 256 * 1024
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    # The manifest of the read store is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+    return ChunkedUploads(str(tmp_path / 'uploads'))
+
+
+def chunks(content: bytes) -> list:
+    """Split a content in chunks of CHUNK_SIZE bytes.
+
+    :param content: The content of the file.
+    """
+    return [
+        content[offset:offset + CHUNK_SIZE]
+        for offset in range(0, len(content), CHUNK_SIZE)
+    ]
+
+
+def checksum(data: bytes) -> str:
+    """Get the hex SHA-256 of some bytes, as computed by the browser.
+
+    :param data: The bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def testAssembly(registry):
+    content = bytes(range(256)) * 3000
+    upload = registry.create('sample.fastq', len(content), CHUNK_SIZE)
+
+    # The chunks arrive in any order
+    parts = chunks(content)
+    for index in reversed(range(len(parts))):
+        upload.writeChunk(index, parts[index], checksum(parts[index]))
+
+    assert upload.complete() == []
+    assert upload.completed
+    with open(upload.path, 'rb') as file:
+        assert file.read() == content
+    assert upload.sha256 == checksum(content)
+    assert knownHash(upload.path) == checksum(content)
+
+
+def testResume(registry):
+    content = b'@read\nACGT\n+\nIIII\n' * 50000
+    upload = registry.create('sample.fastq', len(content), CHUNK_SIZE)
+    parts = chunks(content)
+
+    upload.writeChunk(1, parts[1], checksum(parts[1]))
+    assert upload.complete() == [0] + list(range(2, len(parts)))
+
+    # A restarted server loads the upload from disk
+    resumed = ChunkedUploads(registry.upload_folder).get(upload.id)
+    assert resumed.missing() == [0] + list(range(2, len(parts)))
+
+    for index in resumed.missing():
+        resumed.writeChunk(index, parts[index], checksum(parts[index]))
+
+    assert resumed.complete() == []
+    assert resumed.sha256 == checksum(content)
+    with open(resumed.path, 'rb') as file:
+        assert file.read() == content
+
+
+def testChecksumRequired(registry):
+    upload = registry.create('sample.fastq', 10, CHUNK_SIZE)
+
+    with pytest.raises(ChunkError):
+        upload.writeChunk(0, b'0123456789', None)
+    with pytest.raises(ChunkError):
+        upload.writeChunk(0, b'0123456789', checksum(b'9876543210'))
+    with pytest.raises(ChunkError):
+        upload.writeChunk(0, b'01234', checksum(b'01234'))
+
+    assert upload.missing() == [0]
@@ -0,0 +1,22 @@
+from pyscripts.execution import BackendSelector
+
+
+GB = 1024 * 1024 * 1024
+
+
+def testSelect():
+    selector = BackendSelector(local_max_bytes=GB, local_max_memory=16 * GB)
+
+    assert selector.select(GB, True, 4 * GB).name == 'local'
+    assert selector.select(2 * GB, True, 4 * GB).name == 'slurm'
+    # The index must be built on a compute node
+    assert selector.select(GB, False, 4 * GB).name == 'slurm'
+    # The index does not fit the memory of the login node
+    assert selector.select(GB, True, 32 * GB).name == 'slurm'
+
+
+def testSelectForced():
+    selector = BackendSelector(backend='local')
+
+    assert selector.select(2 ** 40, True, 2 ** 40).name == 'local'
+    assert selector.select(0, False, 0).name == 'slurm'
@@ -0,0 +1,58 @@
+import os
+import subprocess
+
+from pyscripts.index_cache import (
+    INDEX_NAME,
+    buildIndexCommands,
+    indexDir,
+    indexKey
+)
+
+
+def buildIndex(scratch_dir, label: str):
+    """Execute the commands building the viral index, with a stub of
+    centrifuge-build writing a label in the index.
+
+    :param scratch_dir: The $SCRATCH directory path.
+    :param label: Content of the index.
+    """
+    stub = scratch_dir / 'centrifuge-build'
+    stub.write_text(f'#!/bin/bash\necho {label} > "${{@: -1}}.1.cf"\n')
+    stub.chmod(0o755)
+
+    subprocess.run(
+        ['bash', '-c', buildIndexCommands(str(scratch_dir), ['viral'], '1')],
+        cwd=scratch_dir,
+        env={**os.environ, 'PATH': f'{scratch_dir}:{os.environ["PATH"]}'},
+        check=True
+    )
+
+
+def testIndexSwitch(tmp_path):
+    entry = indexDir(str(tmp_path), indexKey(['viral'], '1'))
+
+    buildIndex(tmp_path, 'first')
+    first = os.path.realpath(entry)
+    with open(f'{entry}/{INDEX_NAME}.1.cf') as file:
+        assert file.read() == 'first\n'
+
+    # The entry links the new build, the previous one is left to the jobs
+    # still reading it
+    buildIndex(tmp_path, 'second')
+    assert os.path.islink(entry)
+    assert os.path.realpath(entry) != first
+    with open(f'{entry}/{INDEX_NAME}.1.cf') as file:
+        assert file.read() == 'second\n'
+    with open(f'{first}/{INDEX_NAME}.1.cf') as file:
+        assert file.read() == 'first\n'
+
+
+def testIndexDirectoryReplaced(tmp_path):
+    # An entry cached before the builds were linked is a directory
+    entry = indexDir(str(tmp_path), indexKey(['viral'], '1'))
+    os.makedirs(entry)
+
+    buildIndex(tmp_path, 'first')
+    assert os.path.islink(entry)
+    with open(f'{entry}/{INDEX_NAME}.1.cf') as file:
+        assert file.read() == 'first\n'
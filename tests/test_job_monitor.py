@@ -0,0 +1,117 @@
+import asyncio
+import types
+
+import pytest
+
+from pyscripts import job_monitor
+from pyscripts.job_monitor import (
+    JobFailedError,
+    JobMonitor,
+    parseStates,
+    parseUsage
+)
+from pyscripts.resources import GB
+
+
+class FakeConnection:
+    """SSH connection answering the squeue and sacct commands.
+
+    :param squeue: Output of squeue.
+    :param sacct: Output of sacct.
+    """
+
+    def __init__(self, squeue: str = '', sacct: str = ''):
+        self.squeue = squeue
+        self.sacct = sacct
+        self.commands = []
+
+    async def run(self, command: str, check: bool = False):
+        """Record a command and answer it.
+
+        :param command: The command.
+        :param check: Ignored.
+        """
+        self.commands.append(command)
+        output = self.squeue if command.startswith('squeue') else self.sacct
+        return types.SimpleNamespace(stdout=output)
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection()
+
+    async def connect(hostname, username, password):
+        return connection
+
+    monkeypatch.setattr(job_monitor.pool, 'connect', connect)
+    # Poll without waiting
+    monkeypatch.setattr(job_monitor, 'DEFAULT_POLL_INTERVAL', 0.01)
+
+    return connection
+
+
+def testParseStates():
+    assert parseStates(
+        '100 RUNNING\n'
+        '101_0 COMPLETING\n'
+        '101_[1-3] PENDING\n'
+        '\n'
+    ) == {'100': 'RUNNING', '101_0': 'COMPLETING', '101_[1-3]': 'PENDING'}
+
+    # sacct lines, with the suffixes of the states
+    assert parseStates(
+        '102|CANCELLED by 1234\n'
+        '103|FAILED+\n'
+        '104_2|OUT_OF_MEMORY\n'
+    ) == {'102': 'CANCELLED', '103': 'FAILED', '104_2': 'OUT_OF_MEMORY'}
+
+
+def testParseUsage():
+    output = (
+        '200|30|\n'
+        '200.batch|30|1024K\n'
+        '2001|99|\n'
+        '2001.batch|99|64G\n'
+    )
+    assert parseUsage(output, '200') == {'seconds': 30, 'memory': 1024 ** 2}
+    assert parseUsage(output, '300') is None
+
+
+def testParseUsageArray():
+    # The largest usage of the tasks of the array
+    output = (
+        '210_0|25|\n'
+        '210_0.batch|25|1048576\n'
+        '210_1|40|\n'
+        '210_1.batch|40|2G\n'
+        '210_1.extern|40|\n'
+    )
+    assert parseUsage(output, '210') == {'seconds': 40, 'memory': 2 * GB}
+
+
+def testWaitCompleted(connection):
+    connection.sacct = '300|COMPLETED\n'
+
+    state = asyncio.run(
+        JobMonitor().waitCompleted('host', 'user', 'secret', '300')
+    )
+
+    assert state == 'COMPLETED'
+    # Looked up in the accounting once out of the queue
+    assert any(command.startswith('sacct') for command in connection.commands)
+
+
+def testWaitUnknown(connection):
+    # A job in neither squeue nor sacct is lost after a few polls
+    with pytest.raises(JobFailedError) as error:
+        asyncio.run(
+            JobMonitor().waitCompleted('host', 'user', 'secret', '400')
+        )
+
+    assert error.value.state == 'UNKNOWN'
+    squeues = [
+        command for command in connection.commands
+        if command.startswith('squeue')
+    ]
+    assert len(squeues) == job_monitor.MAX_MISSING_POLLS
+
@@ -0,0 +1,33 @@
+import pytest
+
+from pyscripts.library_cache import snapshotLabel
+
+
+def testSnapshotLabel():
+    output = 'Refreshing viral\narchaea@2024-01-01,viral@2024-02-01\n'
+
+    assert snapshotLabel(output, ['viral', 'archaea']) == (
+        'archaea@2024-01-01,viral@2024-02-01'
+    )
+
+
+def testSnapshotLabelUnderscoreDomains():
+    label = 'vertebrate_mammalian@2024-01-01,vertebrate_other@2024-01-02'
+
+    assert snapshotLabel(
+        label,
+        ['vertebrate_other', 'vertebrate_mammalian']
+    ) == label
+
+
+@pytest.mark.parametrize('output', [
+    '',
+    'viral@',
+    'viral@2024-01',
+    'viral@2024-01-01',
+    'archaea@2024-01-01,fungi@2024-01-01',
+    'error: flock timeout'
+])
+def testInvalidSnapshotLabel(output):
+    with pytest.raises(ValueError):
+        snapshotLabel(output, ['viral', 'archaea'])
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from HPC_CleanSeq import app
+from pyscripts.chart_cache import charts
+from pyscripts.chart_service import service
+from pyscripts.report_registry import reports
+
+from tests.test_taxonomy_report import writeReport
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Keep the registry, the charts and the saved reports of the test
+    monkeypatch.setattr(reports, 'directory', str(tmp_path / 'reports'))
+    monkeypatch.setattr(charts, 'directory', str(tmp_path / 'charts'))
+    monkeypatch.setattr(service, 'directory', str(tmp_path / 'columns'))
+    monkeypatch.setattr(service, 'workers', 1)
+
+    yield app.test_client()
+
+    # Stop the workers of the test
+    service.configure()
+
+
+@pytest.fixture
+def report_id(tmp_path):
+    return reports.register(writeReport(tmp_path, [
+        ('Bacteria', 2, 'superkingdom', 0, 5, 0, 0.0),
+        ('Escherichia', 561, 'genus', 0, 30, 2, 0.1),
+        ('Escherichia coli', 562, 'species', 5000, 4000, 3000, 0.4),
+        ('Salmonella', 590, 'genus', 0, 10, 1, 0.1),
+        ('Salmonella enterica', 28901, 'species', 4800, 2000, 1500, 0.4)
+    ]))
+
+
+def testRows(client, report_id):
+    response = client.get(
+        f'/reports/{report_id}/rows?sort=name&order=asc&rank=species'
+    )
+
+    assert response.status_code == 200
+    page = response.get_json()
+    assert page['total'] == 2
+    assert [row['taxID'] for row in page['rows']] == [562, 28901]
+
+
+def testRowsErrors(client, report_id):
+    assert client.get('/reports/missing/rows').status_code == 404
+    assert client.get(
+        f'/reports/{report_id}/rows?sort=color'
+    ).status_code == 400
+
+
+def testChart(client, report_id):
+    response = client.get(f'/reports/{report_id}/charts/abu_chart?top=1')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    labels = json.loads(response.data)['data'][0]['labels']
+    assert labels == ['Escherichia coli', 'Other']
+
+    # Aggregated at a rank
+    response = client.get(
+        f'/reports/{report_id}/charts/abu_chart?rank=genus'
+    )
+    labels = json.loads(response.data)['data'][0]['labels']
+    assert sorted(labels) == ['Escherichia', 'Salmonella']
+
+
+def testChartErrors(client, report_id):
+    assert client.get(
+        f'/reports/{report_id}/charts/pie'
+    ).status_code == 404
+    assert client.get('/reports/missing/charts/abu_chart').status_code == 404
+    assert client.get(
+        f'/reports/{report_id}/charts/abu_chart?rank=color'
+    ).status_code == 400
+    assert client.get(
+        f'/reports/{report_id}/charts/abu_chart?top=0'
+    ).status_code == 400
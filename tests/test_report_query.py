@@ -0,0 +1,115 @@
+import pytest
+
+from pyscripts.report_query import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    ReportQuery,
+    queryArgs
+)
+from pyscripts.taxonomy_report import TaxonomyReport
+
+from tests.test_taxonomy_report import writeReport
+
+
+def testNameMaskLengthChange(tmp_path):
+    # 'İ' is lowercased in two characters, the next rows must not shift
+    query = ReportQuery(TaxonomyReport.fromTSV(writeReport(tmp_path, [
+        ('İİİİİİİİ virus', 1, 'species', 0, 10, 10, 0.5),
+        ('Ebola', 2, 'species', 0, 20, 20, 0.3),
+        ('Dengue', 3, 'species', 0, 30, 30, 0.2)
+    ])))
+
+    assert query.nameMask('ebola').tolist() == [False, True, False]
+    assert query.nameMask('DENGUE').tolist() == [False, False, True]
+    assert query.nameMask('virus').tolist() == [True, False, False]
+
+
+# Report of the queries, sorted by taxID as written by Centrifuge
+ROWS = [
+    ('Bacteria', 2, 'superkingdom', 0, 5, 0, 0.0),
+    ('Escherichia', 561, 'genus', 0, 30, 2, 0.1),
+    ('Escherichia coli', 562, 'species', 5000, 400, 300, 0.4),
+    ('Salmonella enterica', 28901, 'species', 4800, 200, 150, 0.3),
+    ('Escherichia albertii', 208962, 'species', 4700, 100, 80, 0.2)
+]
+
+
+@pytest.fixture
+def query(tmp_path):
+    return ReportQuery(TaxonomyReport.fromTSV(writeReport(tmp_path, ROWS)))
+
+
+def names(page: dict) -> list:
+    """Get the names of the rows of a page.
+
+    :param page: The page returned by ReportQuery.query.
+    """
+    return [row['name'] for row in page['rows']]
+
+
+def testSort(query):
+    assert names(query.query(sort='numReads', limit=3)) == [
+        'Escherichia coli',
+        'Salmonella enterica',
+        'Escherichia albertii'
+    ]
+    assert names(query.query(sort='name', descending=False, limit=2)) == [
+        'Bacteria',
+        'Escherichia'
+    ]
+    # By the name of the rank
+    assert names(query.query(sort='taxRank', descending=False)) == [
+        'Escherichia',
+        'Escherichia coli',
+        'Salmonella enterica',
+        'Escherichia albertii',
+        'Bacteria'
+    ]
+
+
+def testFilter(query):
+    page = query.query(rank='species', name='escherichia')
+    assert page['total'] == 2
+    assert names(page) == ['Escherichia coli', 'Escherichia albertii']
+
+    page = query.query(min_reads=100, max_abundance=0.3)
+    assert names(page) == ['Salmonella enterica', 'Escherichia albertii']
+
+    assert query.query(rank='order')['total'] == 0
+
+
+def testPaging(query):
+    page = query.query(sort='abundance', offset=1, limit=2)
+
+    assert page['total'] == 5
+    assert page['offset'] == 1
+    assert names(page) == ['Salmonella enterica', 'Escherichia albertii']
+    assert page['rows'][0] == {
+        'name': 'Salmonella enterica',
+        'taxID': 28901,
+        'taxRank': 'species',
+        'genomeSize': 4800,
+        'numReads': 200,
+        'numUniqueReads': 150,
+        'abundance': 0.3
+    }
+    assert query.query(offset=10)['rows'] == []
+
+
+def testQueryArgs():
+    params = queryArgs({'sort': 'abundance', 'order': 'asc', 'offset': '20'})
+
+    assert params['sort'] == 'abundance'
+    assert not params['descending']
+    assert params['offset'] == 20
+    assert params['limit'] == DEFAULT_PAGE_SIZE
+
+    for args in (
+        {'sort': 'color'},
+        {'offset': '-1'},
+        {'limit': '0'},
+        {'limit': str(MAX_PAGE_SIZE + 1)},
+        {'min_reads': 'many'}
+    ):
+        with pytest.raises(ValueError):
+            queryArgs(args)
@@ -0,0 +1,71 @@
+import asyncio
+
+from pyscripts import run_manager
+from pyscripts.progress import bus
+from pyscripts.run_manager import RunManager, current_slot
+
+
+def testReleasedSlot():
+    manager = RunManager(max_concurrent=1)
+    events = []
+
+    async def stage(name: str, wait: float):
+        async with manager._slots:
+            current_slot.set({'waiting': 0})
+            events.append(f'{name} started')
+            async with manager.released():
+                await asyncio.sleep(wait)
+            events.append(f'{name} ended')
+
+    async def main():
+        manager._slots = asyncio.Semaphore(1)
+        await asyncio.gather(stage('a', 0.1), stage('b', 0))
+
+    # The second stage takes the slot while the first waits for its job
+    asyncio.run(main())
+    assert events == ['a started', 'b started', 'b ended', 'a ended']
+
+
+def testReleasedOutOfStage():
+    manager = RunManager(max_concurrent=1)
+
+    async def main():
+        async with manager.released():
+            return 'done'
+
+    assert asyncio.run(main()) == 'done'
+
+
+def testDisconnectLastRun(monkeypatch):
+    closed = []
+
+    async def close(hostname, username):
+        closed.append((hostname, username))
+
+    monkeypatch.setattr(run_manager.pool, 'close', close)
+    manager = RunManager()
+    runs = [
+        manager.create('host', 'user', 'secret', 'account', [], ['virus'])
+        for _ in range(2)
+    ]
+
+    # The connection is kept while another run needs the password
+    runs[0].dropCredentials()
+    asyncio.run(manager._disconnect('host', 'user'))
+    assert closed == []
+
+    runs[1].dropCredentials()
+    asyncio.run(manager._disconnect('host', 'user'))
+    assert closed == [('host', 'user')]
+
+
+def testExpire():
+    manager = RunManager(run_ttl=-1)
+    run = manager.create('host', 'user', None, 'account', [], ['virus'])
+    run.setProgress('Queued', 0)
+    assert any(last[0] == run.id for last in bus._last)
+
+    # The next run forgets the finished one and its channel
+    manager.create('host', 'user', None, 'account', [], ['virus'])
+    assert manager.get(run.id) is None
+    assert not any(last[0] == run.id for last in bus._last)
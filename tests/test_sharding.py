@@ -0,0 +1,102 @@
+import subprocess
+
+from pyscripts.sharding import SHARDS_DIR, mergeCommands, splitCommands
+from pyscripts.taxonomy_report import REPORT_COLUMNS, TREE_FILE
+
+
+def runCommands(directory, commands: str):
+    """Execute script lines in a working directory.
+
+    :param directory: The working directory.
+    :param commands: The script lines.
+    """
+    subprocess.run(['bash', '-c', commands], cwd=directory, check=True)
+
+
+def writeTable(path, rows: list):
+    """Write a tab separated file.
+
+    :param path: Path of the file.
+    :param rows: Array of the rows, as tuples of the fields.
+    """
+    path.write_text(''.join(
+        '\t'.join(str(field) for field in row) + '\n' for row in rows
+    ))
+
+
+def testSplit(tmp_path):
+    for mate in (1, 2):
+        (tmp_path / f'sample_{mate}.fastq').write_text(''.join(
+            f'@read{read}/{mate}\nACGT\n+\nIIII\n' for read in range(5)
+        ))
+
+    runCommands(tmp_path, splitCommands(
+        ['sample_1.fastq', 'sample_2.fastq'],
+        2
+    ))
+
+    # The mates of a pair are in the same shard at the same position
+    for shard, reads in ((0, [0, 2, 4]), (1, [1, 3])):
+        for mate in (1, 2):
+            lines = (
+                tmp_path / SHARDS_DIR / f'{shard}_{mate}.fastq'
+            ).read_text().splitlines()
+            assert lines[::4] == [f'@read{read}/{mate}' for read in reads]
+
+
+def testMerge(tmp_path):
+    shards = tmp_path / SHARDS_DIR
+    shards.mkdir()
+    (tmp_path / 'reports').mkdir()
+    header = ('readID', 'seqID', 'taxID', 'score')
+
+    writeTable(shards / 'output_0.txt', [header, ('r0', 's1', 562, 10)])
+    writeTable(shards / 'output_1.txt', [header, ('r1', 's2', 590, 12)])
+    writeTable(shards / 'report_0.tsv', [
+        REPORT_COLUMNS,
+        ('Escherichia coli', 562, 'species', 5000, 30, 20, 0.6),
+        ('Salmonella', 590, 'genus', 0, 10, 5, 0.4)
+    ])
+    writeTable(shards / 'report_1.tsv', [
+        REPORT_COLUMNS,
+        ('Salmonella', 590, 'genus', 0, 20, 15, 0.5),
+        ('Escherichia coli', 562, 'species', 5000, 10, 5, 0.2),
+        ('Viruses', 10239, 'superkingdom', 0, 5, 5, 0.3)
+    ])
+
+    runCommands(tmp_path, mergeCommands(2))
+
+    output = (tmp_path / 'reports' / 'centrifuge_output.txt').read_text()
+    assert output.splitlines() == [
+        'readID\tseqID\ttaxID\tscore',
+        'r0\ts1\t562\t10',
+        'r1\ts2\t590\t12'
+    ]
+
+    # Reads summed and abundances averaged, in order of appearance
+    report = (tmp_path / 'centrifuge_report.tsv').read_text()
+    assert [line.split('\t') for line in report.splitlines()] == [
+        list(REPORT_COLUMNS),
+        ['Escherichia coli', '562', 'species', '5000', '40', '25', '0.4'],
+        ['Salmonella', '590', 'genus', '0', '30', '20', '0.45'],
+        ['Viruses', '10239', 'superkingdom', '0', '5', '5', '0.15']
+    ]
+
+    # The shards are removed, the missing taxonomy leaves no tree
+    assert not shards.exists()
+    assert not (tmp_path / TREE_FILE).exists()
+
+
+def testMergeMissingShard(tmp_path):
+    shards = tmp_path / SHARDS_DIR
+    shards.mkdir()
+    writeTable(shards / 'output_0.txt', [('readID',)])
+    writeTable(shards / 'report_0.tsv', [REPORT_COLUMNS])
+
+    result = subprocess.run(
+        ['bash', '-c', mergeCommands(2)],
+        cwd=tmp_path
+    )
+
+    assert result.returncode != 0
+    assert not (tmp_path / 'centrifuge_report.tsv').exists()
@@ -0,0 +1,173 @@
+import random
+
+from pyscripts.taxonomy_report import (
+    RANK_LEVELS,
+    REPORT_COLUMNS,
+    UNRANKED,
+    TaxonomyReport
+)
+
+
+# Ranks of the taxa of the random trees, by depth
+TREE_RANKS = (
+    'superkingdom',
+    'phylum',
+    'class',
+    'order',
+    'family',
+    'genus',
+    'species',
+    'subspecies',
+    'strain'
+)
+
+
+def writeReport(directory, rows: list) -> str:
+    """Write a centrifuge_report.tsv file and return its path.
+
+    :param directory: Directory of the file.
+    :param rows: Array of the rows, as tuples of the REPORT_COLUMNS.
+    """
+    path = directory / 'centrifuge_report.tsv'
+    lines = [REPORT_COLUMNS] + rows
+    path.write_text(''.join(
+        '\t'.join(str(field) for field in line) + '\n' for line in lines
+    ))
+
+    return str(path)
+
+
+def testHeaderOnlyReport(tmp_path):
+    # A sample without classified reads gives a report without taxa
+    report = TaxonomyReport.fromTSV(writeReport(tmp_path, []))
+
+    assert len(report.tax_id) == 0
+    assert len(report.name) == 0
+    assert report.num_reads.dtype.kind == 'i'
+    assert report.abundance.dtype.kind == 'f'
+
+    report.save(str(tmp_path / 'columns'))
+    loaded = TaxonomyReport.load(str(tmp_path / 'columns'))
+    assert len(loaded.tax_id) == 0
+    assert len(loaded.name) == 0
+
+
+def testReport(tmp_path):
+    report = TaxonomyReport.fromTSV(writeReport(tmp_path, [
+        ('Viruses', 10239, 'superkingdom', 0, 12, 3, 0.0),
+        ('Escherichia coli', 562, 'species', 5000000, 40, 35, 0.75)
+    ]))
+
+    assert report.tax_id.tolist() == [10239, 562]
+    assert report.name.tolist() == ['Viruses', 'Escherichia coli']
+    assert report.num_unique_reads.tolist() == [3, 35]
+    assert report.abundance.tolist() == [0.0, 0.75]
+
+
+def randomTree(size: int, seed: int) -> dict:
+    """Build a random taxonomy tree and return the parent taxID of every
+    taxID, the root (taxID 1) being its own parent.
+
+    :param size: Number of taxa.
+    :param seed: Seed of the random generator.
+    """
+    generator = random.Random(seed)
+    parents = {1: 1}
+    inner = [1]
+
+    for tax_id in range(2, size + 1):
+        # Among the last taxa which may have children, for deep trees
+        parent = generator.choice(inner[-50:])
+        parents[tax_id] = parent
+        if depth(parents, tax_id) < len(TREE_RANKS) - 1:
+            inner.append(tax_id)
+
+    return parents
+
+
+def depth(parents: dict, tax_id: int) -> int:
+    """Get the depth of a taxon in a tree.
+
+    :param parents: The parent taxID of every taxID.
+    :param tax_id: The taxID.
+    """
+    levels = 0
+    while parents[tax_id] != tax_id:
+        tax_id = parents[tax_id]
+        levels += 1
+
+    return levels
+
+
+def testLinkParents(tmp_path):
+    parents = randomTree(300, seed=1)
+    taxa = sorted(random.Random(2).sample(sorted(parents), 120))
+
+    # Centrifuge sorts the report by taxID
+    report = TaxonomyReport.fromTSV(writeReport(tmp_path, [
+        (f'taxon {tax_id}', tax_id, TREE_RANKS[depth(parents, tax_id)],
+         0, 1, 1, 0.0)
+        for tax_id in taxa
+    ]))
+
+    # The nearest ancestor in the report, walking up the whole tree for
+    # every row
+    expected = []
+    for tax_id in taxa:
+        node = tax_id
+        while parents[node] != node and parents[node] not in taxa:
+            node = parents[node]
+        expected.append(
+            taxa.index(parents[node]) if parents[node] != node else -1
+        )
+
+    assert report.linkParents(parents).tolist() == expected
+
+
+def testInferParents(tmp_path):
+    parents = randomTree(300, seed=3)
+    children = {}
+    for tax_id, parent in parents.items():
+        if tax_id != parent:
+            children.setdefault(parent, []).append(tax_id)
+
+    # A report listing every taxon right after its ancestors, with some
+    # unranked taxa
+    order = []
+    stack = [1]
+    while stack:
+        tax_id = stack.pop()
+        order.append(tax_id)
+        stack.extend(reversed(children.get(tax_id, [])))
+    ranks = [
+        'no rank' if tax_id % 7 == 0 else TREE_RANKS[depth(parents, tax_id)]
+        for tax_id in order
+    ]
+    report = TaxonomyReport.fromTSV(writeReport(tmp_path, [
+        (f'taxon {tax_id}', tax_id, rank, 0, 1, 1, 0.0)
+        for tax_id, rank in zip(order, ranks)
+    ]))
+
+    # The last previous row of a higher rank, scanning back from every
+    # row
+    levels = [RANK_LEVELS.get(rank, UNRANKED) for rank in ranks]
+    expected = []
+    for position, level in enumerate(levels):
+        parent = -1
+        for previous in range(position - 1, -1, -1):
+            if levels[previous] != UNRANKED and (
+                level == UNRANKED or levels[previous] < level
+            ):
+                parent = previous
+                break
+        expected.append(parent)
+
+    assert report.inferParents().tolist() == expected
+
+    # The ranked taxa find their parent of the tree, unless unranked
+    inferred = report.inferParents().tolist()
+    for position, tax_id in enumerate(order):
+        parent = parents[tax_id]
+        if levels[position] != UNRANKED and parent != tax_id \
+                and parent % 7 != 0:
+            assert order[inferred[position]] == parent